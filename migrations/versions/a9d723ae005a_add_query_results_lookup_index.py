@@ -0,0 +1,39 @@
+"""Add a (data_source_id, query_hash, retrieved_at DESC) index to query_results.
+
+Revision ID: a9d723ae005a
+Revises: e5c7a4e2df4d
+Create Date: 2026-10-18 09:12:41.220318
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "a9d723ae005a"
+down_revision = "e5c7a4e2df4d"
+branch_labels = None
+depends_on = None
+
+
+INDEX_NAME = "query_results_data_source_id_query_hash_retrieved_at"
+
+
+def upgrade():
+    # query_results is usually the biggest table, so build the index without
+    # blocking writes (CONCURRENTLY can't run inside a transaction).
+    with op.get_context().autocommit_block():
+        op.create_index(
+            INDEX_NAME,
+            "query_results",
+            ["data_source_id", "query_hash", sa.text("retrieved_at DESC")],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            INDEX_NAME, table_name="query_results", postgresql_concurrently=True
+        )
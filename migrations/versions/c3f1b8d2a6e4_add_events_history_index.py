@@ -0,0 +1,36 @@
+"""Add an (action, object_type, created_at) index to events.
+
+Revision ID: c3f1b8d2a6e4
+Revises: a9d723ae005a
+Create Date: 2026-10-19 00:12:05.518730
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "c3f1b8d2a6e4"
+down_revision = "a9d723ae005a"
+branch_labels = None
+depends_on = None
+
+
+INDEX_NAME = "events_action_object_type_created_at"
+
+
+def upgrade():
+    # events grows with every page view, so build the index without blocking
+    # writes (CONCURRENTLY can't run inside a transaction).
+    with op.get_context().autocommit_block():
+        op.create_index(
+            INDEX_NAME,
+            "events",
+            ["action", "object_type", "created_at"],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index(INDEX_NAME, table_name="events", postgresql_concurrently=True)
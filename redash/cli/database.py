@@ -1,6 +1,6 @@
 import time
 
-from click import argument, option
+from click import Choice, argument, option
 from flask.cli import AppGroup
 from flask_migrate import stamp
 import sqlalchemy
@@ -164,3 +164,85 @@ def reencrypt(old_secret, new_secret, show_sql):
 
     data_sources.close()
     db.session.commit()
+
+
+@manager.command()
+@option(
+    "--to",
+    "target_format",
+    type=Choice(["columnar", "json"]),
+    default="columnar",
+    help="format to convert the query results to",
+)
+@option("--batch-size", default=100, help="number of query results per transaction")
+@option("--sleep", default=0.0, help="seconds to wait between batches")
+def convert_query_results(target_format, batch_size, sleep):
+    """Convert stored query results to the columnar (or back to the JSON) format.
+
+    Runs in small batches, each in its own transaction, so it can run while Redash
+    is serving traffic. Query results are never updated once stored, so rows written
+    while the conversion runs are either already in the target format or get
+    converted by a later batch."""
+    from redash import settings
+    from redash.models import db
+    from redash.utils import columnar, json_dumps, json_loads
+
+    _wait_for_db_connection(db)
+
+    def convert(data):
+        if not data:
+            return None
+
+        if target_format == "json":
+            return json_dumps(columnar.decode(data)) if columnar.is_columnar(data) else None
+
+        if columnar.is_columnar(data):
+            return None
+
+        try:
+            deserialized = json_loads(data)
+        except ValueError:
+            return None
+
+        if not isinstance(deserialized, dict):
+            return None
+
+        return columnar.encode(deserialized, settings.QUERY_RESULTS_COMPRESSION)
+
+    query_results = sqlalchemy.table(
+        "query_results", sqlalchemy.column("id"), sqlalchemy.column("data")
+    )
+
+    last_id = 0
+    converted = 0
+    while True:
+        batch = db.session.execute(
+            select([query_results.c.id, query_results.c.data])
+            .where(query_results.c.id > last_id)
+            .order_by(query_results.c.id)
+            .limit(batch_size)
+        ).fetchall()
+
+        if not batch:
+            break
+
+        for query_result_id, data in batch:
+            last_id = query_result_id
+            new_data = convert(data)
+            if new_data is None:
+                continue
+
+            db.session.execute(
+                query_results.update()
+                .where(query_results.c.id == query_result_id)
+                .values(data=new_data)
+            )
+            converted += 1
+
+        db.session.commit()
+        print("Converted {} query results (up to id {}).".format(converted, last_id))
+
+        if sleep:
+            time.sleep(sleep)
+
+    print("Done. Converted {} query results to {}.".format(converted, target_format))
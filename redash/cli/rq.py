@@ -3,7 +3,7 @@ import socket
 import sys
 import datetime
 
-from click import argument
+from click import argument, option
 from flask.cli import AppGroup
 from rq import Connection
 from rq.worker import WorkerStatus
@@ -11,8 +11,10 @@ from sqlalchemy.orm import configure_mappers
 from supervisor_checks import check_runner
 from supervisor_checks.check_modules import base
 
-from redash import rq_redis_connection
+from redash import rq_redis_connection, settings
 from redash.tasks import (
+    AsyncWorker,
+    PreforkWorker,
     Worker,
     rq_scheduler,
     schedule_periodic_jobs,
@@ -31,7 +33,12 @@ def scheduler():
 
 @manager.command()
 @argument("queues", nargs=-1)
-def worker(queues):
+@option(
+    "--prefork/--no-prefork",
+    default=settings.WORKER_PREFORK,
+    help="Run jobs in a long-lived work horse instead of forking one for each job.",
+)
+def worker(queues, prefork):
     # Configure any SQLAlchemy mappers loaded until now so that the mapping configuration
     # will already be available to the forked work horses and they won't need
     # to spend valuable time re-doing that on every fork.
@@ -39,10 +46,55 @@ def worker(queues):
     configure_mappers()
 
     if not queues:
-        queues = ["scheduled_queries", "queries", "periodic", "emails", "default", "schemas"]
+        queues = [
+            "scheduled_queries_fast",
+            "scheduled_queries",
+            "scheduled_queries_slow",
+            "queries_fast",
+            "queries",
+            "queries_slow",
+            "periodic",
+            "emails",
+            "default",
+            "schemas",
+        ]
+
+    with Connection(rq_redis_connection):
+        worker_class = PreforkWorker if prefork else Worker
+        w = worker_class(queues, log_job_description=False, job_monitoring_interval=5)
+        w.work()
+
+
+@manager.command()
+@argument("queues", nargs=-1)
+@option(
+    "--concurrency",
+    type=int,
+    default=settings.ASYNC_WORKER_CONCURRENCY,
+    help="Number of jobs to run at once.",
+)
+def async_worker(queues, concurrency):
+    """Run jobs of I/O-bound queries (of HTTP data sources) concurrently on an
+    event loop. Set the queues of those data sources to the worker's queues."""
+    configure_mappers()
+
+    if not queues:
+        queues = [
+            "scheduled_http_queries_fast",
+            "scheduled_http_queries",
+            "scheduled_http_queries_slow",
+            "http_queries_fast",
+            "http_queries",
+            "http_queries_slow",
+        ]
 
     with Connection(rq_redis_connection):
-        w = Worker(queues, log_job_description=False, job_monitoring_interval=5)
+        w = AsyncWorker(
+            queues,
+            log_job_description=False,
+            job_monitoring_interval=5,
+            concurrency=concurrency,
+        )
         w.work()
 
 
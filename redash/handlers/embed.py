@@ -16,6 +16,7 @@ from redash.security import csp_allows_embeding
 #@login_required  #ZZW
 @csp_allows_embeding
 def embed(query_id, visualization_id, org_slug=None):
+    models.query_result_reads.touch_query(query_id, current_org)
     record_event(
         current_org,
         current_user._get_current_object(),
@@ -2,12 +2,13 @@ import logging
 import time
 
 import unicodedata
-from flask import make_response, request
+from flask import Response, make_response, request, stream_with_context
 from flask_login import current_user
 from flask_restful import abort
 from werkzeug.urls import url_quote
 from redash import models, settings
 from redash.handlers.base import BaseResource, get_object_or_404, record_event
+from redash.result_cache import query_result_cache
 from redash.permissions import (
     has_access,
     not_view_only,
@@ -21,7 +22,6 @@ from redash.tasks.queries import enqueue_query
 from redash.utils import (
     collect_parameters_from_request,
     gen_query_hash,
-    json_dumps,
     utcnow,
     to_filename,
 )
@@ -32,9 +32,9 @@ from redash.models.parameterized_query import (
     dropdown_values,
 )
 from redash.serializers import (
-    serialize_query_result,
-    serialize_query_result_to_dsv,
-    serialize_query_result_to_xlsx,
+    serialize_query_result_to_json,
+    iter_query_result_dsv,
+    iter_query_result_xlsx,
     serialize_job,
 )
 
@@ -102,11 +102,11 @@ def run_query(query, parameters, data_source, query_id, max_age=0):
     )
 
     if query_result:
-        return {
-            "query_result": serialize_query_result(
-                query_result, current_user.is_api_user()
-            )
-        }
+        return make_response(
+            serialize_query_result_to_json(query_result, current_user.is_api_user()),
+            200,
+            {"Content-Type": "application/json"},
+        )
     else:
         job = enqueue_query(
             query.text,
@@ -366,6 +366,9 @@ class QueryResultResource(BaseResource):
 
         if query_result:
             require_access(query_result.data_source, self.current_user, view_only)
+            models.query_result_reads.touch(
+                query_result.data_source_id, query_result.query_hash
+            )
 
             if isinstance(self.current_user, models.ApiUser):
                 event = {
@@ -415,26 +418,49 @@ class QueryResultResource(BaseResource):
 
     @staticmethod
     def make_json_response(query_result):
-        data = json_dumps({"query_result": query_result.to_dict()})
         headers = {"Content-Type": "application/json"}
+
+        if not settings.QUERY_RESULTS_CACHE_ENABLED:
+            data = serialize_query_result_to_json(query_result, is_api_user=False)
+            return make_response(data, 200, headers)
+
+        payload = query_result_cache.get_or_set(
+            query_result.id,
+            lambda: serialize_query_result_to_json(
+                query_result, is_api_user=False
+            ).encode("utf-8"),
+        )
+        data, content_encoding = payload.body(
+            accept_gzip="gzip" in request.accept_encodings
+        )
+        if content_encoding:
+            headers["Content-Encoding"] = content_encoding
+        headers["Vary"] = "Accept-Encoding"
+
         return make_response(data, 200, headers)
 
     @staticmethod
     def make_csv_response(query_result):
         headers = {"Content-Type": "text/csv; charset=UTF-8"}
-        return make_response(serialize_query_result_to_dsv(query_result, ","), 200, headers)
+        return Response(
+            stream_with_context(iter_query_result_dsv(query_result, ",")), 200, headers
+        )
 
     @staticmethod
     def make_tsv_response(query_result):
         headers = {"Content-Type": "text/tab-separated-values; charset=UTF-8"}
-        return make_response(serialize_query_result_to_dsv(query_result, "\t"), 200, headers)
+        return Response(
+            stream_with_context(iter_query_result_dsv(query_result, "\t")), 200, headers
+        )
 
     @staticmethod
     def make_excel_response(query_result):
         headers = {
             "Content-Type": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
         }
-        return make_response(serialize_query_result_to_xlsx(query_result), 200, headers)
+        return Response(
+            stream_with_context(iter_query_result_xlsx(query_result)), 200, headers
+        )
 
 
 class JobResource(BaseResource):
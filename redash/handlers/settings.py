@@ -1,4 +1,5 @@
 from flask import request
+from flask_restful import abort
 
 from redash.models import db, Organization
 from redash.handlers.base import BaseResource, record_event
@@ -39,6 +40,12 @@ class OrganizationSettings(BaseResource):
         if self.current_org.settings.get("settings") is None:
             self.current_org.settings["settings"] = {}
 
+        # The organization's share of the query queues is up to the super admins.
+        if "queue_weight" in new_values and not self.current_user.has_permission(
+            "super_admin"
+        ):
+            abort(403)
+
         previous_values = {}
         for k, v in new_values.items():
             if k == "auth_google_apps_domains":
@@ -1,15 +1,26 @@
 import datetime
 import calendar
 import logging
+import math
 import time
 import numbers
+import zlib
 import pytz
 
+from funcy import chunks
+
 from sqlalchemy import distinct, or_, and_, UniqueConstraint
 from sqlalchemy.dialects import postgresql
 from sqlalchemy.event import listens_for
 from sqlalchemy.ext.hybrid import hybrid_property
-from sqlalchemy.orm import backref, contains_eager, joinedload, subqueryload, load_only
+from sqlalchemy.orm import (
+    Session,
+    backref,
+    contains_eager,
+    joinedload,
+    subqueryload,
+    load_only,
+)
 from sqlalchemy.orm.exc import NoResultFound  # noqa: F401
 from sqlalchemy import func
 from sqlalchemy_utils import generic_relationship
@@ -31,6 +42,7 @@ from redash.query_runner import (
     TYPE_DATETIME,
 )
 from redash.utils import (
+    columnar,
     generate_token,
     json_dumps,
     json_loads,
@@ -63,11 +75,27 @@ class ScheduledQueriesExecutions(object):
     def __init__(self):
         self.executions = {}
 
-    def refresh(self):
-        self.executions = redis_connection.hgetall(self.KEY_NAME)
+    def refresh(self, query_ids=None):
+        if query_ids is None:
+            self.executions = redis_connection.hgetall(self.KEY_NAME)
+            return
+
+        query_ids = [str(query_id) for query_id in query_ids]
+        timestamps = (
+            redis_connection.hmget(self.KEY_NAME, query_ids) if query_ids else []
+        )
+        self.executions = {
+            query_id: timestamp
+            for query_id, timestamp in zip(query_ids, timestamps)
+            if timestamp is not None
+        }
 
     def update(self, query_id):
-        redis_connection.hmset(self.KEY_NAME, {query_id: time.time()})
+        pipe = redis_connection.pipeline()
+        pipe.hmset(self.KEY_NAME, {query_id: time.time()})
+        # The next run is counted from this execution now.
+        scheduled_queries_next_runs.invalidate(query_id, pipe=pipe)
+        pipe.execute()
 
     def get(self, query_id):
         timestamp = self.executions.get(str(query_id))
@@ -80,6 +108,195 @@ class ScheduledQueriesExecutions(object):
 scheduled_queries_executions = ScheduledQueriesExecutions()
 
 
+class ScheduledQueriesNextRuns(object):
+    """
+    Scheduled queries scored by the time they're due to run next, so
+    Query.outdated_queries only has to look at the queries that are due instead
+    of every scheduled query. A query is invalidated (given a score in the past)
+    whenever its schedule, failures or executions change, which makes the next
+    refresh re-evaluate it and store its new next run.
+    """
+
+    KEY_NAME = "sq:next_run_at"
+    BUILT_KEY_NAME = "sq:next_run_at:built"
+
+    # Store the next runs of the evaluated queries, unless a query was
+    # invalidated (its score changed) while it was being evaluated.
+    UPDATE_SCRIPT = """
+    for i = 1, #ARGV, 3 do
+        if redis.call('ZSCORE', KEYS[1], ARGV[i]) == ARGV[i + 1] then
+            if ARGV[i + 2] == '' then
+                redis.call('ZREM', KEYS[1], ARGV[i])
+            else
+                redis.call('ZADD', KEYS[1], ARGV[i + 2], ARGV[i])
+            end
+        end
+    end
+    """
+
+    def __init__(self):
+        self.update_script = redis_connection.register_script(self.UPDATE_SCRIPT)
+
+    def ensure_built(self):
+        if redis_connection.exists(self.BUILT_KEY_NAME):
+            return
+
+        query_ids = [
+            query_id
+            for (query_id,) in db.session.query(Query.id).filter(
+                Query.schedule.isnot(None)
+            )
+        ]
+        for chunk in chunks(10000, query_ids):
+            redis_connection.zadd(self.KEY_NAME, {query_id: 0 for query_id in chunk})
+        redis_connection.set(self.BUILT_KEY_NAME, 1)
+
+    def due(self, now):
+        """Returns {query_id: score} of the queries due at `now`."""
+        due = redis_connection.zrangebyscore(
+            self.KEY_NAME, "-inf", now.timestamp(), withscores=True, score_cast_func=str
+        )
+        return {int(query_id): score for query_id, score in due}
+
+    def update(self, next_runs, scores):
+        """Store the next runs ({query_id: datetime or None}) of queries read
+        with `due`; queries that won't run again (None) are dropped."""
+        args = []
+        for query_id, next_run in next_runs.items():
+            args.extend(
+                [
+                    query_id,
+                    scores[query_id],
+                    next_run.timestamp() if next_run is not None else "",
+                ]
+            )
+
+        for chunk in chunks(3000, args):
+            self.update_script(keys=[self.KEY_NAME], args=chunk)
+
+    def invalidate(self, query_id, pipe=None):
+        # Every invalidation gets a distinct score, so `update` can tell it apart
+        # from the score the query had when it was evaluated.
+        (pipe or redis_connection).zadd(self.KEY_NAME, {query_id: -time.time()})
+
+    def remove(self, query_id):
+        redis_connection.zrem(self.KEY_NAME, query_id)
+
+
+scheduled_queries_next_runs = ScheduledQueriesNextRuns()
+
+
+class QueryResultReads(object):
+    """
+    When the results of each query (by data source and query hash) were last read,
+    for the adaptive refresh of scheduled queries. Queries without reads count as
+    read when the tracking started.
+
+    Reads only matter by the day, so each process records the reads of a result
+    once every TOUCH_INTERVAL seconds at most. The first read of the results of a
+    cold (backed off) query invalidates its next run, so the next refresh brings it
+    back to its regular schedule.
+    """
+
+    KEY_NAME = "query_results:read_at"
+    SINCE_KEY_NAME = "query_results:read_at:since"
+    COLD_KEY_NAME = "query_results:cold"
+    TOUCH_INTERVAL = 60
+
+    # KEYS: read at, since, cold, next runs
+    # ARGV: result key, now
+    TOUCH_SCRIPT = """
+    redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+    redis.call('SET', KEYS[2], ARGV[2], 'NX')
+    local query_ids = redis.call('HGET', KEYS[3], ARGV[1])
+    if query_ids then
+        redis.call('HDEL', KEYS[3], ARGV[1])
+        for query_id in string.gmatch(query_ids, '[^,]+') do
+            redis.call('ZADD', KEYS[4], 'XX', -tonumber(ARGV[2]), query_id)
+        end
+    end
+    """
+
+    def __init__(self):
+        self.touch_script = redis_connection.register_script(self.TOUCH_SCRIPT)
+        self._touched = {}
+
+    def _key(self, data_source_id, query_hash):
+        return "{}:{}".format(data_source_id, query_hash)
+
+    def touch(self, data_source_id, query_hash):
+        key = self._key(data_source_id, query_hash)
+        now = time.time()
+        if now - self._touched.get(key, 0) < self.TOUCH_INTERVAL:
+            return
+
+        if len(self._touched) >= 10000:
+            self._touched.clear()
+        self._touched[key] = now
+        self.touch_script(
+            keys=[
+                self.KEY_NAME,
+                self.SINCE_KEY_NAME,
+                self.COLD_KEY_NAME,
+                ScheduledQueriesNextRuns.KEY_NAME,
+            ],
+            args=[key, now],
+        )
+
+    def forget_touches(self):
+        """Records the next read of each result, however recent the last one was."""
+        self._touched.clear()
+
+    def touch_query(self, query_id, org):
+        """Marks the results of the query as read, without loading the query."""
+        query = (
+            db.session.query(Query.data_source_id, Query.query_hash)
+            .filter(Query.id == query_id, Query.org == org)
+            .first()
+        )
+        if query is not None:
+            self.touch(*query)
+
+    def read_at(self, queries):
+        """When the results of each of the queries (by their id) were last read,
+        by their query text or the text their latest result ran."""
+        keys = [
+            self._key(query.data_source_id, query_hash)
+            for query in queries
+            for query_hash in (query.query_hash, query.latest_query_data.query_hash)
+        ]
+        if not keys:
+            return {}
+
+        pipe = redis_connection.pipeline(transaction=False)
+        pipe.set(self.SINCE_KEY_NAME, time.time(), nx=True)
+        pipe.get(self.SINCE_KEY_NAME)
+        pipe.hmget(self.KEY_NAME, keys)
+        _, since, timestamps = pipe.execute()
+
+        read_at = {}
+        for i, query in enumerate(queries):
+            timestamp = max(float(t or 0) for t in timestamps[2 * i : 2 * i + 2])
+            read_at[query.id] = utils.dt_from_timestamp(max(timestamp, float(since)))
+
+        return read_at
+
+    def mark_cold(self, queries):
+        """Remembers the cold queries, for a read of their results (by their query
+        text or the text their latest result ran) to invalidate their next runs."""
+        cold = {}
+        for query in queries:
+            for query_hash in {query.query_hash, query.latest_query_data.query_hash}:
+                key = self._key(query.data_source_id, query_hash)
+                cold[key] = ",".join(filter(None, [cold.get(key), str(query.id)]))
+
+        if cold:
+            redis_connection.hmset(self.COLD_KEY_NAME, cold)
+
+
+query_result_reads = QueryResultReads()
+
+
 @generic_repr("id", "name", "type", "org_id", "created_at")
 class DataSource(BelongsToOrgMixin, db.Model):
     id = Column(db.Integer, primary_key=True)
@@ -232,6 +449,30 @@ class DataSource(BelongsToOrgMixin, db.Model):
     def resume(self):
         redis_connection.delete(self._pause_key)
 
+    @property
+    def concurrency_limit(self):
+        return int(self.options.get("concurrency_limit") or 0)
+
+    @property
+    def fast_query_threshold(self):
+        return float(self.options.get("fast_query_threshold") or 0)
+
+    @property
+    def slow_query_threshold(self):
+        return float(self.options.get("slow_query_threshold") or 0)
+
+    @property
+    def memory_limit(self):
+        return int(self.options.get("memory_limit") or 0)
+
+    @property
+    def max_result_rows(self):
+        return int(self.options.get("max_result_rows") or 0)
+
+    @property
+    def max_result_bytes(self):
+        return int(self.options.get("max_result_bytes") or 0)
+
     def add_group(self, group, view_only=False):
         dsg = DataSourceGroup(group=group, data_source=self, view_only=view_only)
         db.session.add(dsg)
@@ -299,9 +540,83 @@ class DBPersistence(object):
             delattr(self, DESERIALIZED_DATA_ATTR)
         self._data = data
 
+    @property
+    def serialized_data(self):
+        """The data as JSON text. Persistence classes that store it in another
+        format need to override this."""
+        if self._data is None or not isinstance(self._data, str):
+            return json_dumps(self.data)
+
+        return self._data
+
+    @property
+    def lazy_data(self):
+        """Like `data`, but the rows may be an iterator that decodes them as they
+        are consumed (so they can only be iterated once)."""
+        return self.data
+
+
+class ColumnarPersistence(DBPersistence):
+    """Stores the data column-wise and compressed (see `redash.utils.columnar`).
+
+    Results stored in the JSON format are still readable, so existing rows can be
+    converted online with `manage.py database convert_query_results`. Streamed
+    results are encoded from their rows as they arrive (see `StreamedResult`), and
+    other results are converted from their JSON when they're set.
+    """
+
+    @property
+    def data(self):
+        if self._data is None:
+            return None
+
+        if not hasattr(self, DESERIALIZED_DATA_ATTR):
+            setattr(self, DESERIALIZED_DATA_ATTR, columnar.loads(self._data))
+
+        return self._deserialized_data
+
+    @data.setter
+    def data(self, data):
+        if hasattr(self, DESERIALIZED_DATA_ATTR):
+            delattr(self, DESERIALIZED_DATA_ATTR)
+
+        if isinstance(data, str) and data and not columnar.is_columnar(data):
+            try:
+                deserialized = json_loads(data)
+            except ValueError:
+                deserialized = None
+
+            if isinstance(deserialized, dict):
+                data = columnar.encode(deserialized, settings.QUERY_RESULTS_COMPRESSION)
+                setattr(self, DESERIALIZED_DATA_ATTR, deserialized)
+
+        self._data = data
+
+    @property
+    def serialized_data(self):
+        if columnar.is_columnar(self._data):
+            return json_dumps(self.data)
+
+        return super(ColumnarPersistence, self).serialized_data
+
+    @property
+    def lazy_data(self):
+        if columnar.is_columnar(self._data) and not hasattr(
+            self, DESERIALIZED_DATA_ATTR
+        ):
+            return columnar.decode(self._data, lazy_rows=True)
+
+        return self.data
+
+
+query_result_persistence_formats = {
+    "json": DBPersistence,
+    "columnar": ColumnarPersistence,
+}
 
 QueryResultPersistence = (
-    settings.dynamic_settings.QueryResultPersistence or DBPersistence
+    settings.dynamic_settings.QueryResultPersistence
+    or query_result_persistence_formats[settings.QUERY_RESULTS_STORAGE_FORMAT]
 )
 
 
@@ -319,21 +634,33 @@ class QueryResult(db.Model, QueryResultPersistence, BelongsToOrgMixin):
     retrieved_at = Column(db.DateTime(True)) #utc time
 
     __tablename__ = "query_results"
+    __table_args__ = (
+        db.Index(
+            "query_results_data_source_id_query_hash_retrieved_at",
+            data_source_id,
+            query_hash,
+            retrieved_at.desc(),
+        ),
+    )
 
     def __str__(self):
         return "%d | %s | %s" % (self.id, self.query_hash, self.retrieved_at)
 
-    def to_dict(self):
-        return {
+    def to_dict(self, with_data=True):
+        d = {
             "id": self.id,
             "query_hash": self.query_hash,
             "query": self.query_text,
-            "data": self.data,
             "data_source_id": self.data_source_id,
             "runtime": self.runtime,
             "retrieved_at": self.retrieved_at,
         }
 
+        if with_data:
+            d["data"] = self.data
+
+        return d
+
     @classmethod
     def unused(cls, days=7):
         age_threshold = datetime.datetime.now() - datetime.timedelta(days=days)
@@ -355,11 +682,9 @@ class QueryResult(db.Model, QueryResultPersistence, BelongsToOrgMixin):
             query = cls.query.filter(
                 cls.query_hash == query_hash,
                 cls.data_source == data_source,
-                (
-                    db.func.timezone("utc", cls.retrieved_at)
-                    + datetime.timedelta(seconds=max_age)
-                    >= db.func.timezone("utc", db.func.now())
-                ),
+                # Keep retrieved_at bare so the composite index can be used:
+                cls.retrieved_at
+                >= db.func.now() - datetime.timedelta(seconds=max_age),
             )
 
         return query.order_by(cls.retrieved_at.desc()).first()
@@ -388,9 +713,45 @@ class QueryResult(db.Model, QueryResultPersistence, BelongsToOrgMixin):
         return self.data_source.groups
 
 
+def scheduled_query_shard(query_id, shards):
+    """The shard (of `shards`) the scheduled query is refreshed in."""
+    return zlib.crc32(str(query_id).encode()) % shards
+
+
+def adaptive_next_run(previous_iteration, next_iteration, read_at, now):
+    """
+    When a scheduled query of an organization with adaptive refresh runs, given
+    its regular next run: queries whose results weren't read for
+    ADAPTIVE_REFRESH_COLD_AFTER seconds run ADAPTIVE_REFRESH_STRETCH times less
+    often, and not at all (None) after ADAPTIVE_REFRESH_PAUSE_AFTER seconds.
+    """
+    unread = (now - read_at).total_seconds()
+    if unread < settings.ADAPTIVE_REFRESH_COLD_AFTER:
+        return next_iteration
+
+    if settings.ADAPTIVE_REFRESH_PAUSE_AFTER and (
+        unread >= settings.ADAPTIVE_REFRESH_PAUSE_AFTER
+    ):
+        return None
+
+    return next_iteration + (next_iteration - previous_iteration) * (
+        settings.ADAPTIVE_REFRESH_STRETCH - 1
+    )
+
+
 def should_schedule_next(
     previous_iteration, now, interval, time=None, day_of_week=None, failures=0
 ):
+    next_iteration = next_scheduled_run(
+        previous_iteration, interval, time, day_of_week, failures
+    )
+    return next_iteration is not None and now > next_iteration
+
+
+def next_scheduled_run(
+    previous_iteration, interval, time=None, day_of_week=None, failures=0
+):
+    """The time after which a schedule is due again, or None if it never is."""
     # if time exists then interval > 23 hours (82800s)
     # if day_of_week exists then interval > 6 days (518400s)
     if time is None:
@@ -431,8 +792,32 @@ def should_schedule_next(
         try:
             next_iteration += datetime.timedelta(minutes=2 ** failures)
         except OverflowError:
-            return False
-    return now > next_iteration
+            return None
+    return next_iteration
+
+
+# refresh_queries runs every 30 seconds, so a query runs up to this many seconds
+# after it's due (more when it waits in its queue).
+SPREAD_TOLERANCE = 60
+
+
+def spread_scheduled_run(query_id, next_run, interval):
+    """
+    Moves the next run of a query with only an interval to the query's own point of
+    a cycle of up to SCHEDULED_QUERIES_SPREAD_WINDOW seconds (one its interval is a
+    multiple of), so queries that ran together don't keep running together. It's
+    the last point up to SPREAD_TOLERANCE seconds after the run, so a query that
+    ran at its point is due at its point again an interval later, however late it
+    ran, and a query is never due more than SPREAD_TOLERANCE seconds late.
+    """
+    window = settings.SCHEDULED_QUERIES_SPREAD_WINDOW
+    if not window or next_run is None:
+        return next_run
+
+    cycle = math.gcd(int(interval), window)
+    point = zlib.crc32(str(query_id).encode()) % cycle
+    latest = int(next_run.timestamp()) + SPREAD_TOLERANCE
+    return utils.dt_from_timestamp(latest - (latest - point) % cycle)
 
 
 @gfk_type
@@ -616,54 +1001,129 @@ class Query(ChangeTrackingMixin, TimestampMixin, BelongsToOrgMixin, db.Model):
             <= now
         ]
 
-    @classmethod
-    def outdated_queries(cls):
-        queries = (
-            Query.query.options(
-                joinedload(Query.latest_query_data).load_only("retrieved_at")
-            )
-            .filter(Query.schedule.isnot(None))
-            .order_by(Query.id)
+    def next_run(self, previous_iteration):
+        """When the query is due after running at `previous_iteration`, or None if
+        it never is."""
+        next_run = next_scheduled_run(
+            previous_iteration,
+            self.schedule["interval"],
+            self.schedule["time"],
+            self.schedule["day_of_week"],
+            self.schedule_failures,
         )
+        if self.schedule["time"] is None:
+            next_run = spread_scheduled_run(
+                self.id, next_run, self.schedule["interval"]
+            )
+        return next_run
+
+    @classmethod
+    def outdated_queries(cls, shard=0, shards=1):
+        scheduled_queries_next_runs.ensure_built()
 
         now = utils.utcnow()
+        due = scheduled_queries_next_runs.due(now)
+        if shards > 1:
+            due = {
+                query_id: score
+                for query_id, score in due.items()
+                if scheduled_query_shard(query_id, shards) == shard
+            }
         outdated_queries = {}
-        scheduled_queries_executions.refresh()
+        next_runs = {}
+        cold_queries = []
+        scheduled_queries_executions.refresh(due.keys())
+
+        for query_ids in chunks(1000, sorted(due)):
+            queries = (
+                Query.query.options(
+                    joinedload(Query.latest_query_data).load_only(
+                        "retrieved_at", "query_hash", "runtime"
+                    )
+                )
+                .filter(Query.schedule.isnot(None), Query.id.in_(query_ids))
+                .order_by(Query.id)
+                .all()
+            )
+            read_at = query_result_reads.read_at(
+                [
+                    query
+                    for query in queries
+                    if query.latest_query_data is not None
+                    and query.org.get_setting("adaptive_refresh")
+                ]
+            )
 
-        for query in queries:
-            try:
-                if query.schedule.get("disabled"):
-                    continue
+            # Queries that were deleted or unscheduled are dropped.
+            next_runs.update(dict.fromkeys(query_ids))
+
+            for query in queries:
+                try:
+                    if query.schedule.get("disabled"):
+                        continue
+
+                    schedule_until = None
+                    if query.schedule["until"]:
+                        schedule_until = pytz.utc.localize(
+                            datetime.datetime.strptime(
+                                query.schedule["until"], "%Y-%m-%d"
+                            )
+                        )
 
-                if query.schedule["until"]:
-                    schedule_until = pytz.utc.localize(
-                        datetime.datetime.strptime(query.schedule["until"], "%Y-%m-%d")
+                        if schedule_until <= now:
+                            continue
+
+                    retrieved_at = scheduled_queries_executions.get(query.id) or (
+                        query.latest_query_data and query.latest_query_data.retrieved_at
                     )
 
-                    if schedule_until <= now:
+                    next_run = query.next_run(retrieved_at or now)
+                    if next_run is not None and now > next_run:
+                        if query.id in read_at and retrieved_at is not None:
+                            run_at = adaptive_next_run(
+                                retrieved_at, next_run, read_at[query.id], now
+                            )
+                            if run_at is None or run_at > now:
+                                # Cold queries are checked again after their
+                                # regular interval, in case they're read by then.
+                                check_at = now + (next_run - retrieved_at)
+                                next_runs[query.id] = min(run_at or check_at, check_at)
+                                cold_queries.append(query)
+                                continue
+
+                        key = "{}:{}".format(query.query_hash, query.data_source_id)
+                        outdated_queries[key] = query
+                        # It stays due until its execution invalidates it.
+                        del next_runs[query.id]
                         continue
 
-                retrieved_at = scheduled_queries_executions.get(query.id) or (
-                    query.latest_query_data and query.latest_query_data.retrieved_at
-                )
-
-                if should_schedule_next(
-                    retrieved_at or now,
-                    now,
-                    query.schedule["interval"],
-                    query.schedule["time"],
-                    query.schedule["day_of_week"],
-                    query.schedule_failures,
-                ):
-                    key = "{}:{}".format(query.query_hash, query.data_source_id)
-                    outdated_queries[key] = query
-            except Exception as e:
-                query.schedule["disabled"] = True
-                db.session.commit()
-
-                message = "Could not determine if query %d is outdated due to %s. The schedule for this query has been disabled." % (query.id, repr(e))
-                logging.info(message)
-                sentry.capture_message(message)
+                    # Queries that never ran aren't due until they do.
+                    if retrieved_at is not None:
+                        if schedule_until is None or (
+                            next_run is not None and next_run < schedule_until
+                        ):
+                            next_runs[query.id] = next_run
+                except Exception as e:
+                    query.schedule["disabled"] = True
+                    db.session.commit()
+
+                    message = "Could not determine if query %d is outdated due to %s. The schedule for this query has been disabled." % (query.id, repr(e))
+                    logging.info(message)
+                    sentry.capture_message(message)
+
+        scheduled_queries_next_runs.update(next_runs, due)
+        query_result_reads.mark_cold(cold_queries)
+
+        if cold_queries:
+            # How much refresh work adaptive refresh saved (runtime in seconds).
+            pipe = redis_connection.pipeline(transaction=False)
+            pipe.hincrby("redash:status", "cold_queries_skipped", len(cold_queries))
+            pipe.hincrbyfloat(
+                "redash:status",
+                "cold_queries_runtime_saved",
+                sum(query.latest_query_data.runtime or 0 for query in cold_queries),
+            )
+            pipe.execute()
 
         return list(outdated_queries.values())
 
@@ -856,6 +1316,41 @@ def query_last_modified_by(target, val, oldval, initiator):
     target.last_modified_by_id = val
 
 
+@listens_for(Query, "after_insert")
+@listens_for(Query, "after_update")
+def collect_changed_schedule(mapper, connection, target):
+    state = db.inspect(target)
+    changed = any(
+        state.attrs[attr].history.has_changes()
+        for attr in (
+            "schedule",
+            "schedule_failures",
+            "latest_query_data",
+            "latest_query_data_id",
+        )
+    )
+    if changed:
+        state.session.info.setdefault("changed_schedules", {})[target.id] = (
+            target.schedule is not None
+        )
+
+
+# Next runs are invalidated once the changes are committed: a refresh before that
+# would read the old schedule and store its next run again.
+@listens_for(Session, "after_commit")
+def invalidate_next_scheduled_runs(session):
+    for query_id, scheduled in session.info.pop("changed_schedules", {}).items():
+        if scheduled:
+            scheduled_queries_next_runs.invalidate(query_id)
+        else:
+            scheduled_queries_next_runs.remove(query_id)
+
+
+@listens_for(Session, "after_rollback")
+def forget_changed_schedules(session):
+    session.info.pop("changed_schedules", None)
+
+
 @generic_repr("id", "object_type", "object_id", "user_id", "org_id")
 class Favorite(TimestampMixin, db.Model):
     id = Column(db.Integer, primary_key=True)
@@ -1231,6 +1726,14 @@ class Event(db.Model):
     created_at = Column(db.DateTime(True), default=db.func.now())
 
     __tablename__ = "events"
+    __table_args__ = (
+        db.Index(
+            "events_action_object_type_created_at",
+            "action",
+            "object_type",
+            "created_at",
+        ),
+    )
 
     def __str__(self):
         return "%s,%s,%s,%s" % (
@@ -1,5 +1,7 @@
+import contextvars
 import functools
 
+from flask import _app_ctx_stack
 from flask_sqlalchemy import BaseQuery, SQLAlchemy
 from sqlalchemy.orm import object_session
 from sqlalchemy.pool import NullPool
@@ -22,7 +24,22 @@ class RedashSQLAlchemy(SQLAlchemy):
             options.pop("max_overflow", None)
 
 
-db = RedashSQLAlchemy(session_options={"expire_on_commit": False})
+# Scope of the database session, for code that shares its thread with other code
+# that uses the session (like the jobs of the async worker, which share its event
+# loop). Without one, the session is per app context, like Flask-SQLAlchemy's.
+session_scope = contextvars.ContextVar("session_scope", default=None)
+
+
+def _session_scopefunc():
+    scope = session_scope.get()
+    if scope is not None:
+        return scope
+    return _app_ctx_stack.__ident_func__()
+
+
+db = RedashSQLAlchemy(
+    session_options={"expire_on_commit": False, "scopefunc": _session_scopefunc}
+)
 # Make sure the SQLAlchemy mappers are all properly configured first.
 # This is required by SQLAlchemy-Searchable as it adds DDL listeners
 # on the configuration phase of models.
@@ -5,9 +5,9 @@ from sqlalchemy import union_all
 from redash import redis_connection, rq_redis_connection, __version__, settings
 from redash.models import db, DataSource, Query, QueryResult, Dashboard, Widget
 from redash.utils import json_loads
-from rq import Queue, Worker
-from rq.job import Job
+from rq import Worker
 from rq.registry import StartedJobRegistry
+from redash.tasks.worker import Job, Queue
 
 
 def get_redis_status():
@@ -1,12 +1,19 @@
+import asyncio
 import logging
+from contextvars import ContextVar
 
 from dateutil import parser
 import requests
 
 from redash import settings
-from redash.utils import json_dumps, json_loads
+from redash.utils import JSONEncoder, json_dumps, json_loads
 from rq.timeouts import JobTimeoutException
 
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
 logger = logging.getLogger(__name__)
 
 __all__ = [
@@ -14,6 +21,8 @@ __all__ = [
     "BaseHTTPQueryRunner",
     "InterruptException",
     "JobTimeoutException",
+    "MemoryLimitExceeded",
+    "ResultTooLarge",
     "BaseSQLQueryRunner",
     "TYPE_DATETIME",
     "TYPE_BOOLEAN",
@@ -40,11 +49,54 @@ SUPPORTED_COLUMN_TYPES = set(
     [TYPE_INTEGER, TYPE_FLOAT, TYPE_BOOLEAN, TYPE_STRING, TYPE_DATETIME, TYPE_DATE]
 )
 
+# Options every data source has (see `with_execution_options`).
+EXECUTION_OPTIONS = {
+    "concurrency_limit": {
+        "type": "number",
+        "title": "Concurrent Queries Limit (0 for no limit)",
+        "default": 0,
+    },
+    "fast_query_threshold": {
+        "type": "number",
+        "title": "Fast Lane Runtime Threshold (seconds, 0 to disable)",
+        "default": 0,
+    },
+    "slow_query_threshold": {
+        "type": "number",
+        "title": "Slow Lane Runtime Threshold (seconds, 0 to disable)",
+        "default": 0,
+    },
+    "memory_limit": {
+        "type": "number",
+        "title": "Worker Memory Limit per Query (MB, 0 for the queue's limit)",
+        "default": 0,
+    },
+    "max_result_rows": {
+        "type": "number",
+        "title": "Result Rows Limit (0 for the default limit)",
+        "default": 0,
+    },
+    "max_result_bytes": {
+        "type": "number",
+        "title": "Result Size Limit (bytes, 0 for the default limit)",
+        "default": 0,
+    },
+}
+
 
 class InterruptException(Exception):
     pass
 
 
+class MemoryLimitExceeded(InterruptException):
+    """Raised in a work horse whose job went over its memory limit (see
+    HardLimitingWorker)."""
+
+
+class ResultTooLarge(Exception):
+    pass
+
+
 class NotSupported(Exception):
     pass
 
@@ -53,6 +105,16 @@ class BaseQueryRunner(object):
     deprecated = False
     should_annotate_query = True
     noop_query = None
+    # Query runners that implement `run_query_stream` should set this to True.
+    supports_streaming = False
+    # Number of rows per batch yielded by `run_query_stream`.
+    stream_batch_size = 10000
+    # JSON encoder used to serialize the rows returned by the query runner.
+    json_encoder = JSONEncoder
+    # Limits of the results of queries (0 for no limit), set from the data source's
+    # options before its queries run.
+    max_result_rows = 0
+    max_result_bytes = 0
 
     def __init__(self, configuration):
         self.syntax = "sql"
@@ -94,6 +156,53 @@ class BaseQueryRunner(object):
     def run_query(self, query, user):
         raise NotImplementedError()
 
+    def check_result_size(self, rows=0, size=0):
+        """Raises ResultTooLarge if a result (being fetched) has more rows or bytes
+        than the limits allow. Query runners call this while they fetch rows, so
+        queries fail before their results take all of the worker's memory."""
+        if self.max_result_rows and rows > self.max_result_rows:
+            raise ResultTooLarge(
+                "Query result is too large: it has over {} rows.".format(
+                    self.max_result_rows
+                )
+            )
+        if self.max_result_bytes and size > self.max_result_bytes:
+            raise ResultTooLarge(
+                "Query result is too large: it's over {} bytes.".format(
+                    self.max_result_bytes
+                )
+            )
+
+    def _connect(self):
+        """Opens a connection to the data source, for query runners that pool their
+        connections (see `redash.query_runner.pool`)."""
+        raise NotImplementedError()
+
+    def _check_connection(self, connection):
+        """Whether a pooled connection is still usable, before it's reused."""
+        return True
+
+    def _reset_connection(self, connection):
+        """Undoes what a query left behind on a connection before it goes back to the
+        pool (an open transaction, for example)."""
+        pass
+
+    async def run_query_async(self, query, user):
+        """Coroutine variant of `run_query`, for the async worker. Unless the query
+        runner implements it, `run_query` runs in a thread of the worker."""
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, self.run_query, query, user)
+
+    def run_query_stream(self, query, user):
+        """Streaming variant of `run_query`.
+
+        Generator that yields the list of columns (as returned by `fetch_columns`)
+        first and then lists of rows, in batches of about `stream_batch_size` rows.
+        Errors are raised as exceptions. The consumer may stop iterating (and close
+        the generator) at any time, in which case the query should be cancelled.
+        """
+        raise NotSupported()
+
     def fetch_columns(self, columns):
         column_names = []
         duplicates_counter = 1
@@ -127,7 +236,7 @@ class BaseQueryRunner(object):
         return {
             "name": cls.name(),
             "type": cls.type(),
-            "configuration_schema": cls.configuration_schema(),
+            "configuration_schema": with_execution_options(cls.configuration_schema()),
             **({ "deprecated": True } if cls.deprecated else {})
         }
 
@@ -225,6 +334,118 @@ class BaseHTTPQueryRunner(BaseQueryRunner):
         # Return response and error.
         return response, error
 
+    def build_request(self, query):
+        """The arguments of `get_response` that execute the query, for query runners
+        that execute each query with a single request: those implement this and
+        `parse_response` instead of `run_query`, and run natively on the event loop
+        of the async worker."""
+        raise NotImplementedError()
+
+    def parse_response(self, response, query):
+        """Returns the data and error of the query from its (successful) response."""
+        raise NotImplementedError()
+
+    def run_query(self, query, user):
+        request = self.build_request(query)
+        response, error = self.get_response(**request)
+        if error is not None:
+            return None, error
+
+        return self.parse_response(response, query)
+
+    @property
+    def supports_async(self):
+        return (
+            aiohttp is not None
+            and type(self).build_request is not BaseHTTPQueryRunner.build_request
+        )
+
+    async def run_query_async(self, query, user):
+        if not self.supports_async:
+            return await super().run_query_async(query, user)
+
+        request = self.build_request(query)
+        response, error = await self.get_response_async(**request)
+        if error is not None:
+            return None, error
+
+        return self.parse_response(response, query)
+
+    async def get_response_async(self, url, auth=None, http_method="get", **kwargs):
+        """Coroutine variant of `get_response`, with aiohttp (in the session of the
+        async worker). The response is a `requests.Response`, as from
+        `get_response`."""
+        if auth is None:
+            auth = self.get_auth()
+        if auth is not None:
+            auth = aiohttp.BasicAuth(*auth)
+        for option in ("params", "data"):
+            if kwargs.get(option) is not None:
+                kwargs[option] = _encodable_fields(kwargs[option])
+
+        session = http_session.get()
+        if session is None:
+            async with aiohttp.ClientSession() as session:
+                return await self._request(session, http_method, url, auth, kwargs)
+
+        return await self._request(session, http_method, url, auth, kwargs)
+
+    async def _request(self, session, http_method, url, auth, kwargs):
+        error = None
+        response = requests.Response()
+        try:
+            async with session.request(http_method, url, auth=auth, **kwargs) as r:
+                response.status_code = r.status
+                response.reason = r.reason
+                response.url = str(r.url)
+                response.headers.update(r.headers)
+                response.encoding = r.charset
+                response._content = await r.read()
+
+            if response.status_code >= 400:
+                error = "Failed to execute query. " "Return Code: {} Reason: {}".format(
+                    response.status_code, response.text
+                )
+            elif response.status_code != 200:
+                error = "{} ({}).".format(self.response_error, response.status_code)
+        except aiohttp.ClientError as exc:
+            logger.exception(exc)
+            error = str(exc) or exc.__class__.__name__
+
+        return response, error
+
+
+def _encodable_fields(fields):
+    """`params` or `data` (when it's a dict or a list of pairs) as `requests`
+    encodes them: without the None values, with a pair per item of list values and
+    the other values as strings. aiohttp only takes strings and numbers."""
+    if isinstance(fields, dict):
+        fields = fields.items()
+    elif not isinstance(fields, (list, tuple)):
+        return fields
+
+    encodable = []
+    for key, values in fields:
+        if isinstance(values, (str, bytes)) or not hasattr(values, "__iter__"):
+            values = [values]
+
+        encodable.extend(
+            (_field_text(key), _field_text(value))
+            for value in values
+            if value is not None
+        )
+
+    return encodable
+
+
+def _field_text(value):
+    if isinstance(value, bytes):
+        return value.decode("utf-8")
+    return str(value)
+
+
+# The aiohttp session the async worker's HTTP query runners share.
+http_session = ContextVar("http_session", default=None)
 
 query_runners = {}
 
@@ -254,12 +475,26 @@ def get_query_runner(query_runner_type, configuration):
     return query_runner_class(configuration)
 
 
+def with_execution_options(schema):
+    """Adds the options every data source has, which are used when executing its
+    queries rather than by its query runner, to a configuration schema."""
+    if "properties" not in schema:
+        return schema
+
+    schema = dict(schema)
+    schema["properties"] = dict(schema["properties"], **EXECUTION_OPTIONS)
+    schema["extra_options"] = list(schema.get("extra_options", [])) + list(
+        EXECUTION_OPTIONS
+    )
+    return schema
+
+
 def get_configuration_schema_for_query_runner_type(query_runner_type):
     query_runner_class = query_runners.get(query_runner_type, None)
     if query_runner_class is None:
         return None
 
-    return query_runner_class.configuration_schema()
+    return with_execution_options(query_runner_class.configuration_schema())
 
 
 def import_query_runners(query_runner_imports):
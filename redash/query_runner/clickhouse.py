@@ -4,6 +4,7 @@ import re
 import requests
 
 from redash.query_runner import *
+from redash.query_runner.pool import pooled_connection
 from redash.utils import json_dumps, json_loads
 
 logger = logging.getLogger(__name__)
@@ -62,26 +63,31 @@ class ClickHouse(BaseSQLQueryRunner):
 
         return list(schema.values())
 
+    def _connect(self):
+        # A session keeps its (keep-alive) HTTP connections open between queries.
+        return requests.Session()
+
     def _send_query(self, data, stream=False):
         url = self.configuration.get("url", "http://127.0.0.1:8123")
         try:
             verify = self.configuration.get("verify", True)
-            r = requests.post(
-                url,
-                data=data.encode("utf-8","ignore"),
-                stream=stream,
-                timeout=self.configuration.get("timeout", 30),
-                params={
-                    "user": self.configuration.get("user", "default"),
-                    "password": self.configuration.get("password", ""),
-                    "database": self.configuration["dbname"],
-                },
-                verify=verify,
-            )
-            if r.status_code != 200:
-                raise Exception(r.text)
-            # logging.warning(r.json())
-            return r.json()
+            with pooled_connection(self) as session:
+                r = session.post(
+                    url,
+                    data=data.encode("utf-8","ignore"),
+                    stream=stream,
+                    timeout=self.configuration.get("timeout", 30),
+                    params={
+                        "user": self.configuration.get("user", "default"),
+                        "password": self.configuration.get("password", ""),
+                        "database": self.configuration["dbname"],
+                    },
+                    verify=verify,
+                )
+                if r.status_code != 200:
+                    raise Exception(r.text)
+                # logging.warning(r.json())
+                return r.json()
         except requests.RequestException as e:
             if e.response:
                 details = "({}, Status Code: {})".format(
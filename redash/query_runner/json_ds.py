@@ -159,7 +159,7 @@ class JSON(BaseHTTPQueryRunner):
     def test_connection(self):
         pass
 
-    def run_query(self, query, user):
+    def build_request(self, query):
         query = parse_query(query)
 
         if not isinstance(query, dict):
@@ -179,7 +179,6 @@ class JSON(BaseHTTPQueryRunner):
         )
 
         fields = query.get("fields")
-        path = query.get("path")
 
         if isinstance(request_options.get("auth", None), list):
             request_options["auth"] = tuple(request_options["auth"])
@@ -197,14 +196,13 @@ class JSON(BaseHTTPQueryRunner):
         if fields and not isinstance(fields, list):
             raise QueryParseError("'fields' needs to be a list.")
 
-        response, error = self.get_response(
-            query["url"], http_method=method, **request_options
-        )
-
-        if error is not None:
-            return None, error
+        return dict(request_options, url=query["url"], http_method=method)
 
-        data = json_dumps(parse_json(response.json(), path, fields))
+    def parse_response(self, response, query):
+        query = parse_query(query)
+        data = json_dumps(
+            parse_json(response.json(), query.get("path"), query.get("fields"))
+        )
 
         if data:
             return data, None
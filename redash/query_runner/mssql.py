@@ -3,6 +3,7 @@ import sys
 import uuid
 
 from redash.query_runner import *
+from redash.query_runner.pool import pooled_connection
 from redash.utils import json_dumps, json_loads
 
 logger = logging.getLogger(__name__)
@@ -97,56 +98,68 @@ class SqlServer(BaseSQLQueryRunner):
 
         return list(schema.values())
 
+    def _connect(self):
+        server = self.configuration.get("server", "")
+        port = self.configuration.get("port", 1433)
+
+        if port != 1433:
+            server = server + ":" + str(port)
+
+        return pymssql.connect(
+            server=server,
+            user=self.configuration.get("user", ""),
+            password=self.configuration.get("password", ""),
+            database=self.configuration["db"],
+            tds_version=self.configuration.get("tds_version", "7.0"),
+            charset=self.configuration.get("charset", "UTF-8"),
+        )
+
+    def _check_connection(self, connection):
+        cursor = connection.cursor()
+        cursor.execute("SELECT 1")
+        cursor.fetchall()
+        return True
+
+    def _reset_connection(self, connection):
+        # Statements ran in a transaction that was never committed when
+        # connections were closed after each query, so they still aren't.
+        connection.rollback()
+
     def run_query(self, query, user):
-        connection = None
+        charset = self.configuration.get("charset", "UTF-8")
 
         try:
-            server = self.configuration.get("server", "")
-            user = self.configuration.get("user", "")
-            password = self.configuration.get("password", "")
-            db = self.configuration["db"]
-            port = self.configuration.get("port", 1433)
-            tds_version = self.configuration.get("tds_version", "7.0")
-            charset = self.configuration.get("charset", "UTF-8")
-
-            if port != 1433:
-                server = server + ":" + str(port)
-
-            connection = pymssql.connect(
-                server=server,
-                user=user,
-                password=password,
-                database=db,
-                tds_version=tds_version,
-                charset=charset,
-            )
-
-            if isinstance(query, str):
-                query = query.encode(charset)
-
-            cursor = connection.cursor()
-            logger.debug("SqlServer running query: %s", query)
-
-            cursor.execute(query)
-            data = cursor.fetchall()
-
-            if cursor.description is not None:
-                columns = self.fetch_columns(
-                    [(i[0], types_map.get(i[1], None)) for i in cursor.description]
-                )
-                rows = [
-                    dict(zip((column["name"] for column in columns), row))
-                    for row in data
-                ]
-
-                data = {"columns": columns, "rows": rows}
-                json_data = json_dumps(data)
-                error = None
-            else:
-                error = "No data was returned."
-                json_data = None
-
-            cursor.close()
+            with pooled_connection(self) as connection:
+                if isinstance(query, str):
+                    query = query.encode(charset)
+
+                cursor = connection.cursor()
+                logger.debug("SqlServer running query: %s", query)
+
+                try:
+                    cursor.execute(query)
+                    data = cursor.fetchall()
+                except (KeyboardInterrupt, JobTimeoutException):
+                    connection.cancel()
+                    raise
+
+                if cursor.description is not None:
+                    columns = self.fetch_columns(
+                        [(i[0], types_map.get(i[1], None)) for i in cursor.description]
+                    )
+                    rows = [
+                        dict(zip((column["name"] for column in columns), row))
+                        for row in data
+                    ]
+
+                    data = {"columns": columns, "rows": rows}
+                    json_data = json_dumps(data)
+                    error = None
+                else:
+                    error = "No data was returned."
+                    json_data = None
+
+                cursor.close()
         except pymssql.Error as e:
             try:
                 # Query errors are at `args[1]`
@@ -155,12 +168,6 @@ class SqlServer(BaseSQLQueryRunner):
                 # Connection errors are `args[0][1]`
                 error = e.args[0][1]
             json_data = None
-        except (KeyboardInterrupt, JobTimeoutException):
-            connection.cancel()
-            raise
-        finally:
-            if connection:
-                connection.close()
 
         return json_data, error
 
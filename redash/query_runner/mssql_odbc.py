@@ -4,6 +4,7 @@ import uuid
 
 from redash.query_runner import *
 from redash.query_runner.mssql import types_map
+from redash.query_runner.pool import pooled_connection
 from redash.utils import json_dumps, json_loads
 
 logger = logging.getLogger(__name__)
@@ -94,53 +95,65 @@ class SQLServerODBC(BaseSQLQueryRunner):
 
         return list(schema.values())
 
-    def run_query(self, query, user):
-        connection = None
+    def _connect(self):
+        connection_string_fmt = (
+            "DRIVER={{ODBC Driver 17 for SQL Server}};PORT={};SERVER={};DATABASE={};UID={};PWD={}"
+        )
+        connection_string = connection_string_fmt.format(
+            self.configuration.get("port", 1433),
+            self.configuration.get("server"),
+            self.configuration["db"],
+            self.configuration.get("user", ""),
+            self.configuration.get("password", ""),
+        )
 
-        try:
-            server = self.configuration.get("server")
-            user = self.configuration.get("user", "")
-            password = self.configuration.get("password", "")
-            db = self.configuration["db"]
-            port = self.configuration.get("port", 1433)
-            charset = self.configuration.get("charset", "UTF-8")
-
-            connection_string_fmt = (
-                "DRIVER={{ODBC Driver 17 for SQL Server}};PORT={};SERVER={};DATABASE={};UID={};PWD={}"
-            )
-            connection_string = connection_string_fmt.format(
-                port, server, db, user, password
-            )
-
-            if self.configuration.get('use_ssl', False):
-                connection_string += ";Encrypt=YES"
-
-                if not self.configuration.get('verify_ssl'):
-                    connection_string += ";TrustServerCertificate=YES"
-
-            connection = pyodbc.connect(connection_string)
-            cursor = connection.cursor()
-            logger.debug("SQLServerODBC running query: %s", query)
-            cursor.execute(query)
-            data = cursor.fetchall()
-
-            if cursor.description is not None:
-                columns = self.fetch_columns(
-                    [(i[0], types_map.get(i[1], None)) for i in cursor.description]
-                )
-                rows = [
-                    dict(zip((column["name"] for column in columns), row))
-                    for row in data
-                ]
-
-                data = {"columns": columns, "rows": rows}
-                json_data = json_dumps(data)
-                error = None
-            else:
-                error = "No data was returned."
-                json_data = None
+        if self.configuration.get('use_ssl', False):
+            connection_string += ";Encrypt=YES"
+
+            if not self.configuration.get('verify_ssl'):
+                connection_string += ";TrustServerCertificate=YES"
+
+        return pyodbc.connect(connection_string)
 
-            cursor.close()
+    def _check_connection(self, connection):
+        connection.cursor().execute("SELECT 1").fetchall()
+        return True
+
+    def _reset_connection(self, connection):
+        # Statements ran in a transaction that was never committed when
+        # connections were closed after each query, so they still aren't.
+        connection.rollback()
+
+    def run_query(self, query, user):
+        try:
+            with pooled_connection(self) as connection:
+                cursor = connection.cursor()
+                logger.debug("SQLServerODBC running query: %s", query)
+
+                try:
+                    cursor.execute(query)
+                    data = cursor.fetchall()
+                except (KeyboardInterrupt, JobTimeoutException):
+                    cursor.cancel()
+                    raise
+
+                if cursor.description is not None:
+                    columns = self.fetch_columns(
+                        [(i[0], types_map.get(i[1], None)) for i in cursor.description]
+                    )
+                    rows = [
+                        dict(zip((column["name"] for column in columns), row))
+                        for row in data
+                    ]
+
+                    data = {"columns": columns, "rows": rows}
+                    json_data = json_dumps(data)
+                    error = None
+                else:
+                    error = "No data was returned."
+                    json_data = None
+
+                cursor.close()
         except pyodbc.Error as e:
             try:
                 # Query errors are at `args[1]`
@@ -149,12 +162,6 @@ class SQLServerODBC(BaseSQLQueryRunner):
                 # Connection errors are `args[0][1]`
                 error = e.args[0][1]
             json_data = None
-        except (KeyboardInterrupt, JobTimeoutException):
-            connection.cancel()
-            raise
-        finally:
-            if connection:
-                connection.close()
 
         return json_data, error
 
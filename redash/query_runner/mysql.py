@@ -13,6 +13,7 @@ from redash.query_runner import (
     JobTimeoutException,
     register,
 )
+from redash.query_runner.pool import pooled_connection
 from redash.settings import parse_boolean
 from redash.utils import json_dumps, json_loads
 
@@ -101,7 +102,7 @@ class Mysql(BaseSQLQueryRunner):
     def enabled(cls):
         return enabled
 
-    def _connection(self):
+    def _connect(self):
         params = dict(
             host=self.configuration.get("host", ""),
             user=self.configuration.get("user", ""),
@@ -152,25 +153,40 @@ class Mysql(BaseSQLQueryRunner):
         return list(schema.values())
 
 
+    def _check_connection(self, connection):
+        connection.ping()
+        return True
+
+    def _reset_connection(self, connection):
+        # Statements ran in a transaction that was never committed when
+        # connections were closed after each query, so they still aren't.
+        connection.rollback()
+
     def run_query(self, query, user):
         ev = threading.Event()
-        thread_id = ""
         r = Result()
-        t = None
+        r.exception = None
 
         try:
-            connection = self._connection()
-            thread_id = connection.thread_id()
-            t = threading.Thread(
-                target=self._run_query, args=(query, user, connection, r, ev)
-            )
-            t.start()
-            while not ev.wait(1):
-                pass
-        except (KeyboardInterrupt, InterruptException, JobTimeoutException):
-            self._cancel(thread_id)
-            t.join()
-            raise
+            with pooled_connection(self) as connection:
+                thread_id = connection.thread_id()
+                t = threading.Thread(
+                    target=self._run_query, args=(query, user, connection, r, ev)
+                )
+                t.start()
+                try:
+                    while not ev.wait(1):
+                        pass
+                except (KeyboardInterrupt, InterruptException, JobTimeoutException):
+                    self._cancel(thread_id)
+                    t.join()
+                    raise
+
+                # Raised here so the connection is discarded.
+                if r.exception is not None:
+                    raise r.exception
+        except MySQLdb.Error as e:
+            return None, e.args[1]
 
         return r.json_data, r.error
 
@@ -209,12 +225,9 @@ class Mysql(BaseSQLQueryRunner):
         except MySQLdb.Error as e:
             if cursor:
                 cursor.close()
-            r.json_data = None
-            r.error = e.args[1]
+            r.exception = e
         finally:
             ev.set()
-            if connection:
-                connection.close()
 
     def _get_ssl_parameters(self):
         if not self.configuration.get("use_ssl"):
@@ -237,7 +250,7 @@ class Mysql(BaseSQLQueryRunner):
         error = None
 
         try:
-            connection = self._connection()
+            connection = self._connect()
             cursor = connection.cursor()
             query = "KILL %d" % (thread_id)
             logging.debug(query)
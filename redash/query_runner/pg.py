@@ -1,12 +1,15 @@
 import os
 import logging
+import re
 import select
 from uuid import uuid4
 
 import psycopg2
+import sqlparse
 from psycopg2.extras import Range
 
 from redash.query_runner import *
+from redash.query_runner.pool import pooled_connection
 from redash.utils import JSONEncoder, json_dumps, json_loads
 
 logger = logging.getLogger(__name__)
@@ -67,6 +70,59 @@ def _wait(conn, timeout=None):
             raise psycopg2.OperationalError("select.error received")
 
 
+def _check_idle(connection):
+    status = connection.get_transaction_status()
+    if status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+        raise psycopg2.InterfaceError(
+            "Connection left in transaction status {}.".format(status)
+        )
+
+
+SERVER_SIDE_CURSOR_NAME = "redash_cursor"
+DEFAULT_FETCH_SIZE = 10000
+# SET LOCAL and SET TRANSACTION only apply to the transaction they're made in.
+SET_STATEMENT_REGEX = re.compile(r"set\s+(?!local\b|transaction\b)", re.IGNORECASE)
+
+# Merged into the configuration schemas of the runners that support the cursor.
+SERVER_SIDE_CURSOR_PROPERTIES = {
+    "server_side_cursor": {
+        "type": "boolean",
+        "title": "Use Server-Side Cursor (fetch results in batches)",
+    },
+    "fetch_size": {
+        "type": "number",
+        "title": "Rows per Batch",
+        "default": DEFAULT_FETCH_SIZE,
+    },
+}
+
+
+def split_for_server_side_cursor(query):
+    """Split the query into the SET statements to run first and the SELECT
+    statement to declare a server-side cursor for.
+
+    Returns None unless the query is a single SELECT (optionally preceded by SET
+    statements, like the query group Redshift queries start with). Anything else
+    runs as is: declaring the cursor takes an explicit transaction, which some
+    statements can't run in (VACUUM, CREATE INDEX CONCURRENTLY, some Redshift
+    commands...) or change the meaning of (statements managing transactions).
+    """
+    statements = [
+        statement.strip().rstrip(";")
+        for statement in sqlparse.split(query)
+        if statement.strip()
+    ]
+
+    if not statements or sqlparse.parse(statements[-1])[0].get_type() != "SELECT":
+        return None
+
+    settings = statements[:-1]
+    if not all(SET_STATEMENT_REGEX.match(statement) for statement in settings):
+        return None
+
+    return settings, statements[-1]
+
+
 def full_table_name(schema, name):
     if "." in name:
         name = u'"{}"'.format(name)
@@ -106,6 +162,8 @@ def build_schema(query_result, schema):
 
 class PostgreSQL(BaseSQLQueryRunner):
     noop_query = "SELECT 1"
+    supports_streaming = True
+    json_encoder = PostgreSQLJSONEncoder
 
     @classmethod
     def configuration_schema(cls):
@@ -118,6 +176,7 @@ class PostgreSQL(BaseSQLQueryRunner):
                 "port": {"type": "number", "default": 5432},
                 "dbname": {"type": "string", "title": "Database Name"},
                 "sslmode": {"type": "string", "title": "SSL Mode", "default": "prefer"},
+                **SERVER_SIDE_CURSOR_PROPERTIES,
             },
             "order": ["host", "port", "user", "password"],
             "required": ["dbname"],
@@ -193,45 +252,166 @@ class PostgreSQL(BaseSQLQueryRunner):
 
         return connection
 
-    def run_query(self, query, user):
-        connection = self._get_connection()
-        _wait(connection, timeout=10)
+    @property
+    def _fetch_size(self):
+        return int(self.configuration.get("fetch_size") or self.stream_batch_size)
+
+    def _fetch(self, connection, query):
+        """Run the query and yield the cursor description (None if the query
+        returned no data) and then batches of rows.
 
+        With the `server_side_cursor` option the result set stays on the server and
+        is fetched `fetch_size` rows at a time, instead of libpq buffering all of it
+        in the worker. Named cursors aren't available on asynchronous connections,
+        so the cursor is declared explicitly (which keeps cancellation working).
+        """
         cursor = connection.cursor()
 
-        try:
+        statements = None
+        if self.configuration.get("server_side_cursor"):
+            statements = split_for_server_side_cursor(query)
+
+        if statements is None:
             cursor.execute(query)
             _wait(connection)
 
-            if cursor.description is not None:
-                columns = self.fetch_columns(
-                    [(i[0], types_map.get(i[1], None)) for i in cursor.description]
-                )
-                rows = [
-                    dict(zip((column["name"] for column in columns), row))
-                    for row in cursor
-                ]
-
-                data = {"columns": columns, "rows": rows}
-                error = None
-                json_data = json_dumps(data, ignore_nan=True, cls=PostgreSQLJSONEncoder)
-            else:
-                error = "Query completed but it returned no data."
-                json_data = None
+            yield cursor.description
+            if cursor.description is None:
+                return
+
+            while True:
+                rows = cursor.fetchmany(self._fetch_size)
+                if not rows:
+                    break
+
+                yield rows
+        else:
+            settings, select_statement = statements
+            # The settings are made outside of the cursor's transaction, as they
+            # would be without it.
+            if settings:
+                cursor.execute(";\n".join(settings))
+                _wait(connection)
+
+            declare = "DECLARE {} NO SCROLL CURSOR FOR {}".format(
+                SERVER_SIDE_CURSOR_NAME, select_statement
+            )
+            fetch = "FETCH FORWARD {} FROM {}".format(
+                self._fetch_size, SERVER_SIDE_CURSOR_NAME
+            )
+
+            for statement in ["BEGIN", declare, fetch]:
+                cursor.execute(statement)
+                _wait(connection)
+
+            yield cursor.description
+
+            while True:
+                rows = cursor.fetchall()
+                if not rows:
+                    break
+
+                yield rows
+
+                cursor.execute(fetch)
+                _wait(connection)
+
+            for statement in ["CLOSE {}".format(SERVER_SIDE_CURSOR_NAME), "COMMIT"]:
+                cursor.execute(statement)
+                _wait(connection)
+
+    def _connect(self):
+        connection = self._get_connection()
+        _wait(connection, timeout=10)
+        return connection
+
+    def _check_connection(self, connection):
+        if connection.closed:
+            return False
+
+        cursor = connection.cursor()
+        cursor.execute("SELECT 1")
+        _wait(connection, timeout=10)
+        return True
+
+    def _reset_connection(self, connection):
+        _check_idle(connection)
+
+        # Drops the session state a query may have left behind (settings, role,
+        # temporary tables, prepared statements, LISTENs...), so that the next
+        # query doesn't inherit it.
+        cursor = connection.cursor()
+        cursor.execute("DISCARD ALL")
+        _wait(connection, timeout=10)
+
+    def run_query(self, query, user):
+        try:
+            with pooled_connection(self) as connection:
+                try:
+                    batches = self._fetch(connection, query)
+                    description = next(batches)
+
+                    if description is not None:
+                        columns = self.fetch_columns(
+                            [(i[0], types_map.get(i[1], None)) for i in description]
+                        )
+                        column_names = [column["name"] for column in columns]
+                        rows = []
+                        for batch in batches:
+                            rows.extend(dict(zip(column_names, row)) for row in batch)
+                            self.check_result_size(rows=len(rows))
+
+                        data = {"columns": columns, "rows": rows}
+                        error = None
+                        json_data = json_dumps(
+                            data, ignore_nan=True, cls=PostgreSQLJSONEncoder
+                        )
+                    else:
+                        error = "Query completed but it returned no data."
+                        json_data = None
+                except (KeyboardInterrupt, InterruptException, JobTimeoutException):
+                    connection.cancel()
+                    raise
         except (select.error, OSError) as e:
             error = "Query interrupted. Please retry."
             json_data = None
         except psycopg2.DatabaseError as e:
             error = str(e)
             json_data = None
-        except (KeyboardInterrupt, InterruptException, JobTimeoutException):
-            connection.cancel()
-            raise
-        finally:
-            connection.close()
 
         return json_data, error
 
+    def run_query_stream(self, query, user):
+        try:
+            with pooled_connection(self) as connection:
+                try:
+                    batches = self._fetch(connection, query)
+                    description = next(batches)
+
+                    if description is None:
+                        raise psycopg2.ProgrammingError(
+                            "Query completed but it returned no data."
+                        )
+
+                    columns = self.fetch_columns(
+                        [(i[0], types_map.get(i[1], None)) for i in description]
+                    )
+                    yield columns
+
+                    column_names = [column["name"] for column in columns]
+                    for batch in batches:
+                        yield [dict(zip(column_names, row)) for row in batch]
+                except (
+                    KeyboardInterrupt,
+                    InterruptException,
+                    JobTimeoutException,
+                    GeneratorExit,
+                ):
+                    connection.cancel()
+                    raise
+        except (select.error, OSError):
+            raise psycopg2.OperationalError("Query interrupted. Please retry.")
+
 
 class Redshift(PostgreSQL):
 
@@ -243,6 +423,24 @@ class Redshift(PostgreSQL):
     def name(cls):
         return "Redshift"
 
+    def _reset_connection(self, connection):
+        _check_idle(connection)
+
+        # Redshift has no DISCARD: settings can be reset, but a session's user and
+        # temporary tables can't always be, so connections that have either are
+        # closed instead.
+        cursor = connection.cursor()
+        cursor.execute("RESET ALL")
+        _wait(connection, timeout=10)
+        cursor.execute("SELECT current_user, current_schemas(true)")
+        _wait(connection, timeout=10)
+        user, schemas = cursor.fetchone()
+
+        if user != connection.info.user:
+            raise psycopg2.InterfaceError("Connection left with user {}.".format(user))
+        if "pg_temp" in str(schemas):
+            raise psycopg2.InterfaceError("Connection left with temporary tables.")
+
     def _get_connection(self):
 
         sslrootcert_path = os.path.join(
@@ -283,6 +481,7 @@ class Redshift(PostgreSQL):
                     "title": "Query Group for Scheduled Queries",
                     "default": "default",
                 },
+                **SERVER_SIDE_CURSOR_PROPERTIES,
             },
             "order": [
                 "host",
@@ -293,6 +492,8 @@ class Redshift(PostgreSQL):
                 "sslmode",
                 "adhoc_query_group",
                 "scheduled_query_group",
+                "server_side_cursor",
+                "fetch_size",
             ],
             "required": ["dbname", "user", "password", "host", "port"],
             "secret": ["password"],
@@ -394,6 +595,7 @@ class RedshiftIAM(Redshift):
                     "title": "Query Group for Scheduled Queries",
                     "default": "default",
                 },
+                **SERVER_SIDE_CURSOR_PROPERTIES,
             },
             "order": [
                 "rolename",
@@ -408,6 +610,8 @@ class RedshiftIAM(Redshift):
                 "sslmode",
                 "adhoc_query_group",
                 "scheduled_query_group",
+                "server_side_cursor",
+                "fetch_size",
             ],
             "required": ["dbname", "user", "host", "port", "aws_region"],
             "secret": ["aws_secret_access_key"],
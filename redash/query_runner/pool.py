@@ -0,0 +1,273 @@
+"""
+Pools of query runners' connections, so the queries of a data source run by a
+process reuse its connections instead of connecting (and authenticating, often
+over TLS) for each query.
+
+Query runners opt in by implementing `_connect` (and `_check_connection` and
+`_reset_connection` when they need to) and getting their connections from
+`pooled_connection`. Pools are per process (the connections of a forked process's
+parent aren't reused), so they pay off in processes that run many jobs, like the
+work horses of `PreforkWorker` and the `AsyncWorker`, and in jobs that run many
+queries (see `reused_connections`).
+"""
+import hashlib
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from redash import settings, statsd_client
+from redash.utils import json_dumps
+from redash.utils.configuration import ConfigurationContainer
+
+logger = logging.getLogger(__name__)
+
+
+class ConnectionPool(object):
+    """
+    Idle connections to one data source (up to `max_size` of them). Connections are
+    checked with the query runner's `_check_connection` before they're reused, and
+    closed once they were idle for `max_idle_time` seconds or open for
+    `max_lifetime` seconds.
+    """
+
+    def __init__(self, name, max_size, max_idle_time, max_lifetime):
+        self.name = name
+        self.max_size = max_size
+        self.max_idle_time = max_idle_time
+        self.max_lifetime = max_lifetime
+        self.hits = 0
+        self.misses = 0
+        self.discarded = 0
+        self.checked_out = 0
+        # (connection, created at, idle since), the most recently used last.
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _expired(self, created_at, idle_since, now):
+        if now - created_at >= self.max_lifetime:
+            return "lifetime"
+        if idle_since is not None and now - idle_since >= self.max_idle_time:
+            return "idle"
+        return None
+
+    def _pop(self):
+        with self._lock:
+            if not self._idle:
+                return None
+            return self._idle.pop()
+
+    def checkout(self, query_runner):
+        """Returns an idle connection that passes its health check, or a new one,
+        and the time it was created at."""
+        while True:
+            idle = self._pop()
+            if idle is None:
+                break
+
+            connection, created_at, idle_since = idle
+            reason = self._expired(created_at, idle_since, time.time())
+            if reason is None and not self._healthy(query_runner, connection):
+                reason = "unhealthy"
+            if reason is not None:
+                self.discard(connection, reason)
+                continue
+
+            with self._lock:
+                self.hits += 1
+                self.checked_out += 1
+            statsd_client.incr("connection_pool.hit")
+            return connection, created_at
+
+        statsd_client.incr("connection_pool.miss")
+        with statsd_client.timer("connection_pool.connect"):
+            connection = query_runner._connect()
+        with self._lock:
+            self.misses += 1
+            self.checked_out += 1
+        return connection, time.time()
+
+    def checkin(self, query_runner, connection, created_at):
+        """Returns a connection that was used successfully to the pool."""
+        with self._lock:
+            self.checked_out -= 1
+        try:
+            query_runner._reset_connection(connection)
+        except Exception as e:
+            logger.debug("Failed resetting connection of %s: %s", self.name, e)
+            self.discard(connection, "error")
+            return
+
+        now = time.time()
+        reason = self._expired(created_at, None, now)
+        if reason is None:
+            with self._lock:
+                if len(self._idle) < self.max_size:
+                    self._idle.append((connection, created_at, now))
+                    return
+            reason = "full"
+
+        self.discard(connection, reason)
+
+    def release(self, connection):
+        """Discards a checked out connection that failed, or whose use was
+        interrupted."""
+        with self._lock:
+            self.checked_out -= 1
+        self.discard(connection, "error")
+
+    def discard(self, connection, reason):
+        with self._lock:
+            self.discarded += 1
+        statsd_client.incr("connection_pool.discarded.{}".format(reason))
+        _close(connection)
+
+    def prune(self):
+        """Closes the idle connections that expired."""
+        now = time.time()
+        expired = []
+        with self._lock:
+            idle, self._idle = self._idle, []
+            for connection, created_at, idle_since in idle:
+                reason = self._expired(created_at, idle_since, now)
+                if reason is None:
+                    self._idle.append((connection, created_at, idle_since))
+                else:
+                    expired.append((connection, reason))
+
+        for connection, reason in expired:
+            self.discard(connection, reason)
+
+    def clear(self):
+        """Closes all the idle connections."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+
+        for connection, _, _ in idle:
+            self.discard(connection, "cleared")
+
+    def stats(self):
+        return {
+            "idle": len(self._idle),
+            "checked_out": self.checked_out,
+            "hits": self.hits,
+            "misses": self.misses,
+            "discarded": self.discarded,
+        }
+
+    def _healthy(self, query_runner, connection):
+        try:
+            return query_runner._check_connection(connection)
+        except Exception as e:
+            logger.debug("Health check of connection of %s failed: %s", self.name, e)
+            return False
+
+
+def _close(connection):
+    try:
+        connection.close()
+    except Exception as e:
+        logger.debug("Failed closing connection: %s", e)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+# Pools inherited from the parent process. Their connections share the parent's
+# sockets, so they're never closed (not even by being garbage collected).
+_inherited_pools = []
+# Pool size in `reused_connections` blocks, when it's over QUERY_RUNNER_POOL_SIZE.
+_reuse_size = 0
+
+
+def _forget_pools():
+    _inherited_pools.extend(_pools.values())
+    _pools.clear()
+
+
+os.register_at_fork(after_in_child=_forget_pools)
+
+
+def pool_key(query_runner):
+    """The query runner's type and a hash of its configuration: the data sources
+    with the same configuration share a pool."""
+    configuration = query_runner.configuration
+    if isinstance(configuration, ConfigurationContainer):
+        configuration = configuration.to_dict()
+
+    digest = hashlib.sha256(
+        json_dumps(configuration, sort_keys=True).encode("utf-8")
+    ).hexdigest()
+    return "{}:{}".format(query_runner.type(), digest[:16])
+
+
+def _pool_size():
+    return max(settings.QUERY_RUNNER_POOL_SIZE, _reuse_size)
+
+
+def get_pool(query_runner):
+    key = pool_key(query_runner)
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = ConnectionPool(
+                key,
+                max_size=_pool_size(),
+                max_idle_time=settings.QUERY_RUNNER_POOL_MAX_IDLE_TIME,
+                max_lifetime=settings.QUERY_RUNNER_POOL_MAX_LIFETIME,
+            )
+        _pools[key].max_size = _pool_size()
+        return _pools[key]
+
+
+def pool_stats():
+    """{pool key: stats} of the pools of this process."""
+    return {key: pool.stats() for key, pool in list(_pools.items())}
+
+
+@contextmanager
+def pooled_connection(query_runner):
+    """
+    Yields a connection of the query runner from its pool, returning it to the pool
+    afterwards. Connections are discarded when the block raises (which includes
+    the job being interrupted or timing out). With pooling off
+    (REDASH_QUERY_RUNNER_POOL_SIZE=0), yields a new connection and closes it
+    afterwards.
+    """
+    if _pool_size() <= 0:
+        connection = query_runner._connect()
+        try:
+            yield connection
+        finally:
+            _close(connection)
+        return
+
+    for pool in list(_pools.values()):
+        pool.prune()
+
+    pool = get_pool(query_runner)
+    connection, created_at = pool.checkout(query_runner)
+    try:
+        yield connection
+    except BaseException:
+        pool.release(connection)
+        raise
+
+    pool.checkin(query_runner, connection, created_at)
+
+
+@contextmanager
+def reused_connections(size=1):
+    """
+    Pools up to `size` idle connections of each data source in the block, even
+    with pooling off, for jobs that run several queries of a data source (like
+    query batches). With pooling off, the connections are closed after the block.
+    """
+    global _reuse_size
+    previous, _reuse_size = _reuse_size, max(_reuse_size, size)
+    try:
+        yield
+    finally:
+        _reuse_size = previous
+        if _pool_size() <= 0:
+            for pool in list(_pools.values()):
+                pool.clear()
@@ -9,29 +9,46 @@ class Url(BaseHTTPQueryRunner):
     def test_connection(self):
         pass
 
-    def run_query(self, query, user):
+    def _relative_url_error(self, query):
         base_url = self.configuration.get("url", None)
 
-        query = query.strip()
-
         if base_url is not None and base_url != "":
-            if query.find("://") > -1:
-                return None, "Accepting only relative URLs to '%s'" % base_url
+            if query.strip().find("://") > -1:
+                return "Accepting only relative URLs to '%s'" % base_url
 
-        if base_url is None:
-            base_url = ""
+        return None
+
+    def run_query(self, query, user):
+        error = self._relative_url_error(query)
+        if error is not None:
+            return None, error
 
-        url = base_url + query
+        return super().run_query(query, user)
 
-        response, error = self.get_response(url)
+    async def run_query_async(self, query, user):
+        error = self._relative_url_error(query)
         if error is not None:
             return None, error
 
-        json_data = response.content.strip()
+        return await super().run_query_async(query, user)
+
+    def build_request(self, query):
+        base_url = self.configuration.get("url", None)
+
+        query = query.strip()
+
+        if base_url is None:
+            base_url = ""
+
+        return {"url": base_url + query}
+
+    def parse_response(self, response, query):
+        json_data = response.text.strip()
 
         if json_data:
             return json_data, None
         else:
+            url = self.build_request(query)["url"]
             return None, "Got empty response from '{}'.".format(url)
 
 
@@ -0,0 +1,167 @@
+"""
+Two-tier cache for serialized query result payloads.
+
+Query results are immutable once stored, so the bytes of an API response for a
+given result id never change. This caches them in a bounded, size-aware LRU in
+each process, backed by Redis so that other processes can share the work.
+"""
+import gzip
+import logging
+import threading
+from collections import OrderedDict
+
+import redis
+from redis import RedisError
+
+from redash import settings, statsd_client
+
+logger = logging.getLogger(__name__)
+
+
+class LRUCache(object):
+    """A thread safe LRU cache bounded by the total size of its (bytes) values."""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.size = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key):
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        if len(value) > self.max_size:
+            return 0
+
+        evicted = 0
+        with self._lock:
+            previous = self._items.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous)
+
+            while self._items and self.size + len(value) > self.max_size:
+                _, oldest = self._items.popitem(last=False)
+                self.size -= len(oldest)
+                evicted += 1
+
+            self._items[key] = value
+            self.size += len(value)
+
+        return evicted
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.size = 0
+
+
+class QueryResultCache(object):
+    """Caches response payloads in process memory and in Redis.
+
+    Payloads are stored gzip compressed when `compress` is set; callers can send
+    them as is to clients that accept gzip (see `CachedPayload`).
+    """
+
+    def __init__(
+        self,
+        redis,
+        memory_size,
+        max_item_size,
+        ttl,
+        compress=True,
+        key_prefix="query_result_payload",
+    ):
+        self.redis = redis
+        self.memory = LRUCache(memory_size)
+        self.max_item_size = max_item_size
+        self.ttl = ttl
+        self.compress = compress
+        self.key_prefix = key_prefix
+
+    def _key(self, query_result_id, kind):
+        return "{}:{}:{}".format(self.key_prefix, kind, query_result_id)
+
+    def _store_in_memory(self, key, value):
+        evicted = self.memory.set(key, value)
+        if evicted:
+            statsd_client.incr("query_result_cache.memory.evictions", evicted)
+
+    def get(self, query_result_id, kind="json"):
+        key = self._key(query_result_id, kind)
+
+        value = self.memory.get(key)
+        if value is not None:
+            statsd_client.incr("query_result_cache.memory.hit")
+            return CachedPayload(value, self.compress)
+
+        try:
+            value = self.redis.get(key)
+        except RedisError:
+            logger.exception("Failed reading query result payload from Redis.")
+            value = None
+
+        if value is not None:
+            statsd_client.incr("query_result_cache.redis.hit")
+            self._store_in_memory(key, value)
+            return CachedPayload(value, self.compress)
+
+        statsd_client.incr("query_result_cache.miss")
+        return None
+
+    def set(self, query_result_id, payload, kind="json"):
+        key = self._key(query_result_id, kind)
+        value = gzip.compress(payload, compresslevel=6) if self.compress else payload
+
+        if len(value) > self.max_item_size:
+            statsd_client.incr("query_result_cache.too_large")
+            return CachedPayload(value, self.compress)
+
+        self._store_in_memory(key, value)
+        try:
+            self.redis.set(key, value, ex=self.ttl)
+        except RedisError:
+            logger.exception("Failed writing query result payload to Redis.")
+
+        return CachedPayload(value, self.compress)
+
+    def get_or_set(self, query_result_id, build_payload, kind="json"):
+        """Return the cached payload, building (and caching) it with
+        `build_payload()` on a miss."""
+        cached = self.get(query_result_id, kind)
+        if cached is None:
+            cached = self.set(query_result_id, build_payload(), kind)
+
+        return cached
+
+
+class CachedPayload(object):
+    def __init__(self, value, compressed):
+        self.value = value
+        self.compressed = compressed
+
+    def body(self, accept_gzip=False):
+        """Return (body, content_encoding) to send to a client."""
+        if not self.compressed:
+            return self.value, None
+
+        if accept_gzip:
+            return self.value, "gzip"
+
+        return gzip.decompress(self.value), None
+
+
+query_result_cache = QueryResultCache(
+    redis.from_url(settings.QUERY_RESULTS_CACHE_REDIS_URL),
+    memory_size=settings.QUERY_RESULTS_CACHE_MEMORY_SIZE,
+    max_item_size=settings.QUERY_RESULTS_CACHE_MAX_ITEM_SIZE,
+    ttl=settings.QUERY_RESULTS_CACHE_TTL,
+    compress=settings.QUERY_RESULTS_CACHE_COMPRESS,
+)
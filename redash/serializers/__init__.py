@@ -17,8 +17,11 @@ from redash.models.parameterized_query import ParameterizedQuery
 
 from .query_result import (
     serialize_query_result,
+    serialize_query_result_to_json,
     serialize_query_result_to_dsv,
+    iter_query_result_dsv,
     serialize_query_result_to_xlsx,
+    iter_query_result_xlsx,
 )
 
 
@@ -1,9 +1,16 @@
 import io
 import csv
+import datetime
+import re
+import tempfile
+import zipfile
+from itertools import islice
+
 import xlsxwriter
-from funcy import rpartial, project
-from dateutil.parser import isoparse as parse_date
-from redash.utils import json_loads, UnicodeWriter
+from funcy import project
+from dateutil import tz
+from dateutil.parser import isoparse
+from redash.utils import json_dumps, json_loads, UnicodeWriter
 from redash.query_runner import TYPE_BOOLEAN, TYPE_DATE, TYPE_DATETIME
 from redash.authentication.org_resolving import current_org
 
@@ -29,6 +36,46 @@ def _convert_bool(value):
     return value
 
 
+ISO_DATETIME_REGEX = re.compile(
+    r"(\d{4})-(\d{2})-(\d{2})"
+    r"(?:[T ](\d{2}):(\d{2})(?::(\d{2})(?:\.(\d{1,6}))?)?(Z|[+-]\d{2}:\d{2})?)?$"
+)
+
+
+def parse_date(value):
+    """`isoparse`, with a fast path for the ISO 8601 formats query runners return."""
+    match = ISO_DATETIME_REGEX.match(value) if isinstance(value, str) else None
+    if match is None:
+        return isoparse(value)
+
+    year, month, day, hour, minute, second, fraction, offset = match.groups()
+
+    tzinfo = None
+    if offset == "Z":
+        tzinfo = tz.UTC
+    elif offset is not None:
+        seconds = int(offset[1:3]) * 3600 + int(offset[4:6]) * 60
+        if seconds == 0:
+            tzinfo = tz.UTC
+        else:
+            tzinfo = tz.tzoffset(None, -seconds if offset[0] == "-" else seconds)
+
+    try:
+        return datetime.datetime(
+            int(year),
+            int(month),
+            int(day),
+            int(hour or 0),
+            int(minute or 0),
+            int(second or 0),
+            int(fraction.ljust(6, "0")) if fraction else 0,
+            tzinfo=tzinfo,
+        )
+    except ValueError:
+        # Leave the edge cases (like 24:00) to isoparse.
+        return isoparse(value)
+
+
 def _convert_datetime(value, fmt):
     if not value:
         return value
@@ -42,6 +89,29 @@ def _convert_datetime(value, fmt):
     return ret
 
 
+class DatetimeConverter(object):
+    """Formats the values of a date/datetime column, converting each distinct
+    value only once (dates tend to repeat a lot)."""
+
+    max_cache_size = 100000
+
+    def __init__(self, fmt):
+        self.fmt = fmt
+        self.cache = {}
+
+    def __call__(self, value):
+        if value.__class__ is not str:
+            return _convert_datetime(value, self.fmt)
+
+        converted = self.cache.get(value)
+        if converted is None:
+            converted = _convert_datetime(value, self.fmt)
+            if len(self.cache) < self.max_cache_size:
+                self.cache[value] = converted
+
+        return converted
+
+
 def _get_column_lists(columns):
     date_format = _convert_format(current_org.get_setting("date_format"))
     datetime_format = _convert_format(
@@ -52,9 +122,9 @@ def _get_column_lists(columns):
     )
 
     special_types = {
-        TYPE_BOOLEAN: _convert_bool,
-        TYPE_DATE: rpartial(_convert_datetime, date_format),
-        TYPE_DATETIME: rpartial(_convert_datetime, datetime_format),
+        TYPE_BOOLEAN: lambda: _convert_bool,
+        TYPE_DATE: lambda: DatetimeConverter(date_format),
+        TYPE_DATETIME: lambda: DatetimeConverter(datetime_format),
     }
 
     fieldnames = []
@@ -65,7 +135,7 @@ def _get_column_lists(columns):
 
         for col_type in special_types.keys():
             if col["type"] == col_type:
-                special_columns[col["name"]] = special_types[col_type]
+                special_columns[col["name"]] = special_types[col_type]()
 
     return fieldnames, special_columns
 
@@ -78,10 +148,29 @@ def serialize_query_result(query_result, is_api_user):
         return query_result.to_dict()
 
 
-def serialize_query_result_to_dsv(query_result, delimiter):
-    s = io.StringIO()
+def serialize_query_result_to_json(query_result, is_api_user):
+    """Return `{"query_result": serialize_query_result(...)}` as JSON text.
+
+    The stored data is spliced into the response as is instead of being parsed and
+    encoded again, so the cost is proportional to its size rather than its structure.
+    """
+    if is_api_user:
+        d = project(query_result.to_dict(with_data=False), ["retrieved_at"])
+    else:
+        d = query_result.to_dict(with_data=False)
+
+    envelope = json_dumps(d)[:-1]
+    separator = ", " if d else ""
 
-    query_data = query_result.data
+    return '{{"query_result": {}{}"data": {}}}}}'.format(
+        envelope, separator, query_result.serialized_data
+    )
+
+
+def iter_query_result_dsv(query_result, delimiter, batch_size=1000):
+    """Yield the delimiter separated export of the query result (and of each of its
+    `data_ex` sub-results) in chunks of `batch_size` rows."""
+    query_data = query_result.lazy_data
     data_ex = query_data.get("data_ex")
 
     datas = []
@@ -92,31 +181,156 @@ def serialize_query_result_to_dsv(query_result, delimiter):
             if data is not None:
                 datas.append(data)
 
+    s = io.StringIO()
+    writer = csv.writer(s, delimiter=delimiter)
+
+    def flush():
+        chunk = s.getvalue()
+        s.seek(0)
+        s.truncate()
+        return chunk
+
     for data in datas:
         columns = data.get("columns")
         if columns is None or len(columns) == 0:
             continue
 
         fieldnames, special_columns = _get_column_lists(data["columns"] or [])
+        converters = [special_columns.get(name) for name in fieldnames]
 
-        writer = csv.DictWriter(s, extrasaction="ignore", fieldnames=fieldnames, delimiter=delimiter)
-        writer.writeheader()
+        writer.writerow(fieldnames)
 
-        for row in data["rows"]:
-            for col_name, converter in special_columns.items():
-                if col_name in row:
-                    row[col_name] = converter(row[col_name])
+        rows = iter(data["rows"])
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                break
 
-            writer.writerow(row)
+            # Convert the batch column by column; missing values stay empty.
+            columns = []
+            for name, converter in zip(fieldnames, converters):
+                values = [row.get(name, "") for row in batch]
+                if converter is not None:
+                    values = [converter(value) for value in values]
+                columns.append(values)
 
-    return s.getvalue()
+            writer.writerows(zip(*columns))
 
+            if len(batch) == batch_size:
+                yield flush()
 
-def serialize_query_result_to_xlsx(query_result):
-    output = io.BytesIO()
-    book = xlsxwriter.Workbook(output, {"constant_memory": True})
+    chunk = flush()
+    if chunk:
+        yield chunk
+
+
+def serialize_query_result_to_dsv(query_result, delimiter):
+    return "".join(iter_query_result_dsv(query_result, delimiter))
+
+
+def _xlsx_value(value):
+    # xlsxwriter can't write dicts or lists (JSON values), they're written as text.
+    if isinstance(value, (dict, list)):
+        return str(value)
+    return value
+
+
+class _ZipStream(object):
+    """A write-only file to build a zip file in, which is emptied as its content is
+    taken (zipfile doesn't need to seek back in files it can't `tell` in)."""
+
+    def __init__(self):
+        self.buffer = io.BytesIO()
+
+    def write(self, data):
+        return self.buffer.write(data)
+
+    def flush(self):
+        pass
+
+    def size(self):
+        return self.buffer.tell()
+
+    def take(self):
+        content = self.buffer.getvalue()
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        return content
+
+
+class _XlsxSheetWriter(object):
+    """Stands in for the temporary file xlsxwriter keeps the rows of a worksheet in
+    (in `constant_memory` mode), to write them to an entry of the export instead."""
+
+    def __init__(self, entry, buffer_size=64 * 1024):
+        self.entry = entry
+        self.buffer = io.StringIO()
+        self.buffer_size = buffer_size
+
+    def write(self, data):
+        self.buffer.write(data)
+        if self.buffer.tell() >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        self.entry.write(self.buffer.getvalue().encode("utf-8"))
+        self.buffer.seek(0)
+        self.buffer.truncate()
+
+    # xlsxwriter reads the rows back when the workbook is closed, but by then they
+    # are in the export already.
+    def seek(self, offset):
+        pass
+
+    def read(self, size=-1):
+        return ""
+
+    def close(self):
+        pass
+
+
+def _write_xlsx_sheet(sheet, data, entry):
+    """Write the result set to `sheet`, with its XML going to the zip `entry` as the
+    rows are written. Yields after each row.
 
-    query_data = query_result.data
+    This relies on how xlsxwriter (pinned in requirements.txt) writes worksheets
+    in `constant_memory` mode: each row is written to `row_data_fh` once the next
+    one is started, and the rest of the XML is only written when the workbook is
+    closed."""
+    sheet.row_data_fh.close()
+    sheet.row_data_fh = sheet.fh = writer = _XlsxSheetWriter(entry)
+
+    sheet._xml_declaration()
+    sheet._write_worksheet()
+    sheet._write_sheet_views()
+    sheet._write_sheet_format_pr()
+    sheet._xml_start_tag("sheetData")
+
+    names = [col["name"] for col in data["columns"]]
+    sheet.write_row(0, 0, names)
+    for r, row in enumerate(data["rows"], 1):
+        sheet.write_row(r, 0, [_xlsx_value(row.get(name)) for name in names])
+        yield
+
+    sheet._write_single_row()
+    sheet._xml_end_tag("sheetData")
+    # The links are written here and dropped, so that they're only added to the
+    # worksheet's relationships once (when the workbook is closed).
+    sheet._write_hyperlinks()
+    sheet.hyperlinks.clear()
+    sheet._write_page_margins()
+    sheet._xml_end_tag("worksheet")
+    writer.flush()
+
+
+def iter_query_result_xlsx(query_result, chunk_size=64 * 1024):
+    """Yield the Excel export of the query result (one sheet per result set) in
+    chunks, as it's built.
+
+    The worksheets are compressed into the export as their rows are written, and
+    the rest of the workbook (styles, relationships, etc.) is added once they're
+    all written."""
+    query_data = query_result.lazy_data
     data_ex = query_data.get("data_ex")
 
     datas = []
@@ -128,27 +342,49 @@ def serialize_query_result_to_xlsx(query_result):
             if name is not None and data is not None:
                 datas.append({"name": name, "data": data})
 
-    for item in datas:
-        name = item["name"]
-        data = item["data"]
-        columns = data.get("columns")
-        if columns is None or len(columns) == 0:
-            continue
+    stream = _ZipStream()
+    export = zipfile.ZipFile(stream, "w", compression=zipfile.ZIP_DEFLATED)
 
-        sheet = book.add_worksheet(name)
+    with tempfile.TemporaryFile() as output:
+        # Strings that look like formulas are written as they are.
+        book = xlsxwriter.Workbook(
+            output, {"constant_memory": True, "strings_to_formulas": False}
+        )
+
+        sheets = []
+        for item in datas:
+            columns = item["data"].get("columns")
+            if columns is None or len(columns) == 0:
+                continue
+
+            sheets.append((book.add_worksheet(item["name"]), item["data"]))
+
+        # The first sheet is selected when the workbook is closed, but by then it
+        # has been written already.
+        if sheets:
+            sheets[0][0].activate()
 
-        column_names = []
-        for c, col in enumerate(data["columns"]):
-            sheet.write(0, c, col["name"])
-            column_names.append(col["name"])
+        streamed = set()
+        for index, (sheet, data) in enumerate(sheets, 1):
+            filename = "xl/worksheets/sheet{}.xml".format(index)
+            streamed.add(filename)
 
-        for r, row in enumerate(data["rows"]):
-            for c, name in enumerate(column_names):
-                v = row.get(name)
-                if isinstance(v, (dict, list)):
-                    v = str(v)
-                sheet.write(r + 1, c, v)
+            with export.open(filename, "w") as entry:
+                for _ in _write_xlsx_sheet(sheet, data, entry):
+                    if stream.size() >= chunk_size:
+                        yield stream.take()
 
-    book.close()
+        book.close()
 
-    return output.getvalue()
+        output.seek(0)
+        with zipfile.ZipFile(output) as workbook:
+            for info in workbook.infolist():
+                if info.filename not in streamed:
+                    export.writestr(info, workbook.read(info))
+
+    export.close()
+    yield stream.take()
+
+
+def serialize_query_result_to_xlsx(query_result):
+    return b"".join(iter_query_result_xlsx(query_result))
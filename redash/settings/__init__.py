@@ -7,6 +7,7 @@ from flask_talisman import talisman
 from .helpers import (
     fix_assets_path,
     array_from_string,
+    dict_from_string,
     parse_boolean,
     int_or_none,
     set_from_string,
@@ -55,6 +56,122 @@ QUERY_RESULTS_CLEANUP_MAX_AGE = int(
     os.environ.get("REDASH_QUERY_RESULTS_CLEANUP_MAX_AGE", "30")
 )
 
+# How query results are stored in the query_results table: "json" keeps each result as a
+# single JSON document, "columnar" stores the values column-wise and compressed (zstd,
+# lz4 or zlib -- whichever is installed, unless REDASH_QUERY_RESULTS_COMPRESSION is set).
+# Existing results can be converted with `manage.py database convert_query_results`.
+QUERY_RESULTS_STORAGE_FORMAT = os.environ.get(
+    "REDASH_QUERY_RESULTS_STORAGE_FORMAT", "json"
+)
+QUERY_RESULTS_COMPRESSION = os.environ.get("REDASH_QUERY_RESULTS_COMPRESSION", None)
+
+# Whether to use BaseQueryRunner.run_query_stream for query runners that support it, so
+# workers only hold one batch of rows in memory while serializing the result. The caps
+# below apply to streamed results: results over the cap are truncated and flagged with
+# "truncated": true. 0 means no limit.
+FEATURE_STREAM_QUERY_RESULTS = parse_boolean(
+    os.environ.get("REDASH_FEATURE_STREAM_QUERY_RESULTS", "false")
+)
+QUERY_RESULTS_MAX_ROWS = int(os.environ.get("REDASH_QUERY_RESULTS_MAX_ROWS", "0"))
+QUERY_RESULTS_MAX_BYTES = int(os.environ.get("REDASH_QUERY_RESULTS_MAX_BYTES", "0"))
+# Queries whose results are over these limits fail with a "result too large" error
+# (streamed or not), unless their data source sets its own limits. 0 means no limit.
+QUERY_RESULTS_ROW_LIMIT = int(os.environ.get("REDASH_QUERY_RESULTS_ROW_LIMIT", "0"))
+QUERY_RESULTS_BYTE_LIMIT = int(os.environ.get("REDASH_QUERY_RESULTS_BYTE_LIMIT", "0"))
+
+# Cache the serialized API response of query results (which never change once stored)
+# in a per process LRU of QUERY_RESULTS_CACHE_MEMORY_SIZE bytes, backed by Redis.
+QUERY_RESULTS_CACHE_ENABLED = parse_boolean(
+    os.environ.get("REDASH_QUERY_RESULTS_CACHE_ENABLED", "false")
+)
+QUERY_RESULTS_CACHE_MEMORY_SIZE = int(
+    os.environ.get("REDASH_QUERY_RESULTS_CACHE_MEMORY_SIZE", 64 * 1024 * 1024)
+)
+QUERY_RESULTS_CACHE_MAX_ITEM_SIZE = int(
+    os.environ.get("REDASH_QUERY_RESULTS_CACHE_MAX_ITEM_SIZE", 8 * 1024 * 1024)
+)
+QUERY_RESULTS_CACHE_TTL = int(os.environ.get("REDASH_QUERY_RESULTS_CACHE_TTL", 86400))
+# Redis of the cached payloads (Redash's own by default, without decoded responses
+# since the payloads are binary).
+QUERY_RESULTS_CACHE_REDIS_URL = os.environ.get(
+    "REDASH_QUERY_RESULTS_CACHE_REDIS_URL", _REDIS_URL
+)
+QUERY_RESULTS_CACHE_COMPRESS = parse_boolean(
+    os.environ.get("REDASH_QUERY_RESULTS_CACHE_COMPRESS", "true")
+)
+
+# JSON backend of redash.utils.json_dumps: "simplejson" or "orjson". orjson (>=3.9)
+# is used to serialize query results (json_dumps calls with ignore_nan), falling back
+# to simplejson for anything it can't encode the same way. Its output is compact and
+# isn't ASCII-escaped.
+JSON_BACKEND = os.environ.get("REDASH_JSON_BACKEND", "simplejson")
+
+# Spread scheduled queries that are due at the same time over this many seconds,
+# each query by its own offset, instead of enqueuing them all in the same refresh.
+# Queries with only an interval are spread over the largest divisor of the window
+# their interval is a multiple of. 0 disables spreading.
+SCHEDULED_QUERIES_SPREAD_WINDOW = int(
+    os.environ.get("REDASH_SCHEDULED_QUERIES_SPREAD_WINDOW", 0)
+)
+# Maximum number of scheduled queries enqueued per data source in each refresh (0 for
+# no limit). Due queries over the limit are enqueued by the following refreshes.
+SCHEDULED_QUERIES_MAX_PER_DATA_SOURCE = int(
+    os.environ.get("REDASH_SCHEDULED_QUERIES_MAX_PER_DATA_SOURCE", 0)
+)
+
+# Hand out the jobs of each queue in fair-share order across organizations and the
+# users within each organization, instead of FIFO (see
+# redash.tasks.worker.FairQueue).
+QUEUE_FAIR_SHARE = parse_boolean(os.environ.get("REDASH_QUEUE_FAIR_SHARE", "false"))
+
+# Weight of the latest runtime in the moving average of a query's runtimes, which
+# routes queries of data sources with runtime thresholds to their fast or slow lane.
+QUERY_RUNTIME_EWMA_ALPHA = float(os.environ.get("REDASH_QUERY_RUNTIME_EWMA_ALPHA", 0.3))
+# Runtimes of queries that didn't run for this many seconds are forgotten.
+QUERY_RUNTIME_TTL = int(os.environ.get("REDASH_QUERY_RUNTIME_TTL", 7 * 24 * 60 * 60))
+
+# Scheduler processes hold their membership (and the leader its leadership) with a
+# lease of this many seconds, renewed every second. When one dies, the others take
+# over its periodic jobs within this time.
+SCHEDULER_LEASE_TIMEOUT = int(os.environ.get("REDASH_SCHEDULER_LEASE_TIMEOUT", 5))
+# Number of shards (by query id) scheduled queries are refreshed in, each by its own
+# periodic job. The shards are split among the running scheduler processes.
+SCHEDULED_QUERIES_SHARDS = int(os.environ.get("REDASH_SCHEDULED_QUERIES_SHARDS", 1))
+
+# Adaptive refresh (opt-in per organization, with its adaptive_refresh setting):
+# scheduled queries whose results weren't read for this many seconds refresh
+# ADAPTIVE_REFRESH_STRETCH times less often, and stop refreshing after
+# ADAPTIVE_REFRESH_PAUSE_AFTER seconds (0 to never stop). They go back to their
+# schedule once their results are read.
+ADAPTIVE_REFRESH_COLD_AFTER = int(
+    os.environ.get("REDASH_ADAPTIVE_REFRESH_COLD_AFTER", 14 * 24 * 60 * 60)
+)
+ADAPTIVE_REFRESH_STRETCH = int(os.environ.get("REDASH_ADAPTIVE_REFRESH_STRETCH", 4))
+ADAPTIVE_REFRESH_PAUSE_AFTER = int(
+    os.environ.get("REDASH_ADAPTIVE_REFRESH_PAUSE_AFTER", 0)
+)
+
+# Cache warming: ahead of the times of day dashboards are usually viewed, their
+# queries are executed (with the parameters they were viewed with), so the results
+# are fresh in the cache when they're opened. Every CACHE_WARMING_INTERVAL seconds,
+# the dashboards viewed at the time of day CACHE_WARMING_LEAD_TIME seconds ahead on
+# at least CACHE_WARMING_MIN_DAYS of the last CACHE_WARMING_HISTORY_DAYS days are
+# warmed, up to CACHE_WARMING_MAX_PER_DATA_SOURCE queries per data source.
+CACHE_WARMING_ENABLED = parse_boolean(
+    os.environ.get("REDASH_CACHE_WARMING_ENABLED", "false")
+)
+CACHE_WARMING_INTERVAL = int(os.environ.get("REDASH_CACHE_WARMING_INTERVAL", 15 * 60))
+CACHE_WARMING_LEAD_TIME = int(os.environ.get("REDASH_CACHE_WARMING_LEAD_TIME", 30 * 60))
+CACHE_WARMING_HISTORY_DAYS = int(os.environ.get("REDASH_CACHE_WARMING_HISTORY_DAYS", 14))
+CACHE_WARMING_MIN_DAYS = int(os.environ.get("REDASH_CACHE_WARMING_MIN_DAYS", 3))
+# Most viewed parameter sets warmed for each query.
+CACHE_WARMING_PARAMETER_SETS = int(
+    os.environ.get("REDASH_CACHE_WARMING_PARAMETER_SETS", 3)
+)
+CACHE_WARMING_MAX_PER_DATA_SOURCE = int(
+    os.environ.get("REDASH_CACHE_WARMING_MAX_PER_DATA_SOURCE", 20)
+)
+
 SCHEMAS_REFRESH_SCHEDULE = int(os.environ.get("REDASH_SCHEMAS_REFRESH_SCHEDULE", 30))
 
 AUTH_TYPE = os.environ.get("REDASH_AUTH_TYPE", "api_key")
@@ -242,6 +359,48 @@ JOB_DEFAULT_FAILURE_TTL = int(
     os.environ.get("REDASH_JOB_DEFAULT_FAILURE_TTL",  60 * 60 * 24 * 2)
 )
 
+# Workers started with --prefork (or REDASH_WORKER_PREFORK) run their jobs in a
+# long-lived work horse, which is replaced after running WORKER_HORSE_MAX_JOBS jobs
+# or once it used more than WORKER_HORSE_MAX_MEMORY MB (0 for no limit).
+WORKER_PREFORK = parse_boolean(os.environ.get("REDASH_WORKER_PREFORK", "false"))
+WORKER_HORSE_MAX_JOBS = int(os.environ.get("REDASH_WORKER_HORSE_MAX_JOBS", 1000))
+WORKER_HORSE_MAX_MEMORY = int(os.environ.get("REDASH_WORKER_HORSE_MAX_MEMORY", 1024))
+# Number of jobs the async worker (`rq async_worker`, for the queues of HTTP data
+# sources) runs at once.
+ASYNC_WORKER_CONCURRENCY = int(os.environ.get("REDASH_ASYNC_WORKER_CONCURRENCY", 200))
+# Idle connections per data source the work horses of the prefork worker and the
+# async worker keep open between queries, for the query runners that pool them (0
+# opens a connection for each query). They're closed once they were idle for
+# QUERY_RUNNER_POOL_MAX_IDLE_TIME seconds or open for QUERY_RUNNER_POOL_MAX_LIFETIME.
+QUERY_RUNNER_POOL_SIZE = int(os.environ.get("REDASH_QUERY_RUNNER_POOL_SIZE", 0))
+QUERY_RUNNER_POOL_MAX_IDLE_TIME = int(
+    os.environ.get("REDASH_QUERY_RUNNER_POOL_MAX_IDLE_TIME", 300)
+)
+QUERY_RUNNER_POOL_MAX_LIFETIME = int(
+    os.environ.get("REDASH_QUERY_RUNNER_POOL_MAX_LIFETIME", 3600)
+)
+# With QUERY_BATCHING on, ad-hoc queries of a data source that usually take up to
+# QUERY_BATCH_MAX_RUNTIME seconds and are enqueued within QUERY_BATCH_WINDOW seconds
+# of each other (up to QUERY_BATCH_MAX_SIZE of them) run in one job, over the same
+# connections, QUERY_BATCH_THREADS at a time.
+QUERY_BATCHING = parse_boolean(os.environ.get("REDASH_QUERY_BATCHING", "false"))
+QUERY_BATCH_WINDOW = float(os.environ.get("REDASH_QUERY_BATCH_WINDOW", 0.1))
+QUERY_BATCH_MAX_SIZE = int(os.environ.get("REDASH_QUERY_BATCH_MAX_SIZE", 50))
+QUERY_BATCH_MAX_RUNTIME = float(os.environ.get("REDASH_QUERY_BATCH_MAX_RUNTIME", 1))
+QUERY_BATCH_THREADS = int(os.environ.get("REDASH_QUERY_BATCH_THREADS", 1))
+# Memory (MB of RSS) a job may add to its work horse: over it, the job is
+# interrupted, and over WORKER_MEMORY_HARD_LIMIT_FACTOR times it, the work horse is
+# killed. Data sources can set their own limit; otherwise the limit of the job's queue
+# (REDASH_WORKER_QUEUE_MEMORY_LIMITS="queries:2048,schemas:512") or
+# WORKER_MEMORY_LIMIT applies. 0 means no limit.
+WORKER_MEMORY_LIMIT = int(os.environ.get("REDASH_WORKER_MEMORY_LIMIT", 0))
+WORKER_QUEUE_MEMORY_LIMITS = dict_from_string(
+    os.environ.get("REDASH_WORKER_QUEUE_MEMORY_LIMITS", ""), int
+)
+WORKER_MEMORY_HARD_LIMIT_FACTOR = float(
+    os.environ.get("REDASH_WORKER_MEMORY_HARD_LIMIT_FACTOR", 1.5)
+)
+
 LOG_LEVEL = os.environ.get("REDASH_LOG_LEVEL", "INFO")
 LOG_STDOUT = parse_boolean(os.environ.get("REDASH_LOG_STDOUT", "false"))
 LOG_PREFIX = os.environ.get("REDASH_LOG_PREFIX", "")
@@ -19,6 +19,12 @@ def set_from_string(s):
     return set(array_from_string(s))
 
 
+def dict_from_string(s, value_type=str):
+    """Parses "key:value,key:value" into a dict."""
+    items = (item.split(":", 1) for item in array_from_string(s))
+    return {key.strip(): value_type(value) for key, value in items}
+
+
 def parse_boolean(s):
     """Takes a string and returns the equivalent as a boolean value."""
     s = s.strip().lower()
@@ -43,6 +43,12 @@ FEATURE_SHOW_PERMISSIONS_CONTROL = parse_boolean(
 SEND_EMAIL_ON_FAILED_SCHEDULED_QUERIES = parse_boolean(
     os.environ.get("REDASH_SEND_EMAIL_ON_FAILED_SCHEDULED_QUERIES", "false")
 )
+# Share of the query queues an organization gets relative to other organizations
+# with queued queries (see redash.tasks.worker.FairQueue).
+QUEUE_WEIGHT = float(os.environ.get("REDASH_QUEUE_WEIGHT", 1))
+# Refresh scheduled queries whose results aren't read less often (see
+# ADAPTIVE_REFRESH_COLD_AFTER).
+ADAPTIVE_REFRESH = parse_boolean(os.environ.get("REDASH_ADAPTIVE_REFRESH", "false"))
 
 settings = {
     "beacon_consent": None,
@@ -65,4 +71,6 @@ settings = {
     "auth_jwt_auth_header_name": JWT_AUTH_HEADER_NAME,
     "feature_show_permissions_control": FEATURE_SHOW_PERMISSIONS_CONTROL,
     "send_email_on_failed_scheduled_queries": SEND_EMAIL_ON_FAILED_SCHEDULED_QUERIES,
+    "queue_weight": QUEUE_WEIGHT,
+    "adaptive_refresh": ADAPTIVE_REFRESH,
 }
@@ -12,10 +12,13 @@ from .queries import (
     refresh_schemas,
     cleanup_query_results,
     empty_schedules,
+    wake_parked_queries,
+    warm_caches,
+    recover_query_batches,
 )
 from .alerts import check_alerts_for_query
 from .failure_report import send_aggregated_errors
-from .worker import Worker, Queue, Job
+from .worker import Worker, AsyncWorker, PreforkWorker, Queue, Job
 from .schedule import rq_scheduler, schedule_periodic_jobs, periodic_job_definitions
 
 from redash import rq_redis_connection
@@ -37,6 +37,12 @@ def check_alerts_for_query(query_id):
 
     query = models.Query.query.get(query_id)
 
+    if query.alerts and query.latest_query_data:
+        # Alerts read the results, which keeps them refreshing with adaptive refresh.
+        models.query_result_reads.touch(
+            query.data_source_id, query.latest_query_data.query_hash
+        )
+
     for alert in query.alerts:
         logger.info("Checking alert (%d) of query %d.", alert.id, query_id)
         new_state = alert.evaluate()
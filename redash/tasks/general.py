@@ -2,11 +2,11 @@ import requests
 from datetime import datetime
 
 from flask_mail import Message
-from rq import Connection, Queue
+from rq import Connection
 from rq.registry import FailedJobRegistry
-from rq.job import Job
 from redash import mail, models, settings, rq_redis_connection
 from redash.models import users
+from redash.tasks.worker import Job, Queue
 from redash.version_check import run_version_check
 from redash.worker import job, get_job_logger
 
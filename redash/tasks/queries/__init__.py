@@ -3,5 +3,8 @@ from .maintenance import (
     refresh_schemas,
     cleanup_query_results,
     empty_schedules,
+    wake_parked_queries,
 )
 from .execution import execute_query, enqueue_query
+from .batching import recover_query_batches
+from .warming import warm_caches
@@ -0,0 +1,415 @@
+"""
+Batches of short ad-hoc queries of a data source (like the queries of a dashboard's
+widgets, which are enqueued at once): instead of a job each, which forks a work
+horse and connects to the data source, the queries enqueued within
+QUERY_BATCH_WINDOW seconds of each other run in one job, over the same connections.
+
+Each query still gets its job, which is saved but not pushed to its queue: the
+batch's job runs it (like a worker would), so polling and cancelling it work like
+they do for any other query job. The batch's job is enqueued when the batch is
+opened, and waits for the window to be over (or the batch to be full) before it
+runs the jobs. The jobs of batches whose job failed (or was lost) before running
+them are enqueued on their own by `recover_query_batches`.
+"""
+import ctypes
+import math
+import signal
+import threading
+import time
+import traceback
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from uuid import uuid4
+
+from flask import current_app, has_app_context
+from rq import get_current_job
+from rq.exceptions import NoSuchJobError
+from rq.job import JobStatus
+from rq.registry import FailedJobRegistry, FinishedJobRegistry, StartedJobRegistry
+from rq.timeouts import JobTimeoutException, UnixSignalDeathPenalty
+from rq.utils import as_text, utcformat, utcnow
+
+from redash import redis_connection, rq_redis_connection, settings, statsd_client
+from redash.query_runner.pool import reused_connections
+from redash.tasks.worker import Job, Parked, Queue
+from redash.worker import get_job_logger
+
+from .runtimes import estimate_runtime
+
+logger = get_job_logger(__name__)
+
+# KEYS: open batch, batches
+# ARGV: job id, new batch id, window (ms), max size, expiry (seconds)
+# Adds the job to the open batch of its data source and queue, opening a new one
+# (for `window` ms) if there's none. Returns the batch's id and size: the enqueuer
+# that opened it schedules its job.
+ADD_TO_BATCH = """
+local batch_id = redis.call('GET', KEYS[1])
+if not batch_id then
+    batch_id = ARGV[2]
+    redis.call('SET', KEYS[1], batch_id, 'PX', ARGV[3])
+    redis.call('HSET', KEYS[2], batch_id, KEYS[1])
+end
+local batch_key = 'query_batch:' .. batch_id
+local size = redis.call('RPUSH', batch_key, ARGV[1])
+redis.call('EXPIRE', batch_key, ARGV[5])
+if size >= tonumber(ARGV[4]) then
+    redis.call('DEL', KEYS[1])
+end
+return {batch_id, size}
+"""
+
+# KEYS: open batch, batch
+# ARGV: batch id
+# Closes the batch (if it's still open) and returns the ids of its jobs. Each job is
+# removed from the batch when it's run or enqueued, so the batch's job and
+# `recover_query_batches` don't both take it.
+TAKE_BATCH = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    redis.call('DEL', KEYS[1])
+end
+return redis.call('LRANGE', KEYS[2], 0, -1)
+"""
+
+add_to_batch = redis_connection.register_script(ADD_TO_BATCH)
+take_batch = redis_connection.register_script(TAKE_BATCH)
+
+# The open batch key of each batch with jobs left.
+BATCHES_KEY = "query_batches"
+
+
+def _open_batch_key(data_source_id, queue_name):
+    return "query_batch:open:{}:{}".format(data_source_id, queue_name)
+
+
+def _batch_key(batch_id):
+    return "query_batch:{}".format(batch_id)
+
+
+def batches(data_source, query_hash, scheduled_query):
+    """Whether the query runs in a batch: ad-hoc queries that usually take up to
+    QUERY_BATCH_MAX_RUNTIME seconds do, when batching is on."""
+    if not settings.QUERY_BATCHING or scheduled_query is not None:
+        return False
+
+    estimate = estimate_runtime(data_source.id, query_hash)
+    return estimate is not None and estimate <= settings.QUERY_BATCH_MAX_RUNTIME
+
+
+def _batch_timeout(timeout):
+    """The time limit of a batch of jobs with the time limit."""
+    if not timeout or timeout < 0:
+        return timeout
+
+    threads = max(1, settings.QUERY_BATCH_THREADS)
+    return timeout * math.ceil(settings.QUERY_BATCH_MAX_SIZE / threads)
+
+
+def enqueue_in_batch(job, queue, data_source_id):
+    """
+    Saves the (queued) job and adds it to the open batch of its data source on the
+    queue, instead of pushing it to the queue. Enqueues the batch's job when the job
+    opens a new batch.
+    """
+    job.meta["batched"] = True
+    job.enqueued_at = utcnow()
+    job.save()
+
+    batch_id, size = add_to_batch(
+        keys=[_open_batch_key(data_source_id, queue.name), BATCHES_KEY],
+        args=[
+            job.id,
+            str(uuid4()),
+            max(1, int(settings.QUERY_BATCH_WINDOW * 1000)),
+            settings.QUERY_BATCH_MAX_SIZE,
+            settings.JOB_EXPIRY_TIME,
+        ],
+    )
+    batch_id = as_text(batch_id)
+    statsd_client.incr("query_execution.batched")
+
+    if size == 1:
+        queue.enqueue_call(
+            execute_query_batch,
+            args=(data_source_id, batch_id),
+            job_id=batch_id,
+            timeout=_batch_timeout(job.timeout),
+            result_ttl=0,
+            meta={
+                key: value
+                for key, value in job.meta.items()
+                if key not in ("query_id", "batched")
+            },
+        )
+
+    return job
+
+
+def _requeue(job):
+    Queue(job.origin, connection=rq_redis_connection).enqueue_job(job, at_front=True)
+
+
+def _perform(job):
+    """Runs a job of a batch and stores its result, like a worker does."""
+    try:
+        job.refresh()
+    except NoSuchJobError:
+        return
+
+    # Batched jobs aren't on their queue, so cancelling them only flags them.
+    if job.is_cancelled:
+        logger.info("Job %s has been cancelled.", job.id)
+        return
+
+    started_job_registry = StartedJobRegistry(
+        job.origin, rq_redis_connection, job_class=Job
+    )
+    with rq_redis_connection.pipeline() as pipeline:
+        started_job_registry.add(
+            job, job.timeout or Queue.DEFAULT_TIMEOUT, pipeline=pipeline
+        )
+        job.set_status(JobStatus.STARTED, pipeline=pipeline)
+        pipeline.hset(job.key, "started_at", utcformat(utcnow()))
+        pipeline.execute()
+    job.started_at = utcnow()
+
+    try:
+        with _time_limit(job):
+            rv = job.perform()
+    except Exception:
+        job.ended_at = utcnow()
+        exc_string = traceback.format_exc()
+        logger.error("Job %s of a batch failed: %s", job.id, exc_string)
+        with rq_redis_connection.pipeline() as pipeline:
+            job.set_status(JobStatus.FAILED, pipeline=pipeline)
+            started_job_registry.remove(job, pipeline=pipeline)
+            FailedJobRegistry(job.origin, rq_redis_connection, job_class=Job).add(
+                job, ttl=job.failure_ttl, exc_string=exc_string, pipeline=pipeline
+            )
+            pipeline.execute()
+        return
+
+    job.ended_at = utcnow()
+    if isinstance(rv, Parked):
+        started_job_registry.remove(job)
+        return
+
+    result_ttl = job.get_result_ttl(settings.JOB_EXPIRY_TIME)
+    with rq_redis_connection.pipeline() as pipeline:
+        if result_ttl != 0:
+            job.set_status(JobStatus.FINISHED, pipeline=pipeline)
+            job.save(pipeline=pipeline, include_meta=False)
+            FinishedJobRegistry(job.origin, rq_redis_connection, job_class=Job).add(
+                job, result_ttl, pipeline
+            )
+        job.cleanup(result_ttl, pipeline=pipeline, remove_from_queue=False)
+        started_job_registry.remove(job, pipeline=pipeline)
+        pipeline.execute()
+
+
+def _in_main_thread():
+    return threading.current_thread() is threading.main_thread()
+
+
+@contextmanager
+def _time_limit(job):
+    """
+    Interrupts the job with JobTimeoutException once it's past its time limit. In
+    the main thread it's an alarm, like the work horse's, and the alarm of the
+    batch's own time limit is set again afterwards. Other threads get the exception
+    as soon as they run Python code again (e.g. once a call to the data source
+    returns); the batch's time limit stops the ones that don't.
+    """
+    if not job.timeout or job.timeout < 0:
+        yield
+    elif _in_main_thread():
+        with _alarm(job.timeout, job.id):
+            yield
+    else:
+        with _ThreadTimeLimit(job.timeout):
+            yield
+
+
+@contextmanager
+def _alarm(timeout, job_id):
+    started = time.monotonic()
+    handler = signal.getsignal(signal.SIGALRM)
+    batch_left = signal.alarm(0)
+    if batch_left and batch_left <= timeout:
+        # The batch's own alarm goes off first.
+        signal.alarm(batch_left)
+        yield
+        return
+
+    try:
+        with UnixSignalDeathPenalty(timeout, JobTimeoutException, job_id=job_id):
+            yield
+    finally:
+        signal.signal(signal.SIGALRM, handler)
+        if batch_left:
+            elapsed = int(time.monotonic() - started)
+            signal.alarm(max(1, batch_left - elapsed))
+
+
+def _raise_in_thread(thread_id, exception):
+    """Raises the exception in the thread (None clears a pending one)."""
+    ctypes.pythonapi.PyThreadState_SetAsyncExc(
+        ctypes.c_ulong(thread_id),
+        ctypes.py_object(exception) if exception is not None else None,
+    )
+
+
+class _ThreadTimeLimit(object):
+    def __init__(self, timeout):
+        self.thread_id = threading.get_ident()
+        self.lock = threading.Lock()
+        self.done = False
+        self.timer = threading.Timer(timeout, self.expire)
+        self.timer.daemon = True
+
+    def expire(self):
+        with self.lock:
+            if not self.done:
+                _raise_in_thread(self.thread_id, JobTimeoutException)
+
+    def __enter__(self):
+        self.timer.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        with self.lock:
+            self.done = True
+        self.timer.cancel()
+        # In case it expired as the job was done, but wasn't raised yet.
+        _raise_in_thread(self.thread_id, None)
+
+
+def _take(batch_key, job):
+    """Removes the job from its batch; False if it was taken already."""
+    return redis_connection.lrem(batch_key, 1, job.id) > 0
+
+
+def _perform_all(jobs, batch_key, app=None):
+    if app is not None:
+        with app.app_context():
+            return _perform_all(jobs, batch_key)
+
+    while True:
+        try:
+            job = jobs.popleft()
+        except IndexError:
+            return
+        if _take(batch_key, job):
+            _perform(job)
+
+
+def _perform_in_threads(jobs, batch_key, threads):
+    app = current_app._get_current_object() if has_app_context() else None
+    with ThreadPoolExecutor(threads) as executor:
+        futures = [
+            executor.submit(_perform_all, jobs, batch_key, app) for _ in range(threads)
+        ]
+        try:
+            for future in futures:
+                future.result()
+        except BaseException:
+            # Stops the threads from taking the jobs that are left.
+            _requeue_all(jobs, batch_key)
+            raise
+
+
+def _requeue_all(jobs, batch_key):
+    # Last first, so they're at the front of their queue in order.
+    while True:
+        try:
+            job = jobs.pop()
+        except IndexError:
+            return
+        if _take(batch_key, job):
+            _requeue(job)
+
+
+def _fetch_jobs(job_ids):
+    return deque(
+        job
+        for job in Job.fetch_many(
+            [as_text(job_id) for job_id in job_ids], connection=rq_redis_connection
+        )
+        if job is not None
+    )
+
+
+def _wait_until_closed(open_batch_key, batch_id):
+    """Waits for the batch's window to be over, unless it's full already."""
+    while True:
+        with redis_connection.pipeline() as pipeline:
+            pipeline.get(open_batch_key)
+            pipeline.pttl(open_batch_key)
+            open_batch_id, ttl = pipeline.execute()
+        if open_batch_id != batch_id or ttl <= 0:
+            return
+        time.sleep(min(ttl, 10) / 1000)
+
+
+def execute_query_batch(data_source_id, batch_id):
+    """
+    Runs the jobs of a batch once it's closed, QUERY_BATCH_THREADS at a time over
+    up to as many connections of the data source. Jobs the batch didn't get to
+    (because it was interrupted) are enqueued on their own.
+    """
+    queue_name = get_current_job().origin
+    open_batch_key = _open_batch_key(data_source_id, queue_name)
+    batch_key = _batch_key(batch_id)
+    _wait_until_closed(open_batch_key, batch_id)
+    job_ids = take_batch(keys=[open_batch_key, batch_key], args=[batch_id])
+    jobs = _fetch_jobs(job_ids)
+    threads = max(1, min(settings.QUERY_BATCH_THREADS, len(jobs)))
+    logger.info(
+        "Running batch %s of %d queries of data source %s, %d at a time",
+        batch_id,
+        len(jobs),
+        data_source_id,
+        threads,
+    )
+
+    try:
+        with reused_connections(threads):
+            if threads == 1:
+                _perform_all(jobs, batch_key)
+            else:
+                _perform_in_threads(jobs, batch_key, threads)
+    finally:
+        _requeue_all(jobs, batch_key)
+        redis_connection.hdel(BATCHES_KEY, batch_id)
+
+
+def recover_query_batches():
+    """
+    Enqueues the jobs of batches whose job failed, or was lost, before it ran them
+    (for example because its work horse was killed), on their own.
+    """
+    for batch_id, open_batch_key in redis_connection.hgetall(BATCHES_KEY).items():
+        batch_id = as_text(batch_id)
+        # Open batches' jobs are being scheduled.
+        if as_text(redis_connection.get(open_batch_key) or "") == batch_id:
+            continue
+
+        try:
+            batch = Job.fetch(batch_id, connection=rq_redis_connection)
+        except NoSuchJobError:
+            batch = None
+        if batch is not None and batch.get_status() != JobStatus.FAILED:
+            continue
+
+        batch_key = _batch_key(batch_id)
+        jobs = _fetch_jobs(
+            take_batch(keys=[open_batch_key, batch_key], args=[batch_id])
+        )
+        logger.warning(
+            "Enqueuing the %d queries left in batch %s on their own.",
+            len(jobs),
+            batch_id,
+        )
+        _requeue_all(jobs, batch_key)
+        redis_connection.hdel(BATCHES_KEY, batch_id)
@@ -1,20 +1,38 @@
+import asyncio
+import contextvars
+import functools
 import signal
+import tempfile
+import threading
 import time
-import redis
+from uuid import uuid4
 
+from funcy import chunks
 from rq import get_current_job
 from rq.job import JobStatus
 from rq.timeouts import JobTimeoutException
 from rq.exceptions import NoSuchJobError
-
-from redash import models, redis_connection, settings
-from redash.query_runner import InterruptException
-from redash.tasks.worker import Queue, Job
+from rq.utils import as_text
+
+from redash import (
+    models,
+    redis_connection,
+    rq_redis_connection,
+    settings,
+    statsd_client,
+)
+from redash.models.base import session_scope
+from redash.query_runner import InterruptException, ResultTooLarge
+from redash.tasks.worker import Queue, Job, Parked
 from redash.tasks.alerts import check_alerts_for_query
 from redash.tasks.failure_report import track_failure
-from redash.utils import gen_query_hash, json_dumps, utcnow
+from redash.utils import columnar, gen_query_hash, json_dumps, utcnow
 from redash.worker import get_job_logger
 
+from .batching import batches, enqueue_in_batch
+from .runtimes import route_queries, route_query, track_runtime
+from .slots import DataSourceSlots
+
 TIMEOUT_MESSAGE = "Query exceeded Redash query execution time limit."
 def get_logger():
     return get_job_logger(__name__)
@@ -28,106 +46,459 @@ def _unlock(query_hash, data_source_id):
     redis_connection.delete(_job_lock_id(query_hash, data_source_id))
 
 
+# How long a job lock may point to a job that wasn't saved yet, before the lock is
+# considered stale: the enqueuer that reserved it is between the two steps.
+JOB_RESERVATION_TIMEOUT = 10
+
+# KEYS: job lock
+# ARGV: new job id, expiry (seconds), stale job id (or "")
+# Reserves the lock for the new job, unless it holds another (live) job: returns
+# the id of the job the lock holds, and how long ago (in ms) it was reserved.
+RESERVE_JOB_LOCK = """
+local current = redis.call('GET', KEYS[1])
+if current and current ~= ARGV[3] then
+    local ttl = redis.call('PTTL', KEYS[1])
+    return {current, tonumber(ARGV[2]) * 1000 - ttl}
+end
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+return {ARGV[1], 0}
+"""
+
+# KEYS: job lock
+# ARGV: job id
+RELEASE_JOB_LOCK = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+reserve_job_lock = redis_connection.register_script(RESERVE_JOB_LOCK)
+release_job_lock = redis_connection.register_script(RELEASE_JOB_LOCK)
+
+
+def _queue_name(data_source, scheduled_query):
+    if scheduled_query:
+        return data_source.scheduled_queue_name  #默认都是scheduled_queries
+    else:
+        return data_source.queue_name #默认都是queries
+
+
+def _job_arguments(data_source, user_id, is_api_key, scheduled_query, query_id):
+    """The keyword arguments of `execute_query` and the RQ options of the job."""
+    scheduled_query_id = scheduled_query.id if scheduled_query else None
+    execute_kwargs = {
+        "user_id": user_id,
+        "scheduled_query_id": scheduled_query_id,
+        "is_api_key": is_api_key,
+    }
+    options = {
+        "job_timeout": settings.dynamic_settings.query_time_limit(
+            scheduled_query, user_id, data_source.org_id
+        ),
+        "meta": {
+            "data_source_id": data_source.id,
+            "org_id": data_source.org_id,
+            "scheduled": scheduled_query_id is not None,
+            "query_id": query_id,
+            "user_id": user_id,
+            "queue_weight": data_source.org.get_setting("queue_weight"),
+            "memory_limit": data_source.memory_limit,
+        },
+    }
+
+    if not scheduled_query:
+        options["result_ttl"] = settings.JOB_EXPIRY_TIME
+
+    return execute_kwargs, options
+
+
 def enqueue_query(
     query, data_source, user_id, is_api_key=False, scheduled_query=None, metadata={}
 ):
     query_id = metadata.get("Query ID", "unknown")
     query_hash = gen_query_hash(query)
+    lock_id = _job_lock_id(query_hash, data_source.id)
     get_logger().info("[query_id=%s] [query_hash=%s] Inserting job", query_id, query_hash)
-    try_count = 0
-    job = None
-
-    while try_count < 5:
-        try_count += 1
 
-        pipe = redis_connection.pipeline()
-        try:
-            pipe.watch(_job_lock_id(query_hash, data_source.id))
-            job_id = pipe.get(_job_lock_id(query_hash, data_source.id))
-            if job_id:
-                job_status = "UNKNOWN"
-                job_complete = False
-                job_cancelled = "False"
-
-                try:
-                    job = Job.fetch(job_id)
-                    job_exists = True
-                    job_status = job.get_status()
-                    job_complete = job_status in [JobStatus.FINISHED, JobStatus.FAILED]
-                    if job.is_cancelled:
-                        job_cancelled = "True"
-                except NoSuchJobError:
-                    job_exists = False
-                    job_status = "EXPIRED"
-
-                get_logger().info("[query_id=%s] [query_hash=%s] Found existing job [job.id=%s] [job_status=%s] [job_cancelled=%s]", query_id, query_hash, job_id, job_status, job_cancelled)
-
-                if job_complete or (not job_exists):
-                    #get_logger().info("[query_id=%s] [query_hash=%s] [job.id=%s], removing redis lock", query_id, query_hash, job_id)
-                    redis_connection.delete(_job_lock_id(query_hash, data_source.id))
-                    job = None
-
-            if not job:
-                pipe.multi()
-
-                if scheduled_query:
-                    queue_name = data_source.scheduled_queue_name  #默认都是scheduled_queries
-                    scheduled_query_id = scheduled_query.id
-                else:
-                    queue_name = data_source.queue_name #默认都是queries
-                    scheduled_query_id = None
-
-                time_limit = settings.dynamic_settings.query_time_limit(
-                    scheduled_query, user_id, data_source.org_id
-                )
-                metadata["Queue"] = queue_name
-                metadata["Enqueue Time"] = time.time()
-
-                queue = Queue(queue_name)
-                enqueue_kwargs = {
-                    "user_id": user_id,
-                    "scheduled_query_id": scheduled_query_id,
-                    "is_api_key": is_api_key,
-                    "job_timeout": time_limit,
-                    "meta": {
-                        "data_source_id": data_source.id,
-                        "org_id": data_source.org_id,
-                        "scheduled": scheduled_query_id is not None,
-                        "query_id": query_id,
-                        "user_id": user_id,
-                    },
-                }
-
-                if not scheduled_query:
-                    enqueue_kwargs["result_ttl"] = settings.JOB_EXPIRY_TIME
-
-                job = queue.enqueue(
-                    execute_query, query, data_source.id, metadata, **enqueue_kwargs
-                )
+    new_job_id = str(uuid4())
+    stale_job_id = ""
 
-                get_logger().info("[query_id=%s] [query_hash=%s] Created new job [job.id=%s]", query_id, query_hash, job.id)
-                pipe.set(
-                    _job_lock_id(query_hash, data_source.id),
-                    job.id,
-                    settings.JOB_EXPIRY_TIME,
-                )
-                pipe.execute()
+    while True:
+        job_id, reserved_ms_ago = reserve_job_lock(
+            keys=[lock_id], args=[new_job_id, settings.JOB_EXPIRY_TIME, stale_job_id]
+        )
+        if job_id == new_job_id:
             break
 
-        except redis.WatchError:
-            get_logger().error("[query_id=%s] [query_hash=%s] redis.WatchError, try_count = %d", query_id, query_hash, try_count)
-            continue
+        try:
+            job = Job.fetch(job_id, connection=rq_redis_connection)
+            job_status = job.get_status()
+            job_cancelled = job.is_cancelled
+        except NoSuchJobError:
+            if reserved_ms_ago < JOB_RESERVATION_TIMEOUT * 1000:
+                # Another enqueuer reserved the lock and is enqueuing the job.
+                time.sleep(0.05)
+                continue
+            job, job_status, job_cancelled = None, "EXPIRED", False
+
+        get_logger().info("[query_id=%s] [query_hash=%s] Found existing job [job.id=%s] [job_status=%s] [job_cancelled=%s]", query_id, query_hash, job_id, job_status, job_cancelled)
+
+        if job and job_status not in [JobStatus.FINISHED, JobStatus.FAILED]:
+            return job
+
+        # Replace the lock of the finished (or expired) job, unless another
+        # enqueuer did already.
+        stale_job_id = job_id
+
+    queue_name = route_query(
+        data_source, query_hash, _queue_name(data_source, scheduled_query)
+    )
+    metadata["Queue"] = queue_name
+    metadata["Enqueue Time"] = time.time()
+
+    queue = Queue(queue_name, connection=rq_redis_connection)
+    execute_kwargs, options = _job_arguments(
+        data_source, user_id, is_api_key, scheduled_query, query_id
+    )
 
-    if not job:
+    try:
+        if batches(data_source, query_hash, scheduled_query):
+            job = enqueue_in_batch(
+                queue.job_class.create(
+                    execute_query,
+                    args=(query, data_source.id, metadata),
+                    kwargs=execute_kwargs,
+                    connection=rq_redis_connection,
+                    timeout=options["job_timeout"],
+                    result_ttl=options.get("result_ttl"),
+                    status=JobStatus.QUEUED,
+                    id=new_job_id,
+                    origin=queue_name,
+                    meta=options["meta"],
+                ),
+                queue,
+                data_source.id,
+            )
+        else:
+            job = queue.enqueue(
+                execute_query,
+                query,
+                data_source.id,
+                metadata,
+                job_id=new_job_id,
+                **execute_kwargs,
+                **options
+            )
+    except Exception:
         get_logger().error("[Manager] [query_id=%s] [query_hash=%s] Failed adding job for query.", query_id, query_hash)
+        release_job_lock(keys=[lock_id], args=[new_job_id])
+        raise
 
+    get_logger().info("[query_id=%s] [query_hash=%s] Created new job [job.id=%s]", query_id, query_hash, job.id)
     return job
 
 
+# Number of queries `enqueue_queries` pipelines at once.
+ENQUEUE_BATCH_SIZE = 500
+
+
+def enqueue_queries(queries):
+    """
+    Bulk version of `enqueue_query` for scheduled queries, given as a list of
+    (query text, scheduled query, metadata) tuples. Pipelines the job lock
+    reservations and the enqueues of each batch of queries, instead of a few
+    round trips for each query.
+
+    Returns the id of the job of each query, or the exception raised enqueuing it.
+    """
+    results = []
+    for batch in chunks(ENQUEUE_BATCH_SIZE, queries):
+        results.extend(_enqueue_batch(batch))
+    return results
+
+
+def _enqueue_batch(queries):
+    results = [None] * len(queries)
+    hashes = [gen_query_hash(query) for query, _, _ in queries]
+    lock_ids = [
+        _job_lock_id(query_hash, scheduled_query.data_source.id)
+        for query_hash, (_, scheduled_query, _) in zip(hashes, queries)
+    ]
+    new_job_ids = [str(uuid4()) for _ in queries]
+
+    pipe = redis_connection.pipeline(transaction=False)
+    for lock_id, new_job_id in zip(lock_ids, new_job_ids):
+        reserve_job_lock(
+            keys=[lock_id],
+            args=[new_job_id, settings.JOB_EXPIRY_TIME, ""],
+            client=pipe,
+        )
+    reservations = pipe.execute()
+
+    reserved = [
+        i for i, (job_id, _) in enumerate(reservations) if job_id == new_job_ids[i]
+    ]
+    locked = [
+        i for i, (job_id, _) in enumerate(reservations) if job_id != new_job_ids[i]
+    ]
+
+    # Queries with a job already: they're done if it's still queued or running.
+    pipe = rq_redis_connection.pipeline(transaction=False)
+    for i in locked:
+        pipe.hget(Job.key_for(reservations[i][0]), "status")
+    fallback = []
+    for i, status in zip(locked, map(as_text, pipe.execute())):
+        if status is None or status in [JobStatus.FINISHED, JobStatus.FAILED]:
+            fallback.append(i)
+        else:
+            results[i] = reservations[i][0]
+
+    queue_names = route_queries(
+        [
+            (
+                queries[i][1].data_source,
+                hashes[i],
+                _queue_name(queries[i][1].data_source, queries[i][1]),
+            )
+            for i in reserved
+        ]
+    )
+
+    # Each job is saved before it's pushed to its queue, so the batch doesn't need
+    # to be a transaction.
+    pipe = rq_redis_connection.pipeline(transaction=False)
+    for i, queue_name in zip(reserved, queue_names):
+        query, scheduled_query, metadata = queries[i]
+        data_source = scheduled_query.data_source
+        try:
+            metadata["Queue"] = queue_name
+            metadata["Enqueue Time"] = time.time()
+            execute_kwargs, options = _job_arguments(
+                data_source,
+                scheduled_query.user_id,
+                False,
+                scheduled_query,
+                metadata.get("Query ID", "unknown"),
+            )
+            queue = Queue(queue_name, connection=rq_redis_connection)
+            job = queue.job_class.create(
+                execute_query,
+                args=(query, data_source.id, metadata),
+                kwargs=execute_kwargs,
+                connection=rq_redis_connection,
+                timeout=options["job_timeout"],
+                result_ttl=options.get("result_ttl"),
+                status=JobStatus.QUEUED,
+                id=new_job_ids[i],
+                origin=queue_name,
+                meta=options["meta"],
+            )
+            queue.enqueue_job(job, pipeline=pipe)
+            results[i] = job.id
+        except Exception as e:
+            results[i] = e
+            release_job_lock(keys=[lock_ids[i]], args=[new_job_ids[i]])
+
+    try:
+        pipe.execute()
+    except Exception:
+        get_logger().exception("Failed enqueuing a batch of %d queries.", len(queries))
+        # Enqueue them one by one, so only the queries that fail do.
+        pipe = redis_connection.pipeline(transaction=False)
+        for i in reserved:
+            if not isinstance(results[i], Exception):
+                release_job_lock(
+                    keys=[lock_ids[i]], args=[new_job_ids[i]], client=pipe
+                )
+                fallback.append(i)
+        pipe.execute()
+
+    for i in fallback:
+        query, scheduled_query, metadata = queries[i]
+        try:
+            results[i] = enqueue_query(
+                query,
+                scheduled_query.data_source,
+                scheduled_query.user_id,
+                scheduled_query=scheduled_query,
+                metadata=metadata,
+            ).id
+        except Exception as e:
+            results[i] = e
+
+    return results
+
+
 def signal_handler(*args):
     raise InterruptException
 
 
+# Streamed results are kept in memory up to this size, and on disk above it.
+SPOOL_MAX_SIZE = 4 * 1024 * 1024
+
+
+class StreamedResult(object):
+    """Serializes a query result from the batches yielded by `run_query_stream`,
+    so only one batch of rows is deserialized at a time. The serialized rows are
+    written to a spooled file as they arrive, which moves to disk once it's over
+    `SPOOL_MAX_SIZE` bytes.
+
+    With `columnar`, the values of each column are written to a file of their own
+    instead, to encode the result in the columnar format (`to_columnar`) without
+    deserializing it first.
+
+    Stops accepting rows once `max_rows` rows or `max_bytes` bytes of rows were
+    collected (0 means no limit), and flags the result as truncated. `check_size`
+    is called with the number of rows and bytes collected after each batch, to fail
+    results that are too large.
+    """
+
+    def __init__(
+        self, json_encoder, max_rows=0, max_bytes=0, check_size=None, columnar=False
+    ):
+        self.json_encoder = json_encoder
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.check_size = check_size
+        self.columnar = columnar
+        self.columns = None
+        self.row_count = 0
+        self.byte_count = 0
+        self.truncated = False
+        self._files = None
+
+    def _dumps(self, value):
+        return json_dumps(value, ignore_nan=True, cls=self.json_encoder)
+
+    def _start(self, columns):
+        self.columns = columns
+        if self.columnar:
+            self._names = [column["name"] for column in columns]
+            self._files = [
+                tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+                for _ in self._names
+            ]
+        else:
+            self._files = [
+                tempfile.SpooledTemporaryFile(
+                    max_size=SPOOL_MAX_SIZE, mode="w+", encoding="utf-8", newline=""
+                )
+            ]
+            self._files[0].write(
+                '{{"columns": {}, "rows": ['.format(self._dumps(columns))
+            )
+
+    def _encode(self, rows):
+        """The chunks of the rows to append to each file."""
+        if not self.columnar:
+            return [self._dumps(rows)[1:-1]]
+
+        # The rows of run_query_stream are keyed by the names of the columns.
+        return [
+            self._dumps([row[name] for row in rows])[1:-1].encode("utf-8")
+            for name in self._names
+        ]
+
+    def _row_size(self, row):
+        if not self.columnar:
+            return len(self._dumps(row)) + 2
+
+        return sum(len(self._dumps(row[name])) + 2 for name in self._names)
+
+    def add_rows(self, rows):
+        if self.max_rows and self.row_count + len(rows) > self.max_rows:
+            rows = rows[: self.max_rows - self.row_count]
+            self.truncated = True
+
+        if not rows:
+            return
+
+        chunks = self._encode(rows)
+        size = sum(len(chunk) + 2 for chunk in chunks)
+        if self.max_bytes and self.byte_count + size > self.max_bytes:
+            # Only the last batch goes over the limit, so it's fine to measure it
+            # row by row to find how many of its rows still fit.
+            self.truncated = True
+            fitting = 0
+            total = self.byte_count
+            for row in rows:
+                total += self._row_size(row)
+                if total > self.max_bytes:
+                    break
+                fitting += 1
+
+            if not fitting:
+                return
+
+            rows = rows[:fitting]
+            chunks = self._encode(rows)
+            size = sum(len(chunk) + 2 for chunk in chunks)
+
+        separator = b", " if self.columnar else ", "
+        for file, chunk in zip(self._files, chunks):
+            if self.row_count:
+                file.write(separator)
+            file.write(chunk)
+        self.row_count += len(rows)
+        self.byte_count += size
+
+    def consume(self, stream):
+        try:
+            for batch in stream:
+                if self.columns is None:
+                    self._start(batch)
+                    continue
+
+                self.add_rows(batch)
+                if self.check_size is not None:
+                    self.check_size(self.row_count, self.byte_count)
+                if self.truncated:
+                    break
+        finally:
+            stream.close()
+
+    def close(self):
+        for file in self._files or []:
+            file.close()
+
+    def to_json(self):
+        """Returns the serialized result, and closes the spooled file."""
+        if self._files is None:
+            self._start([])
+
+        file = self._files[0]
+        try:
+            file.write("]")
+            if self.truncated:
+                file.write(', "truncated": true')
+            file.write("}")
+
+            file.seek(0)
+            return file.read()
+        finally:
+            self.close()
+
+    def to_columnar(self, codec=None):
+        """Returns the result in the columnar format (see `redash.utils.columnar`),
+        and closes the spooled files."""
+        if self._files is None:
+            self._start([])
+
+        keys = ["columns", "rows"]
+        meta = {"columns": self.columns}
+        if self.truncated:
+            keys.append("truncated")
+            meta["truncated"] = True
+
+        try:
+            return columnar.encode_columns(
+                keys, meta, self._names, self.row_count, self._files, codec
+            )
+        finally:
+            self.close()
+
+
 class QueryExecutionError(Exception):
     pass
 
@@ -150,9 +521,16 @@ def _resolve_user(user_id, is_api_key, query_id):
 
 class QueryExecutor(object):
     def __init__(
-        self, query, data_source_id, user_id, is_api_key, metadata, scheduled_query
+        self,
+        query,
+        data_source_id,
+        user_id,
+        is_api_key,
+        metadata,
+        scheduled_query,
+        job=None,
     ):
-        self.job = get_current_job()
+        self.job = job or get_current_job()
         self.query = query
         self.query_hash = gen_query_hash(self.query)
         self.data_source_id = data_source_id
@@ -168,9 +546,76 @@ class QueryExecutor(object):
             models.scheduled_queries_executions.update(scheduled_query.id)
 
     def run(self):
+        slots = DataSourceSlots(self.data_source.id, self.data_source.concurrency_limit)
+        if not slots.acquire(self.job):
+            self._log_progress("PARKED", "concurrency_limit=%d" % slots.limit)
+            return Parked()
+
+        started_at = time.time()
+        # Jobs of query batches may run in threads, which can't set signal handlers.
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGINT, signal_handler)
+
+        query_runner, annotated_query = self._start(started_at)
+
+        try:
+            if (
+                settings.FEATURE_STREAM_QUERY_RESULTS
+                and query_runner.supports_streaming
+            ):
+                data, error = self._run_query_stream(query_runner, annotated_query)
+            else:
+                data, error = query_runner.run_query(annotated_query, self.user)
+            if data is not None:
+                query_runner.check_result_size(size=len(data))
+        except Exception as e:
+            data, error = None, self._error(e, started_at)
+        finally:
+            slots.release(self.job)
+
+        return self._finish(data, error, started_at)
+
+    async def run_async(self):
+        """Coroutine variant of `run`, for the async worker: the query runs on the
+        worker's event loop (see `BaseQueryRunner.run_query_async`), and the
+        database and Redis calls in its threads."""
+        slots = DataSourceSlots(self.data_source.id, self.data_source.concurrency_limit)
+        if not await _in_thread(slots.acquire, self.job):
+            self._log_progress("PARKED", "concurrency_limit=%d" % slots.limit)
+            return Parked()
+
         started_at = time.time()
-        signal.signal(signal.SIGINT, signal_handler)
+        query_runner, annotated_query = self._start(started_at)
 
+        try:
+            data, error = await self._run_query_async(query_runner, annotated_query)
+            if data is not None:
+                query_runner.check_result_size(size=len(data))
+        except Exception as e:
+            data, error = None, self._error(e, started_at)
+        finally:
+            await _in_thread(slots.release, self.job)
+
+        return await _in_thread(self._finish, data, error, started_at)
+
+    async def _run_query_async(self, query_runner, annotated_query):
+        # The job's time limit and cancellation interrupt the query like the
+        # JobTimeoutException and InterruptException of `run`.
+        timeout = self.job.timeout
+        if not timeout or timeout < 0:
+            timeout = None
+        try:
+            return await asyncio.wait_for(
+                query_runner.run_query_async(annotated_query, self.user), timeout
+            )
+        except asyncio.TimeoutError:
+            raise JobTimeoutException(
+                "Task exceeded maximum timeout value ({} seconds)".format(timeout)
+            )
+        except asyncio.CancelledError:
+            raise InterruptException()
+
+    def _start(self, started_at):
         enqueue_time = self.metadata.get("Enqueue Time", 0.0)
         waiting_time = started_at - enqueue_time
         message = "waiting_time=%f" % waiting_time
@@ -178,22 +623,30 @@ class QueryExecutor(object):
         self._log_progress("EXECUTING_QUERY", message)
 
         query_runner = self.data_source.query_runner
-        annotated_query = self._annotate_query(query_runner)
+        query_runner.max_result_rows = (
+            self.data_source.max_result_rows or settings.QUERY_RESULTS_ROW_LIMIT
+        )
+        query_runner.max_result_bytes = (
+            self.data_source.max_result_bytes or settings.QUERY_RESULTS_BYTE_LIMIT
+        )
+        return query_runner, self._annotate_query(query_runner)
 
-        try:
-            data, error = query_runner.run_query(annotated_query, self.user)
-        except Exception as e:
-            if isinstance(e, JobTimeoutException):
-                error = TIMEOUT_MESSAGE
-            else:
-                error = str(e)
+    def _error(self, e, started_at):
+        if isinstance(e, JobTimeoutException):
+            error = TIMEOUT_MESSAGE
+        else:
+            error = str(e)
+
+        if isinstance(e, ResultTooLarge):
+            statsd_client.incr("query_execution.result_too_large")
 
-            data = None
-            #get_logger().warning("Unexpected error while running query:", exc_info=1)
-            run_time = time.time() - started_at
-            message = "run_time=%f, error=[%s]" % (run_time, error)
-            self._log_progress("UNEXPECTED_ERROR", message)
+        #get_logger().warning("Unexpected error while running query:", exc_info=1)
+        run_time = time.time() - started_at
+        message = "run_time=%f, error=[%s]" % (run_time, error)
+        self._log_progress("UNEXPECTED_ERROR", message)
+        return error
 
+    def _finish(self, data, error, started_at):
         run_time = time.time() - started_at
         message = "run_time=%f, error=[%s], data_length=%s" % (run_time, error, data and len(data))
         self._log_progress("AFTER_QUERY", message)
@@ -217,6 +670,8 @@ class QueryExecutor(object):
                 self.scheduled_query.skip_updated_at = True
                 models.db.session.add(self.scheduled_query)
 
+            track_runtime(self.data_source, self.query_hash, run_time)
+
             query_result = models.QueryResult.store_result(
                 self.data_source.org_id,
                 self.data_source,
@@ -239,6 +694,28 @@ class QueryExecutor(object):
             models.db.session.commit()
             return result
 
+    def _run_query_stream(self, query_runner, annotated_query):
+        result = StreamedResult(
+            query_runner.json_encoder,
+            max_rows=settings.QUERY_RESULTS_MAX_ROWS,
+            max_bytes=settings.QUERY_RESULTS_MAX_BYTES,
+            check_size=query_runner.check_result_size,
+            # Encoded from the streamed rows, instead of by the model from the JSON.
+            columnar=issubclass(models.QueryResult, models.ColumnarPersistence),
+        )
+        result.consume(query_runner.run_query_stream(annotated_query, self.user))
+
+        if result.truncated:
+            self._log_progress(
+                "RESULT_TRUNCATED",
+                "rows=%d, bytes=%d" % (result.row_count, result.byte_count),
+            )
+
+        if result.columnar:
+            return result.to_columnar(settings.QUERY_RESULTS_COMPRESSION), None
+
+        return result.to_json(), None
+
     def _annotate_query(self, query_runner):
         self.metadata["Job ID"] = self.job.id
         self.metadata["Query Hash"] = self.query_hash
@@ -286,3 +763,60 @@ def execute_query(
     except QueryExecutionError as e:
         models.db.session.rollback()
         return e
+
+
+async def _in_thread(func, *args):
+    """Calls func in a thread of the event loop's executor, in the caller's context
+    (and so its database session)."""
+    context = contextvars.copy_context()
+    return await asyncio.get_event_loop().run_in_executor(
+        None, functools.partial(context.run, func, *args)
+    )
+
+
+def _query_executor(
+    query, data_source_id, metadata, user_id, scheduled_query_id, is_api_key, job
+):
+    if scheduled_query_id is not None:
+        scheduled_query = models.Query.query.get(scheduled_query_id)
+    else:
+        scheduled_query = None
+
+    return QueryExecutor(
+        query, data_source_id, user_id, is_api_key, metadata, scheduled_query, job
+    )
+
+
+async def execute_query_async(
+    query,
+    data_source_id,
+    metadata,
+    user_id=None,
+    scheduled_query_id=None,
+    is_api_key=False,
+    job=None,
+):
+    """`execute_query` for the async worker, which passes the job. The jobs share
+    the worker's event loop, so each gets its own database session."""
+    token = session_scope.set(object())
+    try:
+        executor = await _in_thread(
+            _query_executor,
+            query,
+            data_source_id,
+            metadata,
+            user_id,
+            scheduled_query_id,
+            is_api_key,
+            job,
+        )
+        return await executor.run_async()
+    except QueryExecutionError as e:
+        await _in_thread(models.db.session.rollback)
+        return e
+    finally:
+        await _in_thread(models.db.session.remove)
+        session_scope.reset(token)
+
+
+execute_query.run_async = execute_query_async
@@ -1,5 +1,8 @@
+import datetime
 import logging
 import time
+import zlib
+from collections import Counter
 
 from rq.timeouts import JobTimeoutException
 from redash import models, redis_connection, settings, statsd_client
@@ -8,10 +11,11 @@ from redash.models.parameterized_query import (
     QueryDetachedFromDataSourceError,
 )
 from redash.tasks.failure_report import track_failure
-from redash.utils import json_dumps, sentry
+from redash.utils import json_dumps, json_loads, sentry, utcnow
 from redash.worker import job, get_job_logger
 
-from .execution import enqueue_query
+from .execution import enqueue_queries
+from .slots import PARKED_DATA_SOURCES_KEY, DataSourceSlots
 
 logger = get_job_logger(__name__)
 
@@ -71,37 +75,166 @@ def _apply_default_parameters(query):
         return query.query_text
 
 
-def refresh_queries():
-    logger.info("Refreshing queries...")
+def _spread_offset(query):
+    """Seconds after its run time a query with a fixed run time is enqueued, so
+    queries scheduled for the same time don't all run at once. The offset
+    depends only on the query, so it runs at the same time on every day. (Queries
+    with only an interval are spread by their next run instead.)"""
+    window = settings.SCHEDULED_QUERIES_SPREAD_WINDOW
+    if not window or not (query.schedule or {}).get("time"):
+        return 0
+
+    return zlib.crc32(str(query.id).encode()) % window
+
+
+def _enqueue_at(query, now):
+    """When the query should be enqueued: when it was due plus its spread offset."""
+    retrieved_at = models.scheduled_queries_executions.get(query.id) or (
+        query.latest_query_data and query.latest_query_data.retrieved_at
+    )
+    if not query.schedule or retrieved_at is None:
+        return now
+
+    try:
+        due_at = query.next_run(retrieved_at)
+    except Exception:
+        return now
+
+    if due_at is None:
+        return now
+
+    return due_at + datetime.timedelta(seconds=_spread_offset(query))
+
+
+def _smooth(queries):
+    """
+    Returns the queries to enqueue now, oldest due first, and the queries held
+    back (spread over SCHEDULED_QUERIES_SPREAD_WINDOW). Held back queries stay due,
+    so later refreshes enqueue them.
+    """
+    if not (
+        settings.SCHEDULED_QUERIES_SPREAD_WINDOW
+        or settings.SCHEDULED_QUERIES_MAX_PER_DATA_SOURCE
+    ):
+        return queries, []
+
+    now = utcnow()
+    models.scheduled_queries_executions.refresh([q.id for q in queries])
+    enqueue_at = {query.id: _enqueue_at(query, now) for query in queries}
+
+    queries = sorted(queries, key=lambda q: enqueue_at[q.id])
+    due = [q for q in queries if enqueue_at[q.id] <= now]
+    spread = [q for q in queries if enqueue_at[q.id] > now]
+
+    return due, spread
+
+
+def _report_enqueue_failure(query, e):
+    message = "Could not enqueue query %d due to %s" % (query.id, repr(e))
+    logging.info(message)
+    sentry.capture_message(message)
+
+
+def _store_status(status, shard, shards):
+    """Stores the refresh status, summed up over all shards."""
+    if shards == 1:
+        redis_connection.hmset("redash:status", status)
+        return
+
+    pipe = redis_connection.pipeline()
+    pipe.hset("redash:status:shards", shard, json_dumps(status))
+    pipe.hgetall("redash:status:shards")
+    shard_statuses = pipe.execute()[1]
+
+    statuses = [
+        json_loads(shard_status)
+        for other_shard, shard_status in shard_statuses.items()
+        if int(other_shard) < shards
+    ]
+    redis_connection.hmset(
+        "redash:status",
+        {
+            "outdated_queries_count": sum(
+                s["outdated_queries_count"] for s in statuses
+            ),
+            "spread_queries_count": sum(s["spread_queries_count"] for s in statuses),
+            "carried_over_queries_count": sum(
+                s["carried_over_queries_count"] for s in statuses
+            ),
+            "last_refresh_at": max(s["last_refresh_at"] for s in statuses),
+            "query_ids": json_dumps(
+                [
+                    query_id
+                    for s in statuses
+                    for query_id in json_loads(s["query_ids"])
+                ]
+            ),
+        },
+    )
+
+
+def refresh_queries(shard=0, shards=1):
+    logger.info("Refreshing queries (shard %d of %d)...", shard + 1, shards)
+    to_enqueue = []
     enqueued = []
-    for query in models.Query.outdated_queries():
+    carried_over = []
+    enqueued_per_data_source = Counter()
+    # The budget of a data source is split between the shards.
+    max_per_data_source = -(-settings.SCHEDULED_QUERIES_MAX_PER_DATA_SOURCE // shards)
+
+    queries, spread = _smooth(models.Query.outdated_queries(shard, shards))
+    for query in queries:
         if not _should_refresh_query(query):
             continue
 
+        if (
+            max_per_data_source
+            and enqueued_per_data_source[query.data_source_id] >= max_per_data_source
+        ):
+            carried_over.append(query)
+            continue
+
         try:
-            enqueue_query(
-                _apply_default_parameters(query),
-                query.data_source,
-                query.user_id,
-                scheduled_query=query,
-                metadata={"Query ID": query.id, "Username": "Scheduled"},
-            )
-            enqueued.append(query)
+            query_text = _apply_default_parameters(query)
         except Exception as e:
-            message = "Could not enqueue query %d due to %s" % (query.id, repr(e))
-            logging.info(message)
-            sentry.capture_message(message)
+            _report_enqueue_failure(query, e)
+            continue
+
+        to_enqueue.append(
+            (query_text, query, {"Query ID": query.id, "Username": "Scheduled"})
+        )
+        enqueued_per_data_source[query.data_source_id] += 1
+
+    for (_, query, _), result in zip(to_enqueue, enqueue_queries(to_enqueue)):
+        if isinstance(result, Exception):
+            _report_enqueue_failure(query, result)
+        else:
+            enqueued.append(query)
 
     status = {
         "outdated_queries_count": len(enqueued),
+        "spread_queries_count": len(spread),
+        "carried_over_queries_count": len(carried_over),
         "last_refresh_at": time.time(),
         "query_ids": json_dumps([q.id for q in enqueued]),
     }
 
-    redis_connection.hmset("redash:status", status)
+    _store_status(status, shard, shards)
     logger.info("Done refreshing queries: %s" % status)
 
 
+def wake_parked_queries():
+    """
+    Enqueues parked query jobs of data sources with free slots. Releasing a slot
+    wakes parked jobs by itself; this is for slots that were freed by an expired
+    lease (of a job whose worker died) or by raising the concurrency limit.
+    """
+    for data_source_id in redis_connection.smembers(PARKED_DATA_SOURCES_KEY):
+        data_source = models.DataSource.query.get(data_source_id)
+        limit = data_source.concurrency_limit if data_source else 0
+        DataSourceSlots(data_source_id, limit).wake()
+
+
 def cleanup_query_results():
     """
     Job to cleanup unused query results -- such that no query links to them anymore, and older than
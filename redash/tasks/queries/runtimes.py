@@ -0,0 +1,152 @@
+import time
+
+from rq import Worker
+
+from redash import redis_connection, rq_redis_connection, settings, statsd_client
+
+FAST_LANE = "fast"
+SLOW_LANE = "slow"
+
+# How long the queues workers listen to are cached for, in seconds.
+LISTENED_QUEUES_TTL = 60
+_listened_queues = {}
+
+# KEYS: runtime estimate
+# ARGV: runtime, alpha, ttl
+# Returns the previous estimate (or false when there was none).
+RECORD_RUNTIME = """
+local previous = redis.call('GET', KEYS[1])
+local estimate = tonumber(ARGV[1])
+if previous then
+    estimate = tonumber(previous) + tonumber(ARGV[2]) * (estimate - tonumber(previous))
+end
+redis.call('SET', KEYS[1], tostring(estimate), 'EX', ARGV[3])
+return previous
+"""
+
+record_runtime_script = redis_connection.register_script(RECORD_RUNTIME)
+
+
+def _runtime_key(data_source_id, query_hash):
+    return "query_runtime:{}:{}".format(data_source_id, query_hash)
+
+
+def estimate_runtime(data_source_id, query_hash):
+    """The exponentially weighted moving average of the query's runtimes (in
+    seconds) on the data source, or None if it didn't run lately."""
+    estimate = redis_connection.get(_runtime_key(data_source_id, query_hash))
+    return float(estimate) if estimate is not None else None
+
+
+def record_runtime(data_source_id, query_hash, runtime):
+    """Adds the runtime to the query's moving average and returns the estimate it
+    had before."""
+    previous = record_runtime_script(
+        keys=[_runtime_key(data_source_id, query_hash)],
+        args=[runtime, settings.QUERY_RUNTIME_EWMA_ALPHA, settings.QUERY_RUNTIME_TTL],
+    )
+    return float(previous) if previous is not None else None
+
+
+def runtime_lane(data_source, runtime):
+    """The lane of queries that run for `runtime` seconds on the data source, or
+    None for its regular queue."""
+    if runtime is None:
+        return None
+
+    if data_source.slow_query_threshold and runtime >= data_source.slow_query_threshold:
+        return SLOW_LANE
+
+    if data_source.fast_query_threshold and runtime <= data_source.fast_query_threshold:
+        return FAST_LANE
+
+    return None
+
+
+def listened_queues():
+    """The names of the queues that workers listen to (cached for
+    LISTENED_QUEUES_TTL seconds)."""
+    now = time.time()
+    if now >= _listened_queues.get("expires_at", 0):
+        workers = Worker.all(connection=rq_redis_connection)
+        _listened_queues["queues"] = set(
+            queue_name for worker in workers for queue_name in worker.queue_names()
+        )
+        _listened_queues["expires_at"] = now + LISTENED_QUEUES_TTL
+    return _listened_queues["queues"]
+
+
+def _routes(data_source):
+    return bool(data_source.fast_query_threshold or data_source.slow_query_threshold)
+
+
+def _route(data_source, queue_name, estimate):
+    lane = runtime_lane(data_source, estimate)
+    if lane is None:
+        return queue_name
+
+    # Queues can be custom (like the queues of HTTP data sources), and their lanes
+    # are only used if workers listen to them.
+    lane_queue_name = "{}_{}".format(queue_name, lane)
+    if lane_queue_name not in listened_queues():
+        return queue_name
+
+    statsd_client.incr("query_execution.routed.{}".format(lane))
+    return lane_queue_name
+
+
+def route_query(data_source, query_hash, queue_name):
+    """
+    Routes a query to the fast or slow lane of its queue (`<queue>_fast` or
+    `<queue>_slow`) by its estimated runtime, when the data source has runtime
+    thresholds set and workers listen to the lane. Queries that didn't run lately
+    stay on the queue.
+    """
+    if not _routes(data_source):
+        return queue_name
+
+    return _route(
+        data_source, queue_name, estimate_runtime(data_source.id, query_hash)
+    )
+
+
+def route_queries(queries):
+    """Bulk version of `route_query`, for a list of (data source, query hash,
+    queue name) tuples."""
+    routed = [_routes(data_source) for data_source, _, _ in queries]
+    keys = [
+        _runtime_key(data_source.id, query_hash)
+        for (data_source, query_hash, _), routes in zip(queries, routed)
+        if routes
+    ]
+    estimates = iter(redis_connection.mget(keys) if keys else [])
+
+    queue_names = []
+    for (data_source, _, queue_name), routes in zip(queries, routed):
+        if routes:
+            estimate = next(estimates)
+            queue_name = _route(
+                data_source,
+                queue_name,
+                float(estimate) if estimate is not None else None,
+            )
+        queue_names.append(queue_name)
+
+    return queue_names
+
+
+def track_runtime(data_source, query_hash, runtime):
+    """Records the runtime of a query, and how accurate its estimate was."""
+    estimate = record_runtime(data_source.id, query_hash, runtime)
+    if estimate is None:
+        return
+
+    statsd_client.timing(
+        "query_execution.runtime_estimate_error", abs(runtime - estimate) * 1000
+    )
+
+    if _routes(data_source):
+        if runtime_lane(data_source, estimate) == runtime_lane(data_source, runtime):
+            statsd_client.incr("query_execution.routing.hit")
+        else:
+            statsd_client.incr("query_execution.routing.miss")
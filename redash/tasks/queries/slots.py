@@ -0,0 +1,152 @@
+import time
+
+from rq.exceptions import NoSuchJobError
+from rq.job import JobStatus
+
+from redash import redis_connection, rq_redis_connection, statsd_client
+from redash.tasks.worker import Job, Queue, Worker
+from redash.worker import get_job_logger
+
+logger = get_job_logger(__name__)
+
+PARKED_DATA_SOURCES_KEY = "data_sources:parked_jobs"
+
+# How long a slot is leased beyond the job's time limit (and the grace period
+# the worker gives the job before killing it).
+LEASE_MARGIN = 60
+# Lease of jobs without a time limit.
+DEFAULT_LEASE = 12 * 60 * 60
+
+# KEYS: slots, parked jobs, parked data sources
+# ARGV: now, lease expiry, job id, limit, data source id
+ACQUIRE_OR_PARK = """
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+if redis.call('ZSCORE', KEYS[1], ARGV[3])
+    or redis.call('ZCARD', KEYS[1]) < tonumber(ARGV[4]) then
+    redis.call('ZADD', KEYS[1], ARGV[2], ARGV[3])
+    return 1
+end
+redis.call('RPUSH', KEYS[2], ARGV[3])
+redis.call('SADD', KEYS[3], ARGV[5])
+return 0
+"""
+
+# KEYS: slots, parked jobs, parked data sources
+# ARGV: now, job id (or ""), limit, data source id
+# Returns the ids of the parked jobs to enqueue, one for each free slot.
+RELEASE_AND_WAKE = """
+if ARGV[2] ~= '' then
+    redis.call('ZREM', KEYS[1], ARGV[2])
+end
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+local free = tonumber(ARGV[3]) - redis.call('ZCARD', KEYS[1])
+local woken = {}
+while free > 0 do
+    local job_id = redis.call('LPOP', KEYS[2])
+    if not job_id then
+        break
+    end
+    woken[#woken + 1] = job_id
+    free = free - 1
+end
+if redis.call('LLEN', KEYS[2]) == 0 then
+    redis.call('SREM', KEYS[3], ARGV[4])
+end
+return woken
+"""
+
+acquire_or_park = redis_connection.register_script(ACQUIRE_OR_PARK)
+release_and_wake = redis_connection.register_script(RELEASE_AND_WAKE)
+
+
+class DataSourceSlots(object):
+    """
+    Limits how many queries of a data source run at once (its `concurrency_limit`
+    option, 0 for no limit).
+
+    A running job leases one of the data source's slots. The lease expires a
+    while after the job's time limit, so slots of jobs whose worker died are
+    freed as well. A job that doesn't get a slot is parked instead of waiting
+    for one: its worker moves on, and the job is enqueued again (at the front of
+    its queue) when a slot is released.
+    """
+
+    def __init__(self, data_source_id, limit):
+        self.data_source_id = data_source_id
+        self.limit = limit
+
+    @property
+    def keys(self):
+        return [
+            "data_source:{}:slots".format(self.data_source_id),
+            "data_source:{}:parked_jobs".format(self.data_source_id),
+            PARKED_DATA_SOURCES_KEY,
+        ]
+
+    def acquire(self, job):
+        """Leases a slot for the job, or parks it and returns False."""
+        if not self.limit:
+            return True
+
+        now = time.time()
+        timeout = job.timeout if job.timeout and job.timeout > 0 else None
+        lease = timeout + Worker.grace_period if timeout else DEFAULT_LEASE
+        acquired = acquire_or_park(
+            keys=self.keys,
+            args=[
+                now,
+                now + lease + LEASE_MARGIN,
+                job.id,
+                self.limit,
+                self.data_source_id,
+            ],
+        )
+
+        if not acquired:
+            job.meta.setdefault("parked_at", now)
+            job.save_meta()
+            job.set_status(JobStatus.QUEUED)
+            statsd_client.incr("query_execution.parked")
+            return False
+
+        parked_at = job.meta.pop("parked_at", None)
+        if parked_at is not None:
+            job.save_meta()
+            statsd_client.timing("query_execution.slot_wait", (now - parked_at) * 1000)
+
+        return True
+
+    def release(self, job):
+        if not self.limit:
+            return
+
+        self._wake(job.id)
+
+    def wake(self):
+        """Enqueues parked jobs for the slots that are free."""
+        self._wake("")
+
+    def _wake(self, job_id):
+        job_ids = release_and_wake(
+            keys=self.keys,
+            # Without a limit (anymore), all parked jobs are woken.
+            args=[time.time(), job_id, self.limit or 2 ** 31, self.data_source_id],
+        )
+
+        for parked_job_id in job_ids:
+            try:
+                parked_job = Job.fetch(parked_job_id, connection=rq_redis_connection)
+            except NoSuchJobError:
+                continue
+
+            if parked_job.is_cancelled:
+                continue
+
+            logger.info(
+                "Enqueuing parked job %s of data source %s.",
+                parked_job_id,
+                self.data_source_id,
+            )
+            Queue(parked_job.origin, connection=rq_redis_connection).enqueue_job(
+                parked_job, at_front=True
+            )
@@ -0,0 +1,216 @@
+import datetime
+from collections import Counter, defaultdict
+
+from sqlalchemy import or_
+from sqlalchemy.orm import contains_eager, joinedload
+
+from redash import models, settings, statsd_client
+from redash.models.parameterized_query import (
+    InvalidParameterError,
+    QueryDetachedFromDataSourceError,
+)
+from redash.utils import json_dumps, json_loads, utcnow
+from redash.worker import get_job_logger
+
+from .execution import enqueue_query
+from .maintenance import _should_refresh_query
+
+logger = get_job_logger(__name__)
+
+DAY = datetime.timedelta(days=1)
+
+
+def _history(action, object_type, window_start, window_end, *columns):
+    """
+    Yields (days ago, *columns) of the events recorded at the same time of day as
+    the window, on each of the last CACHE_WARMING_HISTORY_DAYS days.
+    """
+    windows = [
+        models.Event.created_at.between(
+            window_start - days * DAY, window_end - days * DAY
+        )
+        for days in range(1, settings.CACHE_WARMING_HISTORY_DAYS + 1)
+    ]
+    events = models.db.session.query(models.Event.created_at, *columns).filter(
+        models.Event.action == action,
+        models.Event.object_type == object_type,
+        or_(*windows),
+    )
+    for created_at, *values in events:
+        yield (-(-(window_start - created_at) // DAY),) + tuple(values)
+
+
+def hot_dashboards(window_start, window_end):
+    """
+    The ids of the dashboards viewed at the time of day of the window on at least
+    CACHE_WARMING_MIN_DAYS of the previous days, most viewed first.
+    """
+    views = Counter()
+    days = defaultdict(set)
+    for days_ago, object_id in _history(
+        "view", "dashboard", window_start, window_end, models.Event.object_id
+    ):
+        try:
+            dashboard_id = int(object_id)
+        except (TypeError, ValueError):
+            continue
+        views[dashboard_id] += 1
+        days[dashboard_id].add(days_ago)
+
+    return [
+        dashboard_id
+        for dashboard_id, _ in views.most_common()
+        if len(days[dashboard_id]) >= settings.CACHE_WARMING_MIN_DAYS
+    ]
+
+
+def hot_parameters(query_ids, window_start, window_end):
+    """
+    {query_id: [parameters, ...]} of the parameter values the queries were executed
+    with at the time of day of the window on at least CACHE_WARMING_MIN_DAYS of the
+    previous days, most used first.
+    """
+    query_ids = set(query_ids)
+    executions = Counter()
+    days = defaultdict(set)
+    for days_ago, properties in _history(
+        "execute_query",
+        "data_source",
+        window_start,
+        window_end,
+        models.Event.additional_properties,
+    ):
+        properties = properties or {}
+        parameters = properties.get("parameters")
+        try:
+            query_id = int(properties.get("query_id"))
+        except (TypeError, ValueError):
+            continue
+        if query_id not in query_ids or not isinstance(parameters, dict):
+            continue
+
+        key = (query_id, json_dumps(parameters, sort_keys=True))
+        executions[key] += 1
+        days[key].add(days_ago)
+
+    hot = defaultdict(list)
+    for (query_id, parameters), _ in executions.most_common():
+        if len(days[(query_id, parameters)]) >= settings.CACHE_WARMING_MIN_DAYS:
+            hot[query_id].append(json_loads(parameters))
+
+    return hot
+
+
+def _dashboard_queries(dashboard_ids):
+    """The queries of the dashboards' widgets, in the order of the dashboards."""
+    widgets = (
+        models.Widget.query.join(models.Dashboard)
+        .join(models.Visualization)
+        .join(models.Query, models.Visualization.query_rel)
+        .options(
+            contains_eager(models.Widget.visualization)
+            .contains_eager(models.Visualization.query_rel)
+            .joinedload(models.Query.data_source)
+        )
+        .filter(
+            models.Widget.dashboard_id.in_(dashboard_ids),
+            models.Dashboard.is_archived.is_(False),
+            models.Query.is_archived.is_(False),
+        )
+    )
+    rank = {dashboard_id: i for i, dashboard_id in enumerate(dashboard_ids)}
+
+    queries = []
+    for widget in sorted(widgets, key=lambda widget: rank[widget.dashboard_id]):
+        query = widget.visualization.query_rel
+        if query not in queries:
+            queries.append(query)
+
+    return queries
+
+
+def _query_texts(query, parameter_sets):
+    """The texts of the query with each set of parameter values (over its default
+    values) and with its default values, up to CACHE_WARMING_PARAMETER_SETS."""
+    if not query.parameters:
+        return [query.query_text]
+
+    defaults = {p["name"]: p.get("value") for p in query.parameters}
+    texts = []
+    for parameters in parameter_sets + [{}]:
+        try:
+            parameterized = query.parameterized.apply(dict(defaults, **parameters))
+        except (InvalidParameterError, QueryDetachedFromDataSourceError) as e:
+            logger.debug("Not warming %s with %s: %s", query.id, parameters, e)
+            continue
+
+        if parameterized.missing_params or parameterized.text in texts:
+            continue
+
+        texts.append(parameterized.text)
+        if len(texts) == settings.CACHE_WARMING_PARAMETER_SETS:
+            break
+
+    return texts
+
+
+def warm_caches():
+    """
+    Executes the queries of the dashboards that are usually viewed at the time of
+    day CACHE_WARMING_LEAD_TIME seconds from now (see `hot_dashboards`), with the
+    parameter values they're usually viewed with, so their results are in the
+    cache (`QueryResult.get_latest`) when they're opened.
+    """
+    window_start = utcnow() + datetime.timedelta(
+        seconds=settings.CACHE_WARMING_LEAD_TIME
+    )
+    window_end = window_start + datetime.timedelta(
+        seconds=settings.CACHE_WARMING_INTERVAL
+    )
+    # Results of previous warmings are still fresh when this window begins.
+    fresh_for = settings.CACHE_WARMING_LEAD_TIME + settings.CACHE_WARMING_INTERVAL
+
+    dashboard_ids = hot_dashboards(window_start, window_end)
+    queries = _dashboard_queries(dashboard_ids) if dashboard_ids else []
+    parameters = hot_parameters(
+        [query.id for query in queries], window_start, window_end
+    )
+
+    enqueued_per_data_source = Counter()
+    over_budget = 0
+    for query in queries:
+        if not _should_refresh_query(query):
+            continue
+
+        for text in _query_texts(query, parameters[query.id]):
+            if (
+                enqueued_per_data_source[query.data_source_id]
+                >= settings.CACHE_WARMING_MAX_PER_DATA_SOURCE
+            ):
+                over_budget += 1
+                continue
+
+            if models.QueryResult.get_latest(query.data_source, text, fresh_for):
+                continue
+
+            try:
+                enqueue_query(
+                    text,
+                    query.data_source,
+                    query.user_id,
+                    metadata={"Query ID": query.id, "Username": "Cache warming"},
+                )
+            except Exception as e:
+                logger.warning("Failed warming cache of query %s: %s", query.id, e)
+                continue
+
+            enqueued_per_data_source[query.data_source_id] += 1
+
+    enqueued = sum(enqueued_per_data_source.values())
+    statsd_client.incr("cache_warming.enqueued", enqueued)
+    logger.info(
+        "Warmed caches of %d dashboards: enqueued %d queries, %d over budget.",
+        len(dashboard_ids),
+        enqueued,
+        over_budget,
+    )
@@ -2,12 +2,21 @@ from __future__ import absolute_import
 import logging
 import hashlib
 import json
+import os
+import signal
+import socket
+import time
+import zlib
 from datetime import datetime, timedelta
 from functools import partial
 from random import randint
+from uuid import uuid4
 
+from rq.exceptions import NoSuchJobError
 from rq.job import Job
+from rq.utils import as_text
 from rq_scheduler import Scheduler
+from rq_scheduler.utils import get_next_scheduled_time, to_unix
 
 from redash import settings, rq_redis_connection
 from redash.tasks import (
@@ -19,12 +28,237 @@ from redash.tasks import (
     purge_failed_jobs,
     version_check,
     send_aggregated_errors,
+    wake_parked_queries,
+    warm_caches,
+    recover_query_batches,
+    Queue,
 )
 
 logger = logging.getLogger(__name__)
 
-rq_scheduler = Scheduler(
-    connection=rq_redis_connection, queue_name="periodic", interval=5
+# KEYS: leader
+# ARGV: instance id, lease (ms)
+# Takes the leadership if nobody holds it, or renews it. Returns 1 for the leader.
+ACQUIRE_LEADERSHIP = """
+local leader = redis.call('GET', KEYS[1])
+if leader and leader ~= ARGV[1] then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+return 1
+"""
+
+# KEYS: leader
+# ARGV: instance id
+RELEASE_LEADERSHIP = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# KEYS: scheduled jobs, leader
+# ARGV: job id, score it's due at, next score (or "" if it doesn't run again),
+#       instance id of the leader (or "" for jobs any scheduler may enqueue)
+# Claims a due job for its current run by moving it to its next run, unless another
+# scheduler did already, or the leadership it needs was lost.
+CLAIM_JOB = """
+if ARGV[4] ~= '' and redis.call('GET', KEYS[2]) ~= ARGV[4] then
+    return 0
+end
+if redis.call('ZSCORE', KEYS[1], ARGV[1]) ~= ARGV[2] then
+    return 0
+end
+if ARGV[3] == '' then
+    redis.call('ZREM', KEYS[1], ARGV[1])
+else
+    redis.call('ZADD', KEYS[1], ARGV[3], ARGV[1])
+end
+return 1
+"""
+
+acquire_leadership = rq_redis_connection.register_script(ACQUIRE_LEADERSHIP)
+release_leadership = rq_redis_connection.register_script(RELEASE_LEADERSHIP)
+claim_job = rq_redis_connection.register_script(CLAIM_JOB)
+
+
+class LeaseScheduler(Scheduler):
+    """
+    Scheduler that several processes can run at once, for failover and to split
+    the scheduled queries between them.
+
+    Each process renews a lease on its membership every `interval` seconds, and
+    one of them (the leader) also on its leadership; a process that stops renewing
+    them is replaced within `lease_timeout` seconds. The leader enqueues the
+    periodic jobs, except for jobs with a `shard` meta (the shards of
+    `refresh_queries`), which are split among the processes by rendezvous hashing.
+
+    A due job is claimed (atomically moved to its next run) before it's enqueued,
+    so it's enqueued at most once per run, even while processes disagree on who
+    leads or owns a shard. A process that dies between claiming and enqueuing a
+    job skips that run of the job.
+    """
+
+    leader_key = "rq:scheduler:leader"
+    instances_key = "rq:scheduler:instances"
+
+    def __init__(self, *args, **kwargs):
+        self.lease_timeout = kwargs.pop("lease_timeout", 5)
+        super(LeaseScheduler, self).__init__(*args, **kwargs)
+        self.instance_id = None
+        self.is_leader = False
+        self.instances = []
+
+    @property
+    def instance_key(self):
+        return "{}:{}".format(self.scheduler_key, self.instance_id)
+
+    def register_birth(self):
+        self.instance_id = "{}:{}:{}".format(
+            socket.gethostname(), os.getpid(), uuid4().hex[:8]
+        )
+        self.log.info("Registering birth of scheduler %s", self.instance_id)
+        with self.connection.pipeline() as p:
+            p.hset(self.instance_key, "birth", time.time())
+            p.expire(self.instance_key, int(self._interval) + 10)
+            p.execute()
+
+    def register_death(self):
+        self.log.info("Registering death of scheduler %s", self.instance_id)
+        with self.connection.pipeline() as p:
+            release_leadership(
+                keys=[self.leader_key], args=[self.instance_id], client=p
+            )
+            p.zrem(self.instances_key, self.instance_id)
+            p.hset(self.instance_key, "death", time.time())
+            p.expire(self.instance_key, 60)
+            p.execute()
+        self.is_leader = False
+
+    def heartbeat(self):
+        """Renews the leases of this scheduler, and finds the live schedulers."""
+        now = time.time()
+        with self.connection.pipeline() as p:
+            p.zadd(self.instances_key, {self.instance_id: now + self.lease_timeout})
+            p.zremrangebyscore(self.instances_key, "-inf", now)
+            p.zrangebyscore(self.instances_key, now, "+inf")
+            acquire_leadership(
+                keys=[self.leader_key],
+                args=[self.instance_id, int(self.lease_timeout * 1000)],
+                client=p,
+            )
+            p.expire(self.instance_key, int(self._interval) + 10)
+            _, _, instances, is_leader, _ = p.execute()
+
+        self.instances = sorted(as_text(instance) for instance in instances)
+        if bool(is_leader) != self.is_leader:
+            self.log.info(
+                "Scheduler %s %s the leadership.",
+                self.instance_id,
+                "took" if is_leader else "lost",
+            )
+        self.is_leader = bool(is_leader)
+
+    def shard_owner(self, shard):
+        return max(
+            self.instances,
+            key=lambda instance: zlib.crc32("{}:{}".format(instance, shard).encode()),
+        )
+
+    def _next_run(self, job):
+        """The score of the job's next run, or "" if this run is its last."""
+        repeat = job.meta.get("repeat")
+        if repeat is not None and int(repeat) <= 1:
+            return ""
+
+        interval = job.meta.get("interval")
+        if interval:
+            return to_unix(datetime.utcnow()) + int(interval)
+
+        cron_string = job.meta.get("cron_string")
+        if cron_string:
+            return to_unix(get_next_scheduled_time(cron_string))
+
+        return ""
+
+    def enqueue_jobs(self):
+        """Enqueues the due jobs of this scheduler."""
+        due = self.connection.zrangebyscore(
+            self.scheduled_jobs_key,
+            0,
+            to_unix(datetime.utcnow()),
+            withscores=True,
+            score_cast_func=as_text,
+        )
+
+        jobs = []
+        for job_id, score in due:
+            job_id = as_text(job_id)
+            try:
+                job = self.job_class.fetch(job_id, connection=self.connection)
+            except NoSuchJobError:
+                if self.is_leader:
+                    self.cancel(job_id)
+                continue
+
+            shard = job.meta.get("shard")
+            if shard is None and not self.is_leader:
+                continue
+            if shard is not None and self.shard_owner(shard) != self.instance_id:
+                continue
+
+            claimed = claim_job(
+                keys=[self.scheduled_jobs_key, self.leader_key],
+                args=[
+                    job_id,
+                    score,
+                    self._next_run(job),
+                    self.instance_id if shard is None else "",
+                ],
+            )
+            if claimed:
+                if job.meta.get("repeat") is not None:
+                    job.meta["repeat"] = int(job.meta["repeat"]) - 1
+                self.log.debug("Pushing %s to %s", job_id, job.origin)
+                self.get_queue_for_job(job).enqueue_job(job)
+                jobs.append(job)
+
+        return jobs
+
+    def run(self, burst=False):
+        self.register_birth()
+        self._install_signal_handlers()
+
+        try:
+            while True:
+                start_time = time.time()
+                self.heartbeat()
+                self.enqueue_jobs()
+
+                if burst:
+                    break
+
+                seconds_until_next_run = self._interval - (time.time() - start_time)
+                if seconds_until_next_run > 0:
+                    time.sleep(seconds_until_next_run)
+        finally:
+            self.register_death()
+
+    def _install_signal_handlers(self):
+        def stop(signum, frame):
+            self.log.info("Shutting down scheduler %s...", self.instance_id)
+            raise SystemExit()
+
+        signal.signal(signal.SIGINT, stop)
+        signal.signal(signal.SIGTERM, stop)
+
+
+rq_scheduler = LeaseScheduler(
+    connection=rq_redis_connection,
+    queue_class=Queue,
+    queue_name="periodic",
+    interval=1,
+    lease_timeout=settings.SCHEDULER_LEASE_TIMEOUT,
 )
 
 
@@ -51,8 +285,24 @@ def schedule(kwargs):
 
 
 def periodic_job_definitions():
-    jobs = [
-        {"func": refresh_queries, "interval": 30, "result_ttl": 600},
+    shards = settings.SCHEDULED_QUERIES_SHARDS
+    if shards > 1:
+        jobs = [
+            {
+                "func": refresh_queries,
+                "kwargs": {"shard": shard, "shards": shards},
+                "meta": {"shard": shard},
+                "interval": 30,
+                "result_ttl": 600,
+            }
+            for shard in range(shards)
+        ]
+    else:
+        jobs = [{"func": refresh_queries, "interval": 30, "result_ttl": 600}]
+
+    jobs += [
+        {"func": wake_parked_queries, "interval": 60, "result_ttl": 600},
+        {"func": recover_query_batches, "interval": 60, "result_ttl": 600},
         {"func": empty_schedules, "interval": timedelta(minutes=60)},
         {
             "func": refresh_schemas,
@@ -76,6 +326,15 @@ def periodic_job_definitions():
     if settings.QUERY_RESULTS_CLEANUP_ENABLED:
         jobs.append({"func": cleanup_query_results, "interval": timedelta(minutes=5)})
 
+    if settings.CACHE_WARMING_ENABLED:
+        jobs.append(
+            {
+                "func": warm_caches,
+                "interval": timedelta(seconds=settings.CACHE_WARMING_INTERVAL),
+                "result_ttl": 600,
+            }
+        )
+
     # Add your own custom periodic jobs in your dynamic_settings module.
     jobs.extend(settings.dynamic_settings.periodic_jobs() or [])
 
@@ -85,11 +344,16 @@ def periodic_job_definitions():
 def schedule_periodic_jobs(jobs):
     job_definitions = [prep(job) for job in jobs]
 
-    jobs_to_clean_up = Job.fetch_many(
-        set([job.id for job in rq_scheduler.get_jobs()])
-        - set([job_id(job) for job in job_definitions]),
-        rq_redis_connection,
-    )
+    # Jobs scheduled to run once (like batches of queries) aren't periodic jobs.
+    jobs_to_clean_up = [
+        job
+        for job in Job.fetch_many(
+            set([job.id for job in rq_scheduler.get_jobs()])
+            - set([job_id(job) for job in job_definitions]),
+            rq_redis_connection,
+        )
+        if job is not None and "interval" in job.meta
+    ]
 
     jobs_to_schedule = [
         job for job in job_definitions if job_id(job) not in rq_scheduler
@@ -1,20 +1,46 @@
+import asyncio
 import errno
+import functools
+import multiprocessing
 import os
+import random
+import resource
 import signal
+import sys
 import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app, has_app_context
 from rq import Worker as BaseWorker, Queue as BaseQueue, get_current_job
-from rq.utils import utcnow
+from rq.connections import resolve_connection
+from rq.defaults import DEFAULT_LOGGING_DATE_FORMAT, DEFAULT_LOGGING_FORMAT
+from rq.exceptions import DequeueTimeout, NoSuchJobError
+from rq.logutils import setup_loghandlers
+from rq.registry import StartedJobRegistry
+from rq.utils import as_text, utcformat, utcnow
 from rq.timeouts import UnixSignalDeathPenalty, HorseMonitorTimeoutException
 from rq.job import Job as BaseJob, JobStatus
+from rq.worker import WorkerStatus, logger as rq_logger
+
+from redash import rq_redis_connection, settings, statsd_client
+from redash.query_runner import MemoryLimitExceeded, aiohttp, http_session
 
 
 class CancellableJob(BaseJob):
     def cancel(self, pipeline=None):
         # TODO - add tests that verify that queued jobs are removed from queue and running jobs are actively cancelled
-        if self.is_started:
+        # Jobs in a batch aren't on their queue, so their batch checks the flag too.
+        if self.is_started or self.meta.get("batched"):
             self.meta["cancelled"] = True
             self.save_meta()
 
+        if self.origin:
+            queue_key = FairQueue.redis_queue_namespace_prefix + self.origin
+            fair_forget(
+                args=[FairQueue.fair_prefix(queue_key), self.id],
+                client=self.connection,
+            )
         super().cancel(pipeline=pipeline)
 
     @property
@@ -22,10 +48,284 @@ class CancellableJob(BaseJob):
         return self.meta.get("cancelled", False)
 
 
+class Parked(object):
+    """
+    Returned by jobs that didn't run but were set aside to be enqueued again
+    later, so the worker doesn't finish them.
+    """
+
+
 class CancellableQueue(BaseQueue):
     job_class = CancellableJob
 
 
+# Scripts of FairQueue. Tenants (organizations, and users within each
+# organization) are kept in sorted sets, scored by how much of the queue they got
+# so far (an organization's score goes up by 1 / its weight for each of its jobs).
+# The tenant with the lowest score is served next, and tenants that (re)join
+# start at the lowest score, so they can't bank turns while they're idle.
+# Jobs popped in fair order stay on the RQ queue until they reach its head (removing
+# them from the middle of it is O(N)): they're in the popped set till then.
+FAIR_LUA_HELPERS = """
+local function join(key, member)
+    if not redis.call('ZSCORE', key, member) then
+        local lowest = redis.call('ZRANGE', key, 0, 0, 'WITHSCORES')
+        redis.call('ZADD', key, lowest[2] or 0, member)
+    end
+end
+
+local function leave_if_empty(prefix, org, user)
+    local users_key = prefix .. ':org:' .. org .. ':users'
+    if redis.call('LLEN', users_key .. ':' .. user) == 0 then
+        redis.call('ZREM', users_key, user)
+    end
+    if redis.call('ZCARD', users_key) == 0 then
+        redis.call('ZREM', prefix .. ':orgs', org)
+    end
+end
+
+local function pop_popped(prefix, queue_key)
+    local job_id = redis.call('LINDEX', queue_key, 0)
+    while job_id and redis.call('SREM', prefix .. ':popped', job_id) == 1 do
+        redis.call('LPOP', queue_key)
+        job_id = redis.call('LINDEX', queue_key, 0)
+    end
+end
+"""
+
+# ARGV: prefix, job id, org, user, weight, at front ("1" or "0"), queue key
+FAIR_PUSH = FAIR_LUA_HELPERS + """
+local prefix, job_id, org, user = ARGV[1], ARGV[2], ARGV[3], ARGV[4]
+local users_key = prefix .. ':org:' .. org .. ':users'
+-- A job enqueued again (e.g. parked) may still be on the queue from its last pop.
+if redis.call('SREM', prefix .. ':popped', job_id) == 1 then
+    redis.call('LREM', ARGV[7], 1, job_id)
+end
+if ARGV[6] == '1' then
+    redis.call('LPUSH', users_key .. ':' .. user, job_id)
+else
+    redis.call('RPUSH', users_key .. ':' .. user, job_id)
+end
+redis.call('HSET', prefix .. ':tenants', job_id, org .. ':' .. user)
+redis.call('HSET', prefix .. ':weights', org, ARGV[5])
+join(prefix .. ':orgs', org)
+join(users_key, user)
+"""
+
+# ARGV: prefix, queue key, job key prefix
+# Pops the next job id of the queue in fair order. Jobs enqueued without a tenant
+# are only popped when no tenant has jobs. Jobs that were deleted without leaving
+# their tenant are dropped.
+FAIR_POP = FAIR_LUA_HELPERS + """
+local prefix, queue_key = ARGV[1], ARGV[2]
+local orgs_key = prefix .. ':orgs'
+while true do
+    local org = redis.call('ZRANGE', orgs_key, 0, 0)[1]
+    if not org then
+        pop_popped(prefix, queue_key)
+        local job_id = redis.call('LPOP', queue_key)
+        pop_popped(prefix, queue_key)
+        return job_id
+    end
+
+    local users_key = prefix .. ':org:' .. org .. ':users'
+    local user = redis.call('ZRANGE', users_key, 0, 0)[1]
+    local job_id = user and redis.call('LPOP', users_key .. ':' .. user)
+    if job_id then
+        local weight = tonumber(redis.call('HGET', prefix .. ':weights', org)) or 1
+        redis.call('ZINCRBY', orgs_key, 1 / math.max(weight, 0.001), org)
+        redis.call('ZINCRBY', users_key, 1, user)
+        redis.call('HDEL', prefix .. ':tenants', job_id)
+    end
+    leave_if_empty(prefix, org, user or '')
+
+    if job_id then
+        if redis.call('EXISTS', ARGV[3] .. job_id) == 0 then
+            redis.call('LREM', queue_key, 1, job_id)
+        else
+            redis.call('SADD', prefix .. ':popped', job_id)
+            pop_popped(prefix, queue_key)
+            return job_id
+        end
+    end
+end
+"""
+
+# ARGV: prefix, job id
+# Removes a job that was popped from the queue directly, or removed from it (e.g.
+# cancelled), from its tenant's jobs. Returns 1 if it was popped in fair order
+# already.
+FAIR_FORGET = FAIR_LUA_HELPERS + """
+local prefix, job_id = ARGV[1], ARGV[2]
+local popped = redis.call('SREM', prefix .. ':popped', job_id)
+local tenant = redis.call('HGET', prefix .. ':tenants', job_id)
+if tenant then
+    local org, user = string.match(tenant, '^([^:]*):(.*)$')
+    redis.call('LREM', prefix .. ':org:' .. org .. ':users:' .. user, 1, job_id)
+    redis.call('HDEL', prefix .. ':tenants', job_id)
+    leave_if_empty(prefix, org, user)
+end
+return popped
+"""
+
+# ARGV: prefix, queue key, job key prefix
+# Empties the queue like rq's Queue.empty, except for the jobs that were popped in
+# fair order already (they're running), and drops its tenants. Returns the number of
+# jobs deleted.
+FAIR_EMPTY = """
+local prefix, queue_key = ARGV[1], ARGV[2]
+local count = 0
+while true do
+    local job_id = redis.call('LPOP', queue_key)
+    if not job_id then
+        break
+    end
+    if redis.call('SREM', prefix .. ':popped', job_id) == 0 then
+        redis.call('DEL', ARGV[3] .. job_id, ARGV[3] .. job_id .. ':dependents')
+        count = count + 1
+    end
+end
+for _, org in ipairs(redis.call('ZRANGE', prefix .. ':orgs', 0, -1)) do
+    local users_key = prefix .. ':org:' .. org .. ':users'
+    for _, user in ipairs(redis.call('ZRANGE', users_key, 0, -1)) do
+        redis.call('DEL', users_key .. ':' .. user)
+    end
+    redis.call('DEL', users_key)
+end
+redis.call('DEL', prefix .. ':orgs', prefix .. ':tenants', prefix .. ':popped')
+return count
+"""
+
+# The scripts are called with the connection of the queue.
+fair_push = rq_redis_connection.register_script(FAIR_PUSH)
+fair_pop = rq_redis_connection.register_script(FAIR_POP)
+fair_forget = rq_redis_connection.register_script(FAIR_FORGET)
+fair_empty = rq_redis_connection.register_script(FAIR_EMPTY)
+
+
+class FairQueue(CancellableQueue):
+    """
+    Hands out jobs in fair-share order instead of FIFO: organizations take turns
+    (weighted by their `queue_weight` setting), and so do the users within each
+    organization, so a single user can't make everyone else wait behind their
+    jobs.
+
+    Jobs stay on the regular RQ queue (so counting, listing and removing them
+    works as usual); the per organization/user lists only decide which of them
+    is popped next. Jobs popped out of order are only removed from the RQ queue
+    once they reach its head, so popping doesn't slow down as the queue grows.
+    Jobs are assigned to tenants by their `org_id` and `user_id` meta; jobs
+    without an `org_id` are popped only when no tenant has jobs.
+
+    Jobs are only assigned to tenants with QUEUE_FAIR_SHARE on; otherwise the
+    queue is FIFO (jobs enqueued while it was on are still popped in fair order).
+    """
+
+    fair_namespace_prefix = "rq:fair:"
+
+    @classmethod
+    def fair_prefix(cls, queue_key):
+        return cls.fair_namespace_prefix + as_text(queue_key)[
+            len(cls.redis_queue_namespace_prefix) :
+        ]
+
+    def enqueue_job(self, job, pipeline=None, at_front=False):
+        org_id = job.meta.get("org_id")
+        if org_id is None or not settings.QUEUE_FAIR_SHARE:
+            return super().enqueue_job(job, pipeline=pipeline, at_front=at_front)
+
+        pipe = pipeline if pipeline is not None else self.connection.pipeline()
+        job = super().enqueue_job(job, pipeline=pipe, at_front=at_front)
+        fair_push(
+            args=[
+                self.fair_prefix(self.key),
+                job.id,
+                org_id,
+                job.meta.get("user_id") or "",
+                job.meta.get("queue_weight", 1),
+                "1" if at_front else "0",
+                self.key,
+            ],
+            client=pipe,
+        )
+        if pipeline is None:
+            pipe.execute()
+
+        return job
+
+    def _popped_key(self):
+        return self.fair_prefix(self.key) + ":popped"
+
+    @property
+    def count(self):
+        with self.connection.pipeline() as pipeline:
+            pipeline.llen(self.key)
+            pipeline.scard(self._popped_key())
+            queued, popped = pipeline.execute()
+        return queued - popped
+
+    def get_job_ids(self, offset=0, length=-1):
+        popped = set(map(as_text, self.connection.smembers(self._popped_key())))
+        job_ids = [job_id for job_id in super().get_job_ids() if job_id not in popped]
+        if length >= 0:
+            return job_ids[offset : offset + length]
+        return job_ids[offset:]
+
+    def remove(self, job_or_id, pipeline=None):
+        job_id = job_or_id.id if isinstance(job_or_id, self.job_class) else job_or_id
+        fair_forget(
+            args=[self.fair_prefix(self.key), job_id],
+            client=pipeline if pipeline is not None else self.connection,
+        )
+        return super().remove(job_or_id, pipeline=pipeline)
+
+    def empty(self):
+        return fair_empty(
+            args=[
+                self.fair_prefix(self.key),
+                self.key,
+                self.job_class.redis_job_namespace_prefix,
+            ],
+            client=self.connection,
+        )
+
+    @classmethod
+    def lpop(cls, queue_keys, timeout, connection=None):
+        connection = resolve_connection(connection)
+        for queue_key in queue_keys:
+            job_id = fair_pop(
+                args=[
+                    cls.fair_prefix(queue_key),
+                    queue_key,
+                    cls.job_class.redis_job_namespace_prefix,
+                ],
+                client=connection,
+            )
+            if job_id is not None:
+                return queue_key, job_id
+
+        # All queues are empty: wait for a job, which is the only one anyway.
+        while True:
+            result = super().lpop(queue_keys, timeout, connection=connection)
+            if result is None:
+                return None
+
+            queue_key, job_id = result
+            if not fair_forget(
+                args=[cls.fair_prefix(queue_key), job_id], client=connection
+            ):
+                return result
+
+
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+
+def memory_limit_handler(*args):
+    raise MemoryLimitExceeded(
+        "Query exceeded the memory limit of the worker. Try returning fewer rows."
+    )
+
+
 class HardLimitingWorker(BaseWorker):
     """
     RQ's work horses enforce time limits by setting a timed alarm and stopping jobs
@@ -39,11 +339,29 @@ class HardLimitingWorker(BaseWorker):
     The HardLimitingWorker class changes the default monitoring behavior of the default
     RQ Worker by checking if the work horse is still busy with the job, even after
     it should have timed out (+ a grace period of 15s). If it does, it kills the work horse.
+
+    It limits the memory of jobs the same way: once a job grew its work horse's RSS
+    by more than its memory limit (see `memory_limit`), the work horse is interrupted
+    with MemoryLimitExceeded, and once it grew it by WORKER_MEMORY_HARD_LIMIT_FACTOR
+    times that, the work horse is killed.
     """
 
     grace_period = 15
-    queue_class = CancellableQueue
+    queue_class = FairQueue
     job_class = CancellableJob
+    memory_interrupted = False
+    memory_killed = False
+
+    def handle_job_success(self, job, queue, started_job_registry):
+        if isinstance(job.result, Parked):
+            self.log.info("Job %s has been parked.", job.id)
+            with self.connection.pipeline() as pipeline:
+                self.set_current_job_id(None, pipeline=pipeline)
+                started_job_registry.remove(job, pipeline=pipeline)
+                pipeline.execute()
+            return
+
+        super().handle_job_success(job, queue, started_job_registry)
 
     def stop_executing_job(self, job):
         os.kill(self.horse_pid, signal.SIGINT)
@@ -68,12 +386,70 @@ class HardLimitingWorker(BaseWorker):
         )
         self.kill_horse()
 
+    def setup_work_horse_signals(self):
+        super().setup_work_horse_signals()
+        signal.signal(signal.SIGUSR1, memory_limit_handler)
+
+    def memory_limit(self, job):
+        """The memory (MB) the job may add to the work horse: its data source's
+        limit, its queue's or WORKER_MEMORY_LIMIT. 0 means no limit."""
+        return (
+            job.meta.get("memory_limit")
+            or settings.WORKER_QUEUE_MEMORY_LIMITS.get(job.origin)
+            or settings.WORKER_MEMORY_LIMIT
+        )
+
+    def horse_memory(self):
+        """The RSS of the work horse in MB, or None if it's gone."""
+        try:
+            with open("/proc/{}/statm".format(self._horse_pid)) as statm:
+                pages = int(statm.read().split()[1])
+        except (OSError, IndexError, ValueError):
+            return None
+
+        return pages * PAGE_SIZE / 1024 / 1024
+
+    def start_monitoring(self, job):
+        self.monitor_started = utcnow()
+        self.memory_at_start = self.horse_memory() or 0
+        self.memory_interrupted = False
+        self.memory_killed = False
+
+    def enforce_memory_limit(self, job):
+        limit = self.memory_limit(job)
+        memory = self.horse_memory()
+        if not limit or memory is None:
+            return
+
+        used = memory - self.memory_at_start
+        if used > limit * settings.WORKER_MEMORY_HARD_LIMIT_FACTOR:
+            self.log.warning(
+                "Job %s used %dMB of memory, over its hard limit of %dMB. Killing the "
+                "work horse.",
+                job.id,
+                used,
+                limit * settings.WORKER_MEMORY_HARD_LIMIT_FACTOR,
+            )
+            statsd_client.incr("worker.memory_limit.hard")
+            self.memory_killed = True
+            self.kill_horse()
+        elif used > limit and not self.memory_interrupted:
+            self.log.warning(
+                "Job %s used %dMB of memory, over its limit of %dMB. Interrupting it.",
+                job.id,
+                used,
+                limit,
+            )
+            statsd_client.incr("worker.memory_limit.soft")
+            self.memory_interrupted = True
+            os.kill(self._horse_pid, signal.SIGUSR1)
+
     def monitor_work_horse(self, job):
         """The worker will monitor the work horse and make sure that it
         either executes successfully or the status of the job is set to
         failed
         """
-        self.monitor_started = utcnow()
+        self.start_monitoring(job)
         while True:
             try:
                 with UnixSignalDeathPenalty(
@@ -93,6 +469,8 @@ class HardLimitingWorker(BaseWorker):
 
                 if self.soft_limit_exceeded(job):
                     self.enforce_hard_limit(job)
+
+                self.enforce_memory_limit(job)
             except OSError as e:
                 # In case we encountered an OSError due to EINTR (which is
                 # caused by a SIGINT or SIGTERM signal during
@@ -107,6 +485,10 @@ class HardLimitingWorker(BaseWorker):
 
         if ret_val == os.EX_OK:  # The process exited normally.
             return
+
+        self.handle_work_horse_death(job, ret_val)
+
+    def handle_work_horse_death(self, job, ret_val):
         job_status = job.get_status()
         if job_status is None:  # Job completed and its ttl has expired
             return
@@ -123,13 +505,406 @@ class HardLimitingWorker(BaseWorker):
                 ).format(ret_val)
             )
 
-            self.handle_job_failure(
-                job,
-                exc_string="Work-horse process was terminated unexpectedly "
-                "(waitpid returned %s)" % ret_val,
+            if self.memory_killed:
+                exc_string = (
+                    "Work-horse process was killed for using over %dMB of memory"
+                    % (self.memory_limit(job) * settings.WORKER_MEMORY_HARD_LIMIT_FACTOR)
+                )
+            else:
+                exc_string = (
+                    "Work-horse process was terminated unexpectedly "
+                    "(waitpid returned %s)" % ret_val
+                )
+            self.handle_job_failure(job, exc_string=exc_string)
+
+
+class PreforkWorker(HardLimitingWorker):
+    """
+    A HardLimitingWorker that runs its jobs in a long-lived work horse instead of
+    forking a new one for each job, so short jobs don't pay for the fork and for
+    opening new database and Redis connections. The worker still monitors each job
+    like HardLimitingWorker: it cancels jobs by interrupting the work horse, and
+    kills a work horse that exceeds the job's time limit (+ grace period) and forks
+    a new one for the next job.
+
+    The work horse is also replaced after running `max_jobs_per_horse` jobs, or once
+    it used more than `max_horse_memory` MB (0 for no limit), so memory leaked by
+    jobs is given back.
+    """
+
+    def __init__(self, *args, max_jobs_per_horse=None, max_horse_memory=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_jobs_per_horse = (
+            max_jobs_per_horse
+            if max_jobs_per_horse is not None
+            else settings.WORKER_HORSE_MAX_JOBS
+        )
+        self.max_horse_memory = (
+            max_horse_memory
+            if max_horse_memory is not None
+            else settings.WORKER_HORSE_MAX_MEMORY
+        )
+        self._horse_connection = None
+
+    def fork_work_horse(self, job, queue):
+        """Passes the job to the work horse, forking one if there is none."""
+        if self._horse_pid:
+            try:
+                self._horse_connection.send((job.id, queue.name))
+                return
+            except OSError:
+                # It died while it was idle.
+                self.reap_work_horse()
+
+        self.spawn_work_horse()
+        self._horse_connection.send((job.id, queue.name))
+
+    def spawn_work_horse(self):
+        connection, horse_connection = multiprocessing.Pipe()
+        child_pid = os.fork()
+        if child_pid == 0:
+            connection.close()
+            self.main_work_horse_loop(horse_connection)
+        else:
+            horse_connection.close()
+            self._horse_pid = child_pid
+            self._horse_connection = connection
+            self.procline("Forked {0} at {1}".format(child_pid, time.time()))
+
+    def reap_work_horse(self):
+        """Waits for the work horse to exit and returns its exit status."""
+        self._horse_connection.close()
+        _, ret_val = os.waitpid(self._horse_pid, 0)
+        self._horse_pid = 0
+        self._horse_connection = None
+        return ret_val
+
+    def main_work_horse_loop(self, connection):
+        """The entry point of the work horse: runs the jobs it's passed, until it's
+        time to retire or the worker is gone."""
+        random.seed()
+        self.setup_work_horse_signals()
+        self._is_horse = True
+        self.log = rq_logger
+
+        try:
+            jobs = 0
+            while True:
+                try:
+                    job_id, queue_name = connection.recv()
+                except EOFError:
+                    break
+
+                self.perform_job_by_id(job_id, queue_name)
+
+                jobs += 1
+                retire = self.horse_should_retire(jobs)
+                connection.send(retire)
+                if retire:
+                    break
+        except Exception:
+            self.log.exception("Work horse %s failed.", os.getpid())
+            os._exit(1)
+
+        # Never return to the worker's code in the work horse.
+        os._exit(0)
+
+    def perform_job_by_id(self, job_id, queue_name):
+        try:
+            job = self.job_class.fetch(job_id, connection=self.connection)
+        except NoSuchJobError:
+            return
+
+        queue = self.queue_class(
+            queue_name, connection=self.connection, job_class=self.job_class
+        )
+        signal.signal(signal.SIGUSR1, memory_limit_handler)
+        try:
+            self.perform_job(job, queue)
+        finally:
+            # Jobs (query executions) install their own interrupt handler.
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            signal.signal(signal.SIGUSR1, signal.SIG_IGN)
+
+    def horse_should_retire(self, jobs):
+        if self.max_jobs_per_horse and jobs >= self.max_jobs_per_horse:
+            return True
+
+        # ru_maxrss is in KB (on Linux).
+        memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        return bool(self.max_horse_memory and memory > self.max_horse_memory)
+
+    def monitor_work_horse(self, job):
+        """Waits for the work horse to be done with the job, while monitoring it
+        like HardLimitingWorker. Replaces the work horse if it died."""
+        self.start_monitoring(job)
+        while True:
+            try:
+                if self._horse_connection.poll(self.job_monitoring_interval):
+                    retire = self._horse_connection.recv()
+                    if retire:
+                        self.reap_work_horse()
+                    return
+            except (EOFError, OSError):
+                # The work horse died (or was killed).
+                break
+
+            # Send a heartbeat to keep the worker alive.
+            self.heartbeat(self.job_monitoring_interval + 5)
+
+            job.refresh()
+
+            if job.is_cancelled:
+                self.stop_executing_job(job)
+
+            if self.soft_limit_exceeded(job):
+                self.enforce_hard_limit(job)
+
+            self.enforce_memory_limit(job)
+
+        self.handle_work_horse_death(job, self.reap_work_horse())
+
+    def work(self, *args, **kwargs):
+        try:
+            return super().work(*args, **kwargs)
+        finally:
+            if self._horse_pid:
+                self.reap_work_horse()
+
+
+class AsyncWorker(HardLimitingWorker):
+    """
+    A worker that runs up to `concurrency` jobs at once on an asyncio event loop in
+    its own process, for queues of I/O-bound queries (the queues of HTTP data
+    sources): those spend their time waiting on sockets, so they don't need a work
+    horse each.
+
+    Jobs whose function has a coroutine variant (its `run_async`, like
+    `execute_query`'s) run on the event loop; other jobs run in a thread. Jobs fail
+    once they run `grace_period` seconds over their time limit, and cancelled jobs
+    are interrupted, like with HardLimitingWorker. Since the jobs share the process,
+    nothing stops a job that blocks the event loop, so only queues of jobs that
+    don't should be given to this worker.
+    """
+
+    def __init__(self, *args, concurrency=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.concurrency = concurrency or settings.ASYNC_WORKER_CONCURRENCY
+        self._tasks = {}
+
+    def work(
+        self,
+        burst=False,
+        logging_level="INFO",
+        date_format=DEFAULT_LOGGING_DATE_FORMAT,
+        log_format=DEFAULT_LOGGING_FORMAT,
+        max_jobs=None,
+    ):
+        setup_loghandlers(logging_level, date_format, log_format)
+        self.register_birth()
+        self.log.info(
+            "Worker %s: started, running up to %d jobs at once",
+            self.key,
+            self.concurrency,
+        )
+        self.set_state(WorkerStatus.STARTED)
+        # Jobs that run in threads need the application context.
+        app = current_app._get_current_object() if has_app_context() else None
+
+        try:
+            return asyncio.run(self.work_async(burst, max_jobs, app))
+        finally:
+            self.register_death()
+
+    async def work_async(self, burst, max_jobs, app):
+        loop = asyncio.get_event_loop()
+        # Dequeues, jobs without a coroutine variant and the database and Redis
+        # calls of the other jobs run in these threads.
+        loop.set_default_executor(
+            ThreadPoolExecutor(
+                self.concurrency + 1,
+                initializer=self.push_app_context,
+                initargs=(app,),
+            )
+        )
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, self.request_stop_async)
+
+        session = None
+        if aiohttp is not None:
+            session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.concurrency)
+            )
+        http_session.set(session)
+
+        started_jobs = 0
+        last_monitored = time.monotonic()
+        try:
+            while True:
+                if time.monotonic() - last_monitored >= self.job_monitoring_interval:
+                    self.monitor_jobs()
+                    last_monitored = time.monotonic()
+
+                if self._stop_requested and not self._tasks:
+                    self.log.info("Worker %s: stopping on request", self.key)
+                    break
+
+                can_start = not self._stop_requested and (
+                    max_jobs is None or started_jobs < max_jobs
+                )
+                if can_start and len(self._tasks) < self.concurrency:
+                    result = await loop.run_in_executor(
+                        None, self.dequeue_job, None if burst else 1
+                    )
+                    if result is not None:
+                        self.start_job(*result, app=app)
+                        started_jobs += 1
+                        continue
+                    if burst and not self._tasks:
+                        self.log.info("Worker %s: done, quitting", self.key)
+                        break
+                elif not self._tasks:
+                    break
+
+                if self._tasks:
+                    # Without free slots (or jobs to start) there's nothing to do
+                    # until a job is done.
+                    idle = (
+                        not can_start
+                        or burst
+                        or len(self._tasks) >= self.concurrency
+                    )
+                    await asyncio.wait(
+                        list(self._tasks),
+                        timeout=self.job_monitoring_interval if idle else 0,
+                        return_when=asyncio.FIRST_COMPLETED,
+                    )
+        finally:
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                loop.remove_signal_handler(signum)
+            if session is not None:
+                await session.close()
+
+        return bool(started_jobs)
+
+    def dequeue_job(self, timeout):
+        try:
+            return self.queue_class.dequeue_any(
+                self.queues,
+                timeout,
+                connection=self.connection,
+                job_class=self.job_class,
+            )
+        except DequeueTimeout:
+            return None
+
+    def start_job(self, job, queue, app=None):
+        self.log.info("%s: %s", queue.name, job.id)
+        task = asyncio.ensure_future(self.perform_job_async(job, queue, app))
+        self._tasks[task] = job
+        task.add_done_callback(self._tasks.pop)
+        self.set_state(WorkerStatus.BUSY)
+
+    def monitor_jobs(self):
+        """Keeps the worker alive, and interrupts the jobs that were cancelled."""
+        self.heartbeat()
+        self.set_state(WorkerStatus.BUSY if self._tasks else WorkerStatus.IDLE)
+
+        for task, job in list(self._tasks.items()):
+            try:
+                job.refresh()
+            except NoSuchJobError:
+                continue
+
+            if job.is_cancelled and not task.cancelled():
+                self.log.warning("Job %s has been cancelled.", job.id)
+                task.cancel()
+
+        if self.should_run_maintenance_tasks:
+            self.clean_registries()
+
+    async def perform_job_async(self, job, queue, app):
+        loop = asyncio.get_event_loop()
+        started_job_registry = StartedJobRegistry(
+            job.origin, self.connection, job_class=self.job_class
+        )
+        timeout = job.timeout or self.queue_class.DEFAULT_TIMEOUT
+
+        # The Redis calls around the job block, so they run in the executor.
+        try:
+            await loop.run_in_executor(
+                None, self.mark_job_started, job, started_job_registry, timeout
+            )
+
+            job.started_at = utcnow()
+            run_async = getattr(job.func, "run_async", None)
+            if run_async is not None:
+                coroutine = run_async(*job.args, job=job, **job.kwargs)
+            else:
+                coroutine = loop.run_in_executor(None, self.perform_in_thread, job, app)
+
+            rv = await asyncio.wait_for(
+                coroutine, timeout + self.grace_period if timeout > 0 else None
+            )
+        except (Exception, asyncio.CancelledError):
+            job.ended_at = utcnow()
+            await loop.run_in_executor(
+                None, self.finish_failed_job, job, sys.exc_info(), started_job_registry
             )
+        else:
+            job.ended_at = utcnow()
+            job._result = rv
+            await loop.run_in_executor(
+                None,
+                functools.partial(
+                    self.handle_job_success,
+                    job=job,
+                    queue=queue,
+                    started_job_registry=started_job_registry,
+                ),
+            )
+
+    def mark_job_started(self, job, started_job_registry, timeout):
+        with self.connection.pipeline() as pipeline:
+            started_job_registry.add(job, timeout, pipeline=pipeline)
+            job.set_status(JobStatus.STARTED, pipeline=pipeline)
+            pipeline.hset(job.key, "started_at", utcformat(utcnow()))
+            pipeline.execute()
+
+    def finish_failed_job(self, job, exc_info, started_job_registry):
+        exc_string = self._get_safe_exception_string(
+            traceback.format_exception(*exc_info)
+        )
+        self.handle_job_failure(
+            job=job, exc_string=exc_string, started_job_registry=started_job_registry
+        )
+        self.handle_exception(job, *exc_info)
+
+    def push_app_context(self, app):
+        # For the whole life of the thread: popping it would remove the database
+        # session of the job that's using the thread.
+        if app is not None:
+            app.app_context().push()
+
+    def perform_in_thread(self, job, app):
+        if app is None:
+            return job.perform()
+
+        with app.app_context():
+            return job.perform()
+
+    def request_stop_async(self):
+        if self._stop_requested:
+            self.log.warning("Cold shut down")
+            for task in self._tasks:
+                task.cancel()
+            return
+
+        self.handle_warm_shutdown_request()
+        self._stop_requested = True
+        self.set_shutdown_requested_date()
 
 
 Job = CancellableJob
-Queue = CancellableQueue
+Queue = FairQueue
 Worker = HardLimitingWorker
@@ -20,6 +20,11 @@ from sqlalchemy.orm.query import Query
 
 from .human_time import parse_human_time
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 
 COMMENTS_REGEX = re.compile("/\*.*?\*/")
 WRITER_ENCODING = os.environ.get("REDASH_CSV_WRITER_ENCODING", "utf-8")
@@ -109,17 +114,78 @@ class JSONEncoder(simplejson.JSONEncoder):
         return result
 
 
+# json_dumps arguments the orjson backend can honor; other calls use simplejson.
+ORJSON_DUMPS_ARGS = frozenset(["cls", "default", "encoding", "ignore_nan", "sort_keys"])
+
+use_orjson = orjson is not None and settings.JSON_BACKEND == "orjson"
+
+_encoders = {}
+
+
+def _orjson_default(cls, default=None):
+    """Return a `default` function for orjson that encodes values the way `cls`
+    (a JSONEncoder subclass) would with simplejson."""
+    if default is None:
+        if cls not in _encoders:
+            _encoders[cls] = cls()
+        default = _encoders[cls].default
+
+    def orjson_default(o):
+        # simplejson encodes decimals as is (use_decimal), before calling default.
+        # orjson can only do the same with Fragment (orjson 3.9+), so without it
+        # json_dumps falls back to simplejson.
+        if isinstance(o, decimal.Decimal) and o.is_finite():
+            if not hasattr(orjson, "Fragment"):
+                raise TypeError("Decimals need orjson.Fragment.")
+            return orjson.Fragment(str(o))
+        return default(o)
+
+    return orjson_default
+
+
+def _orjson_dumps(data, cls, default=None, encoding=None, ignore_nan=True, sort_keys=False):
+    # Datetimes are passed to `default` to keep the ECMA-262 format. orjson always
+    # encodes NaN and Infinity as null, so it's only used with ignore_nan.
+    option = (
+        orjson.OPT_NON_STR_KEYS
+        | orjson.OPT_PASSTHROUGH_DATETIME
+        | orjson.OPT_PASSTHROUGH_DATACLASS
+    )
+    if sort_keys:
+        option |= orjson.OPT_SORT_KEYS
+
+    return orjson.dumps(
+        data, default=_orjson_default(cls, default), option=option
+    ).decode("utf-8")
+
+
 def json_loads(data, *args, **kwargs):
     """A custom JSON loading function which passes all parameters to the
     simplejson.loads function."""
+    # Not orjson: it reads integers over 64 bits as floats.
     return simplejson.loads(data, *args, **kwargs)
 
 
 def json_dumps(data, *args, **kwargs):
     """A custom JSON dumping function which passes all parameters to the
-    simplejson.dumps function."""
+    simplejson.dumps function (or uses orjson when it can honor them, for calls
+    with ignore_nan)."""
     kwargs.setdefault("cls", JSONEncoder)
     kwargs.setdefault("encoding", None)
+
+    if (
+        use_orjson
+        and kwargs.get("ignore_nan")
+        and not args
+        and kwargs["encoding"] is None
+        and ORJSON_DUMPS_ARGS.issuperset(kwargs)
+    ):
+        try:
+            return _orjson_dumps(data, **kwargs)
+        except orjson.JSONEncodeError:
+            # Integers over 64 bits, unsupported types, etc.
+            pass
+
     return simplejson.dumps(data, *args, **kwargs)
 
 
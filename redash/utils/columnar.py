@@ -0,0 +1,234 @@
+"""
+Columnar, compressed encoding for query result payloads.
+
+Query results are usually stored as one JSON document of the form
+``{"columns": [...], "rows": [{...}, {...}]}``, which repeats every column name
+in every row. This module stores the same payload column-wise: the metadata
+(everything but ``rows``) is kept as one JSON block and the values of each column
+are kept as one JSON array block. The blocks are length-prefixed, compressed with
+the best available codec and base64 encoded, so the result still fits in the
+``query_results.data`` text column.
+
+Encoded payloads are prefixed with ``MAGIC``, which can never start a JSON
+document, so both formats can live side by side in the same table.
+"""
+import base64
+import struct
+import zlib
+
+from redash.utils import json_dumps, json_loads
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+
+MAGIC = "rdc1:"
+FORMAT_VERSION = 1
+
+_block_header = struct.Struct(">I")
+
+
+class ColumnarFormatError(Exception):
+    pass
+
+
+def _zstd_compress(data):
+    return zstandard.ZstdCompressor(level=3).compress(data)
+
+
+def _zstd_decompress(data):
+    return zstandard.ZstdDecompressor().decompress(data)
+
+
+codecs = {"zlib": (lambda data: zlib.compress(data, 6), zlib.decompress)}
+
+if lz4_frame is not None:
+    codecs["lz4"] = (lz4_frame.compress, lz4_frame.decompress)
+
+if zstandard is not None:
+    codecs["zstd"] = (_zstd_compress, _zstd_decompress)
+
+
+def default_codec():
+    for name in ("zstd", "lz4", "zlib"):
+        if name in codecs:
+            return name
+
+
+def is_columnar(text):
+    return isinstance(text, str) and text.startswith(MAGIC)
+
+
+def _row_names(rows):
+    """Return the column order shared by all rows, or None if the rows don't
+    share the same keys (in which case they are stored as-is)."""
+    if not isinstance(rows, list):
+        return None
+
+    if not rows:
+        return []
+
+    if not isinstance(rows[0], dict):
+        return None
+
+    names = list(rows[0].keys())
+    for row in rows:
+        if not isinstance(row, dict) or list(row.keys()) != names:
+            return None
+
+    return names
+
+
+def _pack(blocks):
+    out = bytearray()
+    for block in blocks:
+        out += _block_header.pack(len(block))
+        out += block
+
+    return bytes(out)
+
+
+def _unpack(body):
+    blocks = []
+    offset = 0
+    while offset < len(body):
+        (size,) = _block_header.unpack_from(body, offset)
+        offset += _block_header.size
+        blocks.append(body[offset : offset + size])
+        offset += size
+
+    return blocks
+
+
+def _encode_block(value):
+    return json_dumps(value).encode("utf-8")
+
+
+def _decode_block(block):
+    return json_loads(block.decode("utf-8"))
+
+
+def _check_codec(codec):
+    codec = codec or default_codec()
+    if codec not in codecs:
+        raise ColumnarFormatError("Compression codec {} is not available.".format(codec))
+
+    return codec
+
+
+def _compress(codec, body):
+    compress, _ = codecs[codec]
+    payload = base64.b64encode(compress(body)).decode("ascii")
+
+    return "{}{}:{}".format(MAGIC, codec, payload)
+
+
+def encode(data, codec=None):
+    """Encode a deserialized query result (a dict with ``rows``) into the
+    columnar text representation."""
+    codec = _check_codec(codec)
+
+    rows = data.get("rows")
+    names = _row_names(rows)
+    meta = {k: v for k, v in data.items() if k != "rows"}
+
+    header = {
+        "v": FORMAT_VERSION,
+        "keys": list(data.keys()),
+        "names": names,
+        "count": len(rows) if names is not None else None,
+    }
+    blocks = [_encode_block(header), _encode_block(meta)]
+
+    if names is None:
+        blocks.append(_encode_block(rows))
+    else:
+        for name in names:
+            blocks.append(_encode_block([row[name] for row in rows]))
+
+    return _compress(codec, _pack(blocks))
+
+
+def encode_columns(keys, meta, names, count, columns, codec=None):
+    """Encode a query result that was serialized column by column, the way `encode`
+    encodes it from its rows.
+
+    `keys` are the keys of the result in order (with ``rows``), `meta` its other
+    values, and `columns` a file for each of the `names` columns, with the JSON
+    encoded values of its `count` rows separated by commas (without brackets).
+    """
+    codec = _check_codec(codec)
+
+    header = {"v": FORMAT_VERSION, "keys": keys, "names": names, "count": count}
+    body = bytearray(_pack([_encode_block(header), _encode_block(meta)]))
+
+    for column in columns:
+        column.seek(0)
+        values = column.read()
+        body += _block_header.pack(len(values) + 2)
+        body += b"["
+        body += values
+        body += b"]"
+
+    return _compress(codec, body)
+
+
+def decode(text, lazy_rows=False):
+    """Decode the columnar text representation back into the same structure
+    `json_loads` would have returned for the original JSON payload.
+
+    With `lazy_rows`, ``rows`` is an iterator that builds each row as it's consumed.
+    """
+    if not is_columnar(text):
+        raise ColumnarFormatError("Not a columnar query result payload.")
+
+    codec, _, payload = text[len(MAGIC) :].partition(":")
+    if codec not in codecs:
+        raise ColumnarFormatError(
+            "Query result was compressed with {}, which is not installed.".format(codec)
+        )
+
+    _, decompress = codecs[codec]
+    blocks = _unpack(decompress(base64.b64decode(payload)))
+
+    header = _decode_block(blocks[0])
+    if header.get("v") != FORMAT_VERSION:
+        raise ColumnarFormatError(
+            "Unsupported columnar format version: {}".format(header.get("v"))
+        )
+
+    meta = _decode_block(blocks[1])
+    if "rows" not in header["keys"]:
+        return meta
+
+    names = header["names"]
+    if names is None:
+        rows = _decode_block(blocks[2])
+    elif names:
+        columns = [_decode_block(block) for block in blocks[2:]]
+        rows = (dict(zip(names, values)) for values in zip(*columns))
+    else:
+        rows = ({} for _ in range(header["count"]))
+
+    if not lazy_rows:
+        rows = list(rows)
+    elif isinstance(rows, list):
+        rows = iter(rows)
+
+    meta["rows"] = rows
+    return {key: meta[key] for key in header["keys"]}
+
+
+def loads(text):
+    """Deserialize a stored query result, whichever format it is in."""
+    if is_columnar(text):
+        return decode(text)
+
+    return json_loads(text)
@@ -1,6 +1,8 @@
 import os
 import datetime
 import logging
+import threading
+from http.server import ThreadingHTTPServer
 from unittest import TestCase
 from contextlib import contextmanager
 
@@ -22,7 +24,7 @@ os.environ["REDASH_RATELIMIT_ENABLED"] = "true"
 
 from redash import limiter, redis_connection
 from redash.app import create_app
-from redash.models import db
+from redash.models import db, query_result_reads
 from redash.utils import json_dumps, json_loads
 from tests.factories import Factory, user_factory
 
@@ -36,6 +38,20 @@ def authenticate_request(c, user):
         sess["user_id"] = user.get_id()
 
 
+@contextmanager
+def http_server(handler_class):
+    """Serves HTTP requests with the handler class (in threads), and yields the
+    server's base URL."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler_class)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        yield "http://127.0.0.1:{}".format(server.server_address[1])
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
 @contextmanager
 def authenticated_user(c, user=None):
     if not user:
@@ -65,6 +81,7 @@ class BaseTestCase(TestCase):
         db.get_engine(self.app).dispose()
         self.app_ctx.pop()
         redis_connection.flushdb()
+        query_result_reads.forget_touches()
 
     def make_request(
         self,
@@ -0,0 +1,90 @@
+"""
+Measure how many HTTP data source queries one AsyncWorker process runs at once:
+
+    PYTHONPATH=. python tests/benchmarks/bench_async_worker.py [queries] [seconds]
+
+Each query is of a Url data source, served by a local server that responds after
+`seconds` (1 by default), so the queries run for as long as the worker takes to
+run them all at once. It runs against the database in REDASH_DATABASE_URL and the
+Redis servers in REDASH_REDIS_URL and REDASH_RQ_REDIS_URL, from a "bench_http"
+queue; the organization, data source and results it creates are deleted at the end.
+"""
+import signal
+import sys
+import time
+
+from sqlalchemy.orm import configure_mappers
+
+from tests import http_server
+from tests.tasks.test_worker import SlowHandler
+from redash import create_app, models, rq_redis_connection
+from redash.utils.configuration import ConfigurationContainer
+from redash.tasks.queries.execution import execute_query
+from redash.tasks.worker import AsyncWorker, Queue
+
+QUERIES = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+SECONDS = float(sys.argv[2]) if len(sys.argv) > 2 else 1
+QUEUE_NAME = "bench_http"
+
+
+def measure(data_source_id, queue):
+    jobs = [
+        queue.enqueue(
+            execute_query, "{}?{}".format(SECONDS, i), data_source_id, {}
+        )
+        for i in range(QUERIES)
+    ]
+
+    handlers = {sig: signal.getsignal(sig) for sig in (signal.SIGINT, signal.SIGTERM)}
+    worker = AsyncWorker(
+        [queue],
+        connection=rq_redis_connection,
+        log_job_description=False,
+        concurrency=QUERIES,
+    )
+    started = time.perf_counter()
+    worker.work(burst=True, logging_level="WARNING")
+    elapsed = time.perf_counter() - started
+    for sig, handler in handlers.items():
+        signal.signal(sig, handler)
+
+    stored = sum(1 for job in jobs if isinstance(job.result, int))
+    print(
+        "AsyncWorker: {} queries of {}s in {:.2f}s, {} results stored".format(
+            QUERIES, SECONDS, elapsed, stored
+        )
+    )
+
+
+def main():
+    app = create_app()
+    with app.app_context(), http_server(SlowHandler) as url:
+        configure_mappers()
+        org = models.Organization(name="bench", slug="bench_http", settings={})
+        data_source = models.DataSource(
+            org=org,
+            name="bench_http",
+            type="url",
+            options=ConfigurationContainer({"url": url + "/"}),
+        )
+        models.db.session.add_all([org, data_source])
+        models.db.session.commit()
+        org_id, data_source_id = org.id, data_source.id
+        queue = Queue(QUEUE_NAME, connection=rq_redis_connection)
+        try:
+            measure(data_source_id, queue)
+        finally:
+            queue.empty()
+            models.db.session.rollback()
+            models.QueryResult.query.filter(
+                models.QueryResult.data_source_id == data_source_id
+            ).delete()
+            models.DataSource.query.filter(
+                models.DataSource.id == data_source_id
+            ).delete()
+            models.Organization.query.filter(models.Organization.id == org_id).delete()
+            models.db.session.commit()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""
+Compare running small queries with the PostgreSQL query runner when it connects
+for each query and when it reuses pooled connections:
+
+    PYTHONPATH=. python tests/benchmarks/bench_connection_pool.py [queries]
+
+Runs against the database in REDASH_DATABASE_URL. The gap grows with the cost of
+connecting: over TLS and to remote servers it's much wider than locally.
+"""
+import sys
+import time
+
+import mock
+from sqlalchemy.engine.url import make_url
+
+from redash import settings
+from redash.query_runner.pg import PostgreSQL
+
+QUERIES = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+
+
+def measure(name, query_runner, pool_size):
+    with mock.patch("redash.settings.QUERY_RUNNER_POOL_SIZE", pool_size):
+        started = time.perf_counter()
+        for _ in range(QUERIES):
+            _, error = query_runner.run_query("SELECT 1", None)
+            assert error is None, error
+        elapsed = time.perf_counter() - started
+
+    print(
+        "{}: {} queries in {:.2f}s, {:.2f}ms per query".format(
+            name, QUERIES, elapsed, elapsed / QUERIES * 1000
+        )
+    )
+
+
+def main():
+    url = make_url(settings.SQLALCHEMY_DATABASE_URI)
+    query_runner = PostgreSQL(
+        {
+            "user": url.username,
+            "password": url.password,
+            "host": url.host or url.query.get("host"),
+            "port": url.port,
+            "dbname": url.database,
+        }
+    )
+
+    measure("A connection per query", query_runner, 0)
+    measure("Pooled connections", query_runner, 1)
+
+
+if __name__ == "__main__":
+    main()
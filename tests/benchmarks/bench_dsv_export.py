@@ -0,0 +1,122 @@
+"""
+Compare the CSV export of a date heavy result with per cell conversion (the
+implementation before converters were applied per column batch) and with
+iter_query_result_dsv:
+
+    PYTHONPATH=. python tests/benchmarks/bench_dsv_export.py [rows]
+"""
+import csv
+import datetime
+import io
+import random
+import sys
+import time
+
+import mock
+from dateutil.parser import isoparse
+from funcy import rpartial
+
+from redash.serializers import query_result as serializer
+
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+
+COLUMNS = [
+    {"name": "id", "type": "integer"},
+    {"name": "day", "type": "date"},
+    {"name": "created_at", "type": "datetime"},
+    {"name": "active", "type": "boolean"},
+]
+
+
+class FakeOrg(object):
+    settings = {"date_format": "DD/MM/YY", "time_format": "HH:mm"}
+
+    def get_setting(self, key):
+        return self.settings[key]
+
+
+class FakeQueryResult(object):
+    def __init__(self, data):
+        self.lazy_data = data
+
+
+def generate_rows():
+    start = datetime.datetime(2019, 1, 1)
+    return [
+        {
+            "id": i,
+            "day": (start + datetime.timedelta(days=i % 365)).date().isoformat(),
+            "created_at": (
+                start + datetime.timedelta(minutes=random.randint(0, 525600))
+            ).isoformat()
+            + ".000Z",
+            "active": i % 2 == 0,
+        }
+        for i in range(ROWS)
+    ]
+
+
+def per_cell_convert_datetime(value, fmt):
+    if not value:
+        return value
+
+    try:
+        return isoparse(value).strftime(fmt)
+    except Exception:
+        return value
+
+
+def per_cell_export(data):
+    date_format = serializer._convert_format("DD/MM/YY")
+    datetime_format = serializer._convert_format("DD/MM/YY HH:mm")
+    special_types = {
+        "boolean": serializer._convert_bool,
+        "date": rpartial(per_cell_convert_datetime, date_format),
+        "datetime": rpartial(per_cell_convert_datetime, datetime_format),
+    }
+    special_columns = {
+        col["name"]: special_types[col["type"]]
+        for col in data["columns"]
+        if col["type"] in special_types
+    }
+
+    s = io.StringIO()
+    writer = csv.DictWriter(
+        s, extrasaction="ignore", fieldnames=[c["name"] for c in data["columns"]]
+    )
+    writer.writeheader()
+    for row in data["rows"]:
+        row = dict(row)
+        for col_name, converter in special_columns.items():
+            if col_name in row:
+                row[col_name] = converter(row[col_name])
+
+        writer.writerow(row)
+
+    return s.getvalue()
+
+
+def batched_export(data):
+    return "".join(serializer.iter_query_result_dsv(FakeQueryResult(data), ","))
+
+
+def measure(name, export, data):
+    started = time.perf_counter()
+    output = export(data)
+    print("{}: {:.2f}s".format(name, time.perf_counter() - started))
+    return output
+
+
+def main():
+    print("Generating {} rows...".format(ROWS))
+    data = {"columns": COLUMNS, "rows": generate_rows()}
+
+    with mock.patch.object(serializer, "current_org", FakeOrg()):
+        before = measure("per cell", per_cell_export, data)
+        after = measure("per column batch", batched_export, data)
+
+    assert before == after, "Exports differ"
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Compare enqueuing scheduled queries one by one with enqueue_query against the
+pipelined enqueue_queries that refresh_queries uses now:
+
+    PYTHONPATH=. python tests/benchmarks/bench_enqueue_queries.py [queries]
+
+Runs against the Redis servers in REDASH_REDIS_URL and REDASH_RQ_REDIS_URL. The
+queries aren't saved to the database; their jobs go to a "bench_scheduled" queue,
+which is emptied (along with the job locks) at the end.
+"""
+import sys
+import time
+from types import SimpleNamespace
+
+from redash import create_app, models, redis_connection, rq_redis_connection
+from redash.tasks.queries.execution import enqueue_queries, enqueue_query
+from redash.tasks.worker import Queue
+
+QUERIES = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+DATA_SOURCE_ID = 2 ** 31 - 1
+QUEUE_NAME = "bench_scheduled"
+
+
+def cleanup():
+    queue = Queue(QUEUE_NAME, connection=rq_redis_connection)
+    queue.empty()
+    for key in rq_redis_connection.scan_iter(
+        Queue.fair_prefix(queue.key) + "*", count=1000
+    ):
+        rq_redis_connection.delete(key)
+    for key in redis_connection.scan_iter(
+        "query_hash_job:{}:*".format(DATA_SOURCE_ID), count=1000
+    ):
+        redis_connection.delete(key)
+
+
+def one_by_one(queries):
+    for query in queries:
+        enqueue_query(
+            query.query_text,
+            query.data_source,
+            query.user_id,
+            scheduled_query=query,
+            metadata={"Query ID": query.id, "Username": "Scheduled"},
+        )
+
+
+def pipelined(queries):
+    enqueue_queries(
+        [
+            (query.query_text, query, {"Query ID": query.id, "Username": "Scheduled"})
+            for query in queries
+        ]
+    )
+
+
+def measure(name, fn, queries):
+    cleanup()
+    started = time.perf_counter()
+    fn(queries)
+    elapsed = time.perf_counter() - started
+    count = Queue(QUEUE_NAME, connection=rq_redis_connection).count
+    print("{}: {:.3f}s, {} jobs".format(name, elapsed, count))
+
+
+def main():
+    app = create_app()
+    with app.app_context():
+        org = models.Organization(id=DATA_SOURCE_ID, name="bench", settings={})
+        data_source = models.DataSource(
+            id=DATA_SOURCE_ID,
+            org=org,
+            org_id=org.id,
+            name="bench",
+            type="pg",
+            options={},
+            scheduled_queue_name=QUEUE_NAME,
+        )
+        # Query records its changes (to the database) when it's created, and only
+        # these attributes of it are used to enqueue it.
+        queries = [
+            SimpleNamespace(
+                id=i,
+                data_source=data_source,
+                user_id=1,
+                query_text="SELECT {}".format(i),
+            )
+            for i in range(1, QUERIES + 1)
+        ]
+
+        try:
+            measure("enqueue_query, one by one", one_by_one, queries)
+            measure("enqueue_queries", pipelined, queries)
+        finally:
+            cleanup()
+
+
+if __name__ == "__main__":
+    main()
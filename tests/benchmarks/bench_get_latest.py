@@ -0,0 +1,105 @@
+"""
+Compare the query plan and timing of QueryResult.get_latest's freshness
+predicate before and after making it sargable.
+
+Runs against the database in REDASH_DATABASE_URL (tables must exist), inside a
+transaction that is rolled back at the end:
+
+    PYTHONPATH=. python tests/benchmarks/bench_get_latest.py [rows]
+"""
+import sys
+import time
+
+from sqlalchemy import text
+
+from redash import create_app, models
+from redash.models import db
+from redash.utils import gen_query_hash
+
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+HASHES = 2000
+REPEAT = 200
+
+OLD_PREDICATE = (
+    "timezone('utc', retrieved_at) + interval '{max_age} seconds' "
+    ">= timezone('utc', now())"
+)
+NEW_PREDICATE = "retrieved_at >= now() - interval '{max_age} seconds'"
+
+LOOKUP = """
+SELECT id FROM query_results
+WHERE query_hash = :query_hash AND data_source_id = :data_source_id AND {predicate}
+ORDER BY retrieved_at DESC
+LIMIT 1
+"""
+
+
+def populate(data_source):
+    db.session.execute(
+        text(
+            """
+            INSERT INTO query_results
+                (org_id, data_source_id, query_hash, query, data, runtime, retrieved_at)
+            SELECT :org_id, :data_source_id, md5('query' || (i % :hashes)),
+                   'query ' || (i % :hashes), '{}', 1,
+                   now() - (i || ' seconds')::interval
+            FROM generate_series(1, :rows) AS i
+            """
+        ),
+        {
+            "org_id": data_source.org_id,
+            "data_source_id": data_source.id,
+            "hashes": HASHES,
+            "rows": ROWS,
+        },
+    )
+    db.session.execute(text("ANALYZE query_results"))
+
+
+def measure(name, predicate, params):
+    statement = text(LOOKUP.format(predicate=predicate.format(max_age=3600)))
+
+    plan = db.session.execute(text("EXPLAIN " + str(statement)), params)
+    print("\n{} plan:".format(name))
+    for (line,) in plan:
+        print("  " + line)
+
+    started = time.perf_counter()
+    for _ in range(REPEAT):
+        db.session.execute(statement, params).fetchall()
+    elapsed = (time.perf_counter() - started) / REPEAT * 1000
+    print("{}: {:.3f} ms per lookup".format(name, elapsed))
+
+
+def main():
+    app = create_app()
+    with app.app_context():
+        org = models.Organization(name="bench", slug="bench-get-latest", settings={})
+        data_source = models.DataSource(
+            org=org, name="bench", type="pg", options={}
+        )
+        db.session.add_all([org, data_source])
+        db.session.flush()
+
+        print("Inserting {} query results...".format(ROWS))
+        populate(data_source)
+
+        params = {
+            "query_hash": gen_query_hash("query 42"),
+            "data_source_id": data_source.id,
+        }
+        try:
+            measure("timezone() predicate", OLD_PREDICATE, params)
+            measure("sargable predicate", NEW_PREDICATE, params)
+
+            started = time.perf_counter()
+            for _ in range(REPEAT):
+                models.QueryResult.get_latest(data_source, "query 42", 3600)
+            elapsed = (time.perf_counter() - started) / REPEAT * 1000
+            print("\nQueryResult.get_latest: {:.3f} ms per call".format(elapsed))
+        finally:
+            db.session.rollback()
+
+
+if __name__ == "__main__":
+    main()
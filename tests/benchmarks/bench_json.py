@@ -0,0 +1,82 @@
+"""
+Compare the simplejson and orjson backends of redash.utils.json_dumps on query
+result payloads (json_loads always uses simplejson, and is measured for reference):
+
+    PYTHONPATH=. python tests/benchmarks/bench_json.py [rows]
+"""
+import datetime
+import decimal
+import random
+import sys
+import timeit
+
+import mock
+import pytz
+
+from redash import utils
+from redash.query_runner.pg import PostgreSQLJSONEncoder
+from redash.utils import json_dumps, json_loads
+
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+
+def raw_rows():
+    """Rows as a query runner returns them (before serialization)."""
+    start = datetime.datetime(2019, 1, 1, tzinfo=pytz.utc)
+    return [
+        {
+            "id": i,
+            "user_id": random.randint(1, 10000),
+            "name": "user {}".format(random.randint(1, 10000)),
+            "amount": decimal.Decimal(random.randint(0, 10 ** 6)) / 100,
+            "ratio": random.random(),
+            "created_at": start + datetime.timedelta(seconds=random.randint(0, 10 ** 7)),
+            "day": (start + datetime.timedelta(days=i % 365)).date(),
+            "active": i % 3 == 0,
+            "comment": None if i % 5 else "Лорем ипсум dolor sit amet",
+        }
+        for i in range(ROWS)
+    ]
+
+
+def bench(name, fn, number=3):
+    seconds = min(timeit.repeat(fn, number=1, repeat=number))
+    print("  {:<40} {:8.3f}s".format(name, seconds))
+
+
+def main():
+    if utils.orjson is None:
+        print("orjson isn't installed; only the simplejson backend is available.")
+
+    rows = raw_rows()
+    result = {"columns": [{"name": name} for name in rows[0]], "rows": rows}
+    small_results = [{"columns": [], "rows": rows[i : i + 10]} for i in range(0, 1000, 10)]
+
+    backends = [("simplejson", False)]
+    if utils.orjson is not None:
+        backends.append(("orjson", True))
+
+    for backend, use_orjson in backends:
+        print("{} ({} rows):".format(backend, ROWS))
+        with mock.patch.object(utils, "use_orjson", use_orjson):
+            serialized = json_dumps(result, ignore_nan=True, cls=PostgreSQLJSONEncoder)
+            bench(
+                "dumps result (runner)",
+                lambda: json_dumps(result, ignore_nan=True, cls=PostgreSQLJSONEncoder),
+            )
+            bench("loads result (DBPersistence.data)", lambda: json_loads(serialized))
+
+            decoded = json_loads(serialized)
+            bench(
+                "dumps decoded result",
+                lambda: json_dumps(decoded, ignore_nan=True),
+            )
+            bench(
+                "dumps 100 small results",
+                lambda: [json_dumps(r, ignore_nan=True) for r in small_results],
+            )
+            print("  serialized size: {:.1f} MB".format(len(serialized) / 1024 / 1024))
+
+
+if __name__ == "__main__":
+    main()
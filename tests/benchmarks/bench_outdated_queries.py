@@ -0,0 +1,177 @@
+"""
+Compare the full scan Query.outdated_queries did over every scheduled query with
+the next run index it uses now, on synthetic schedules:
+
+    PYTHONPATH=. python tests/benchmarks/bench_outdated_queries.py [queries]
+
+Runs against the database in REDASH_DATABASE_URL (tables must exist), inside a
+transaction that is rolled back at the end. The Redis keys are suffixed with
+":bench" and deleted at the end.
+"""
+import datetime
+import random
+import sys
+import time
+
+import mock
+import pytz
+from sqlalchemy import text
+from sqlalchemy.orm import joinedload
+
+from redash import create_app, models, redis_connection, utils
+from redash.models import db
+
+QUERIES = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+INTERVALS = [60, 300, 900, 3600, 86400]
+
+
+def populate(org, user, data_source):
+    db.session.execute(
+        text(
+            """
+            INSERT INTO queries
+                (org_id, data_source_id, user_id, name, query, query_hash, api_key,
+                 version, is_archived, is_draft, schedule_failures, options,
+                 schedule, created_at, updated_at)
+            SELECT :org_id, :data_source_id, :user_id, 'query ' || i,
+                   'SELECT ' || i, md5('SELECT ' || i), md5('key' || i),
+                   1, false, false, 0, '{}',
+                   json_build_object('interval', (CAST(:intervals AS text[]))[1 + i % :n],
+                                     'time', null, 'until', null,
+                                     'day_of_week', null)::text,
+                   now(), now()
+            FROM generate_series(1, :queries) AS i
+            """
+        ),
+        {
+            "org_id": org.id,
+            "data_source_id": data_source.id,
+            "user_id": user.id,
+            "intervals": [str(i) for i in INTERVALS],
+            "n": len(INTERVALS),
+            "queries": QUERIES,
+        },
+    )
+
+    # Every query ran within its interval, except for a few that are due now.
+    now = utils.utcnow().timestamp()
+    rows = db.session.execute(
+        text("SELECT id, schedule FROM queries WHERE org_id = :org_id"),
+        {"org_id": org.id},
+    )
+    executions = {}
+    for query_id, schedule in rows:
+        interval = int(utils.json_loads(schedule)["interval"])
+        executions[query_id] = now - interval * random.uniform(0, 1.01)
+
+    for chunk in range(0, len(executions), 10000):
+        redis_connection.hmset(
+            models.ScheduledQueriesExecutions.KEY_NAME,
+            dict(list(executions.items())[chunk : chunk + 10000]),
+        )
+
+
+def full_scan():
+    """Query.outdated_queries before the next run index."""
+    queries = (
+        models.Query.query.options(
+            joinedload(models.Query.latest_query_data).load_only("retrieved_at")
+        )
+        .filter(models.Query.schedule.isnot(None))
+        .order_by(models.Query.id)
+    )
+
+    now = utils.utcnow()
+    outdated_queries = {}
+    models.scheduled_queries_executions.refresh()
+
+    for query in queries:
+        if query.schedule.get("disabled"):
+            continue
+
+        if query.schedule["until"]:
+            schedule_until = pytz.utc.localize(
+                datetime.datetime.strptime(query.schedule["until"], "%Y-%m-%d")
+            )
+            if schedule_until <= now:
+                continue
+
+        retrieved_at = models.scheduled_queries_executions.get(query.id) or (
+            query.latest_query_data and query.latest_query_data.retrieved_at
+        )
+
+        if models.should_schedule_next(
+            retrieved_at or now,
+            now,
+            query.schedule["interval"],
+            query.schedule["time"],
+            query.schedule["day_of_week"],
+            query.schedule_failures,
+        ):
+            key = "{}:{}".format(query.query_hash, query.data_source_id)
+            outdated_queries[key] = query
+
+    return list(outdated_queries.values())
+
+
+def measure(name, fn):
+    db.session.expunge_all()
+    started = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - started
+    print("{}: {:.3f}s, {} outdated".format(name, elapsed, len(result)))
+    return set(query.id for query in result)
+
+
+def main():
+    keys = {
+        models.ScheduledQueriesExecutions: "KEY_NAME",
+        models.ScheduledQueriesNextRuns: "KEY_NAME",
+    }
+    patches = [
+        mock.patch.object(cls, attr, getattr(cls, attr) + ":bench")
+        for cls, attr in keys.items()
+    ]
+    patches.append(
+        mock.patch.object(
+            models.ScheduledQueriesNextRuns,
+            "BUILT_KEY_NAME",
+            models.ScheduledQueriesNextRuns.BUILT_KEY_NAME + ":bench",
+        )
+    )
+
+    # Both implementations look at the same point in time.
+    patches.append(mock.patch.object(utils, "utcnow", return_value=utils.utcnow()))
+
+    app = create_app()
+    with app.app_context():
+        for patch in patches:
+            patch.start()
+
+        org = models.Organization(name="bench", slug="bench-outdated", settings={})
+        user = models.User(org=org, name="bench", email="bench@example.com")
+        data_source = models.DataSource(org=org, name="bench", type="pg", options={})
+        db.session.add_all([org, user, data_source])
+        db.session.flush()
+
+        try:
+            print("Inserting {} scheduled queries...".format(QUERIES))
+            populate(org, user, data_source)
+
+            before = measure("full scan", full_scan)
+            measure("index build (first pass)", models.Query.outdated_queries)
+            after = measure("next run index", models.Query.outdated_queries)
+            assert before == after, "Outdated queries differ"
+        finally:
+            db.session.rollback()
+            redis_connection.delete(
+                models.ScheduledQueriesExecutions.KEY_NAME,
+                models.ScheduledQueriesNextRuns.KEY_NAME,
+                models.ScheduledQueriesNextRuns.BUILT_KEY_NAME,
+            )
+            for patch in patches:
+                patch.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Compare how many short jobs per second a worker runs when it forks a work horse
+for each job (HardLimitingWorker) and when its work horse is long-lived
+(PreforkWorker):
+
+    PYTHONPATH=. python tests/benchmarks/bench_prefork_worker.py [jobs]
+
+The jobs are like the ones on the "default" queue (record_event and such): a
+database statement and a Redis command each. They run against the database in
+REDASH_DATABASE_URL and the Redis servers in REDASH_REDIS_URL and
+REDASH_RQ_REDIS_URL, from a "bench_default" queue that's emptied at the end.
+"""
+import importlib
+import signal
+import sys
+import time
+
+from rq import Connection
+from sqlalchemy.orm import configure_mappers
+
+from redash import create_app, models, redis_connection, rq_redis_connection
+from redash.tasks.worker import HardLimitingWorker, PreforkWorker, Queue
+
+JOBS = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+QUEUE_NAME = "bench_default"
+# Functions of __main__ can't be enqueued, so the job is enqueued by its name.
+JOB = "tests.benchmarks.bench_prefork_worker.short_job"
+
+
+def short_job():
+    models.db.session.execute("SELECT 1")
+    models.db.session.commit()
+    redis_connection.incr("bench_prefork_worker")
+
+
+def measure(worker_class, queue):
+    queue.empty()
+    for _ in range(JOBS):
+        queue.enqueue(JOB, result_ttl=0)
+
+    handlers = {sig: signal.getsignal(sig) for sig in (signal.SIGINT, signal.SIGTERM)}
+    worker = worker_class(
+        [queue],
+        connection=rq_redis_connection,
+        log_job_description=False,
+        job_monitoring_interval=5,
+    )
+    started = time.perf_counter()
+    worker.work(burst=True, logging_level="WARNING")
+    elapsed = time.perf_counter() - started
+    for sig, handler in handlers.items():
+        signal.signal(sig, handler)
+
+    print(
+        "{}: {} jobs in {:.2f}s, {:.0f} jobs/s".format(
+            worker_class.__name__, JOBS, elapsed, JOBS / elapsed
+        )
+    )
+
+
+def main():
+    # Imported once here, like the job modules of the worker command.
+    importlib.import_module(JOB.rsplit(".", 1)[0])
+    app = create_app()
+    with app.app_context(), Connection(rq_redis_connection):
+        configure_mappers()
+        queue = Queue(QUEUE_NAME, connection=rq_redis_connection)
+        try:
+            measure(HardLimitingWorker, queue)
+            measure(PreforkWorker, queue)
+        finally:
+            queue.empty()
+            redis_connection.delete("bench_prefork_worker")
+
+
+if __name__ == "__main__":
+    main()
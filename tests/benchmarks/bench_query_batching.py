@@ -0,0 +1,105 @@
+"""
+Compare how long a worker takes to run the queries of a dashboard (short ad-hoc
+queries of one PostgreSQL data source, enqueued at once) when each runs in its own
+job and when they're batched:
+
+    PYTHONPATH=. python tests/benchmarks/bench_query_batching.py [queries]
+
+The queries are of the database in REDASH_DATABASE_URL, and run by a
+HardLimitingWorker from a "bench_queries" queue of the Redis servers in
+REDASH_REDIS_URL and REDASH_RQ_REDIS_URL. The organization, data source and results
+it creates are deleted at the end.
+"""
+import signal
+import sys
+import time
+
+import mock
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.orm import configure_mappers
+
+from redash import create_app, models, rq_redis_connection, settings
+from redash.serializers import serialize_job
+from redash.tasks.queries.execution import enqueue_query
+from redash.tasks.queries.runtimes import record_runtime
+from redash.tasks.worker import HardLimitingWorker, Queue
+from redash.utils import gen_query_hash
+from redash.utils.configuration import ConfigurationContainer
+
+QUERIES = int(sys.argv[1]) if len(sys.argv) > 1 else 30
+QUEUE_NAME = "bench_queries"
+
+
+def measure(name, data_source, queue, batching):
+    queries = ["SELECT {} AS widget".format(i) for i in range(QUERIES)]
+    for query in queries:
+        record_runtime(data_source.id, gen_query_hash(query), 0.01)
+
+    handlers = {sig: signal.getsignal(sig) for sig in (signal.SIGINT, signal.SIGTERM)}
+    with mock.patch.multiple(
+        "redash.settings", QUERY_BATCHING=batching, QUERY_BATCH_WINDOW=0.05
+    ):
+        started = time.perf_counter()
+        jobs = [enqueue_query(query, data_source, None) for query in queries]
+        worker = HardLimitingWorker(
+            [queue],
+            connection=rq_redis_connection,
+            log_job_description=False,
+            job_monitoring_interval=1,
+        )
+        worker.work(burst=True, logging_level="WARNING")
+        elapsed = time.perf_counter() - started
+    for sig, handler in handlers.items():
+        signal.signal(sig, handler)
+
+    stored = sum(1 for job in jobs if serialize_job(job)["job"]["status"] == 3)
+    print(
+        "{}: {} queries in {:.2f}s, {} results stored".format(
+            name, QUERIES, elapsed, stored
+        )
+    )
+
+
+def main():
+    url = make_url(settings.SQLALCHEMY_DATABASE_URI)
+    app = create_app()
+    with app.app_context():
+        configure_mappers()
+        org = models.Organization(name="bench", slug="bench_batching", settings={})
+        data_source = models.DataSource(
+            org=org,
+            name="bench_batching",
+            type="pg",
+            queue_name=QUEUE_NAME,
+            options=ConfigurationContainer(
+                {
+                    "user": url.username,
+                    "password": url.password,
+                    "host": url.host or url.query.get("host"),
+                    "port": url.port,
+                    "dbname": url.database,
+                }
+            ),
+        )
+        models.db.session.add_all([org, data_source])
+        models.db.session.commit()
+        org_id, data_source_id = org.id, data_source.id
+        queue = Queue(QUEUE_NAME, connection=rq_redis_connection)
+        try:
+            measure("A job per query", data_source, queue, False)
+            measure("Batched queries", data_source, queue, True)
+        finally:
+            queue.empty()
+            models.db.session.rollback()
+            models.QueryResult.query.filter(
+                models.QueryResult.data_source_id == data_source_id
+            ).delete()
+            models.DataSource.query.filter(
+                models.DataSource.id == data_source_id
+            ).delete()
+            models.Organization.query.filter(models.Organization.id == org_id).delete()
+            models.db.session.commit()
+
+
+if __name__ == "__main__":
+    main()
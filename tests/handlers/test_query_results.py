@@ -1,7 +1,13 @@
+import gzip
+
+import mock
+
 from tests import BaseTestCase
 
+from redash import models, redis_connection
 from redash.models import db
-from redash.utils import json_dumps
+from redash.result_cache import QueryResultCache, query_result_cache
+from redash.utils import json_dumps, json_loads
 from redash.handlers.query_results import error_messages
 
 
@@ -29,6 +35,90 @@ class TestQueryResultsCacheHeaders(BaseTestCase):
         self.assertEqual(404, rv.status_code)
 
 
+@mock.patch("redash.settings.QUERY_RESULTS_CACHE_ENABLED", True)
+class TestQueryResultsPayloadCache(BaseTestCase):
+    def setUp(self):
+        super(TestQueryResultsPayloadCache, self).setUp()
+        cache = QueryResultCache(
+            query_result_cache.redis,
+            memory_size=1024 * 1024,
+            max_item_size=1024 * 1024,
+            ttl=60,
+            key_prefix="test_query_result_payload",
+        )
+        patcher = mock.patch("redash.handlers.query_results.query_result_cache", cache)
+        self.cache = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        for key in self.cache.redis.scan_iter("test_query_result_payload:*"):
+            self.cache.redis.delete(key)
+        super(TestQueryResultsPayloadCache, self).tearDown()
+
+    def get_result(self, query_result, **kwargs):
+        return self.make_request(
+            "get", "/api/query_results/{}.json".format(query_result.id), **kwargs
+        )
+
+    def test_serves_the_same_payload_from_cache(self):
+        query_result = self.factory.create_query_result()
+
+        rv = self.get_result(query_result)
+        self.assertEqual(200, rv.status_code)
+        self.assertIsNotNone(self.cache.get(query_result.id))
+
+        with mock.patch(
+            "redash.models.QueryResult.to_dict", side_effect=AssertionError
+        ):
+            cached_rv = self.get_result(query_result)
+
+        self.assertEqual(rv.data, cached_rv.data)
+        self.assertEqual(
+            query_result.id, json_loads(cached_rv.data)["query_result"]["id"]
+        )
+
+    def test_sends_compressed_payload_when_client_accepts_gzip(self):
+        query_result = self.factory.create_query_result()
+
+        rv = self.client.get(
+            "/{}/api/query_results/{}.json".format(
+                self.factory.org.slug, query_result.id
+            ),
+            headers={
+                "Accept-Encoding": "gzip, deflate",
+                "Authorization": "Key {}".format(self.factory.user.api_key),
+            },
+        )
+
+        self.assertEqual("gzip", rv.headers["Content-Encoding"])
+        payload = json_loads(gzip.decompress(rv.data))
+        self.assertEqual(query_result.id, payload["query_result"]["id"])
+
+
+class TestQueryResultDsvResponse(BaseTestCase):
+    def test_streams_csv_file(self):
+        query_result = self.factory.create_query_result(
+            data=json_dumps(
+                {
+                    "columns": [{"name": "x", "type": "integer"}],
+                    "rows": [{"x": i} for i in range(3000)],
+                }
+            )
+        )
+
+        rv = self.make_request(
+            "get",
+            "/api/query_results/{}.csv".format(query_result.id),
+            is_json=False,
+        )
+
+        self.assertEqual(200, rv.status_code)
+        self.assertTrue(rv.is_streamed)
+        self.assertEqual(
+            ["x"] + [str(i) for i in range(3000)], rv.data.decode().split()
+        )
+
+
 class TestQueryResultsContentDispositionHeaders(BaseTestCase):
     def test_supports_unicode(self):
         query_result = self.factory.create_query_result()
@@ -191,6 +281,18 @@ class TestQueryResultAPI(BaseTestCase):
         rv = self.make_request("get", "/api/query_results/{}".format(query_result.id))
         self.assertEqual(rv.status_code, 200)
 
+    def test_marks_result_as_read(self):
+        query_result = self.factory.create_query_result()
+
+        self.make_request("get", "/api/query_results/{}".format(query_result.id))
+
+        self.assertIsNotNone(
+            redis_connection.hget(
+                models.QueryResultReads.KEY_NAME,
+                "{}:{}".format(query_result.data_source_id, query_result.query_hash),
+            )
+        )
+
     def test_execute_new_query(self):
         query = self.factory.create_query()
 
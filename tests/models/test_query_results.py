@@ -5,8 +5,8 @@ from tests import BaseTestCase
 from mock import patch
 
 from redash import models
-from redash.models import DBPersistence
-from redash.utils import utcnow, json_dumps
+from redash.models import ColumnarPersistence, DBPersistence
+from redash.utils import columnar, utcnow, json_dumps, json_loads
 
 
 class QueryResultTest(BaseTestCase):
@@ -110,3 +110,48 @@ class TestDBPersistence(TestCase):
         a = p.data
         b = p.data
         json_loads_patch.assert_called_once_with(json_data)
+
+
+class TestColumnarPersistence(TestCase):
+    def test_stores_data_in_columnar_format(self):
+        p = ColumnarPersistence()
+        p.data = json_dumps({"columns": [], "rows": [{"test": 1}]})
+        self.assertTrue(columnar.is_columnar(p._data))
+        self.assertDictEqual(p.data, {"columns": [], "rows": [{"test": 1}]})
+
+    def test_reads_data_stored_as_json(self):
+        p = ColumnarPersistence()
+        p._data = json_dumps({"columns": [], "rows": [{"test": 1}]})
+        self.assertDictEqual(p.data, {"columns": [], "rows": [{"test": 1}]})
+
+    def test_updating_data_removes_cached_result(self):
+        p = ColumnarPersistence()
+        p.data = '{"test": 1}'
+        self.assertDictEqual(p.data, {"test": 1})
+        p.data = '{"test": 2}'
+        self.assertDictEqual(p.data, {"test": 2})
+
+    def test_serialized_data(self):
+        p = ColumnarPersistence()
+        p.data = json_dumps({"columns": [], "rows": [{"test": 1}]})
+        self.assertEqual(
+            json_loads(p.serialized_data), {"columns": [], "rows": [{"test": 1}]}
+        )
+
+        p._data = '{"rows": []}'
+        self.assertEqual(p.serialized_data, '{"rows": []}')
+
+    def test_lazy_data(self):
+        p = ColumnarPersistence()
+        p._data = columnar.encode({"columns": [], "rows": [{"test": 1}]})
+        self.assertEqual(list(p.lazy_data["rows"]), [{"test": 1}])
+
+        p._data = json_dumps({"columns": [], "rows": [{"test": 1}]})
+        self.assertEqual(p.lazy_data["rows"], [{"test": 1}])
+
+    def test_keeps_data_that_is_not_a_result_as_is(self):
+        p = ColumnarPersistence()
+        p.data = ""
+        self.assertEqual(p._data, "")
+        p.data = None
+        self.assertIsNone(p.data)
@@ -1,7 +1,10 @@
+import asyncio
 import mock
+from http.server import BaseHTTPRequestHandler
 from unittest import TestCase
 
 import requests
+from tests import http_server
 from redash.query_runner import BaseHTTPQueryRunner
 
 
@@ -9,6 +12,40 @@ class RequiresAuthQueryRunner(BaseHTTPQueryRunner):
     requires_authentication = True
 
 
+class EchoAuthHandler(BaseHTTPRequestHandler):
+    """Responds to /<status> with that status and the Authorization header."""
+
+    def do_GET(self):
+        body = (self.headers.get("Authorization") or "").encode("utf-8")
+        self.send_response(int(self.path.strip("/")))
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class EchoRequestHandler(BaseHTTPRequestHandler):
+    """Responds with the path and body of the request."""
+
+    def do_GET(self):
+        self.echo(b"")
+
+    def do_POST(self):
+        self.echo(self.rfile.read(int(self.headers.get("Content-Length") or 0)))
+
+    def echo(self, body):
+        content = self.path.encode("utf-8") + b"\n" + body
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+
 class TestBaseHTTPQueryRunner(TestCase):
     def test_requires_authentication_default(self):
         self.assertFalse(BaseHTTPQueryRunner.requires_authentication)
@@ -127,3 +164,54 @@ class TestBaseHTTPQueryRunner(TestCase):
         self.assertRaisesRegex(
             ValueError, exception_message, query_runner.get_response, url
         )
+
+    def test_get_response_async(self):
+        query_runner = BaseHTTPQueryRunner(
+            {"username": "username", "password": "password"}
+        )
+        with http_server(EchoAuthHandler) as url:
+            response, error = asyncio.run(
+                query_runner.get_response_async(url + "/200")
+            )
+
+        self.assertIsNone(error)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual("Basic dXNlcm5hbWU6cGFzc3dvcmQ=", response.text)
+
+    def test_get_response_async_with_error_status(self):
+        query_runner = BaseHTTPQueryRunner({})
+        with http_server(EchoAuthHandler) as url:
+            response, error = asyncio.run(
+                query_runner.get_response_async(url + "/404")
+            )
+
+        self.assertEqual(404, response.status_code)
+        self.assertIn("Return Code: 404", error)
+
+    def test_get_response_async_connection_error(self):
+        query_runner = BaseHTTPQueryRunner({})
+        response, error = asyncio.run(
+            query_runner.get_response_async("http://127.0.0.1:1/")
+        )
+
+        self.assertIsNone(response.status_code)
+        self.assertIsNotNone(error)
+
+    def test_get_response_async_encodes_fields_like_requests(self):
+        query_runner = BaseHTTPQueryRunner({})
+        fields = {"a": None, "b": True, "c": [1, None, 2.5], "d": "x y"}
+
+        with http_server(EchoRequestHandler) as url:
+            for http_method, option in [("get", "params"), ("post", "data")]:
+                response, error = asyncio.run(
+                    query_runner.get_response_async(
+                        url + "/", http_method=http_method, **{option: fields}
+                    )
+                )
+                expected, _ = query_runner.get_response(
+                    url + "/", http_method=http_method, **{option: fields}
+                )
+
+                self.assertIsNone(error)
+                self.assertEqual(expected.text, response.text)
+
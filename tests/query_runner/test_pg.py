@@ -1,5 +1,16 @@
 from unittest import TestCase
-from redash.query_runner.pg import build_schema
+
+import mock
+from sqlalchemy.engine.url import make_url
+
+from redash import settings
+from redash.query_runner import pool
+from redash.query_runner.pg import (
+    PostgreSQL,
+    build_schema,
+    split_for_server_side_cursor,
+)
+from redash.utils import json_loads
 
 
 class TestBuildSchema(TestCase):
@@ -24,3 +35,90 @@ class TestBuildSchema(TestCase):
         self.assertListEqual(schema["main.users"]["columns"], ["id", "name"])
         self.assertIn('public."main.users"', schema.keys())
         self.assertListEqual(schema['public."main.users"']["columns"], ["id"])
+
+
+class TestSplitForServerSideCursor(TestCase):
+    def test_single_select(self):
+        self.assertEqual(
+            split_for_server_side_cursor("/* Username: a */ SELECT 1;"),
+            ([], "/* Username: a */ SELECT 1"),
+        )
+
+    def test_setup_statements_before_select(self):
+        query = "set query_group to adhoc;\nWITH a AS (SELECT 1) SELECT * FROM a;"
+
+        self.assertEqual(
+            split_for_server_side_cursor(query),
+            (["set query_group to adhoc"], "WITH a AS (SELECT 1) SELECT * FROM a"),
+        )
+
+    def test_non_select_queries(self):
+        self.assertIsNone(split_for_server_side_cursor("INSERT INTO t VALUES (1)"))
+        self.assertIsNone(split_for_server_side_cursor("SELECT 1; DELETE FROM t"))
+        self.assertIsNone(split_for_server_side_cursor("EXPLAIN SELECT 1"))
+        self.assertIsNone(split_for_server_side_cursor(""))
+
+    def test_other_statements_before_select(self):
+        for query in [
+            "VACUUM; SELECT 1",
+            "CREATE TEMP TABLE t AS SELECT 1; SELECT * FROM t",
+            "COMMIT; SELECT 1",
+            "SET LOCAL search_path TO a; SELECT 1",
+            "SET TRANSACTION READ ONLY; SELECT 1",
+        ]:
+            self.assertIsNone(split_for_server_side_cursor(query), query)
+
+
+class TestPooledConnections(TestCase):
+    def setUp(self):
+        pool._pools.clear()
+        self.addCleanup(pool._pools.clear)
+        url = make_url(settings.SQLALCHEMY_DATABASE_URI)
+        self.query_runner = PostgreSQL(
+            {
+                "user": url.username,
+                "password": url.password,
+                "host": url.host or url.query.get("host"),
+                "port": url.port,
+                "dbname": url.database,
+            }
+        )
+        patcher = mock.patch("redash.settings.QUERY_RUNNER_POOL_SIZE", 1)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def run_query(self, query):
+        data, error = self.query_runner.run_query(query, None)
+        return json_loads(data)["rows"] if data else error
+
+    def test_doesnt_reuse_session_state(self):
+        self.run_query("SET search_path TO pg_catalog")
+        self.run_query("CREATE TEMP TABLE pooled (a int)")
+
+        self.assertEqual(
+            [{"search_path": '"$user", public'}], self.run_query("SHOW search_path")
+        )
+        self.assertEqual(
+            {"hits": 2, "misses": 1, "discarded": 0},
+            {
+                key: value
+                for key, value in list(pool.pool_stats().values())[0].items()
+                if key in ("hits", "misses", "discarded")
+            },
+        )
+        self.assertIn("does not exist", self.run_query("SELECT * FROM pooled"))
+
+    def test_fetches_selects_with_a_server_side_cursor(self):
+        self.query_runner.configuration["server_side_cursor"] = True
+        self.query_runner.configuration["fetch_size"] = 2
+
+        self.assertEqual(
+            [{"n": n} for n in range(1, 6)],
+            self.run_query(
+                "SET search_path TO pg_catalog;\nSELECT generate_series(1, 5) AS n"
+            ),
+        )
+        self.assertEqual(
+            [{"a": 1}],
+            self.run_query("CREATE TEMP TABLE t AS SELECT 1 AS a; SELECT * FROM t"),
+        )
@@ -0,0 +1,137 @@
+import os
+import time
+from unittest import TestCase
+
+import mock
+
+from redash.query_runner import BaseQueryRunner
+from redash.query_runner import pool
+from redash.query_runner.pool import (
+    pool_stats,
+    pooled_connection,
+    reused_connections,
+)
+
+
+class Connection(object):
+    def __init__(self):
+        self.closed = False
+        self.healthy = True
+
+    def close(self):
+        self.closed = True
+
+
+class PoolingQueryRunner(BaseQueryRunner):
+    def _connect(self):
+        return Connection()
+
+    def _check_connection(self, connection):
+        return connection.healthy
+
+
+class TestPooledConnection(TestCase):
+    def setUp(self):
+        pool._pools.clear()
+        self.query_runner = PoolingQueryRunner({"host": "example.com"})
+        patcher = mock.patch.multiple(
+            "redash.settings",
+            QUERY_RUNNER_POOL_SIZE=2,
+            QUERY_RUNNER_POOL_MAX_IDLE_TIME=300,
+            QUERY_RUNNER_POOL_MAX_LIFETIME=3600,
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def use(self, query_runner=None):
+        with pooled_connection(query_runner or self.query_runner) as connection:
+            return connection
+
+    def test_reuses_connections(self):
+        first = self.use()
+        second = self.use()
+
+        self.assertIs(first, second)
+        self.assertFalse(first.closed)
+        self.assertEqual(
+            [{"idle": 1, "checked_out": 0, "hits": 1, "misses": 1, "discarded": 0}],
+            list(pool_stats().values()),
+        )
+
+    def test_pools_connections_by_configuration(self):
+        other = PoolingQueryRunner({"host": "example.org"})
+
+        self.assertIsNot(self.use(), self.use(other))
+        self.assertEqual(2, len(pool_stats()))
+
+    def test_discards_connections_when_the_block_raises(self):
+        with self.assertRaises(ValueError):
+            with pooled_connection(self.query_runner) as first:
+                raise ValueError()
+
+        self.assertTrue(first.closed)
+        self.assertIsNot(first, self.use())
+
+    def test_discards_connections_that_fail_their_health_check(self):
+        first = self.use()
+        first.healthy = False
+
+        self.assertIsNot(first, self.use())
+        self.assertTrue(first.closed)
+
+    def test_discards_connections_that_were_idle_too_long(self):
+        first = self.use()
+
+        with mock.patch("time.time", return_value=time.time() + 301):
+            second = self.use()
+
+        self.assertIsNot(first, second)
+        self.assertTrue(first.closed)
+
+    def test_discards_connections_over_their_lifetime(self):
+        with mock.patch("redash.settings.QUERY_RUNNER_POOL_MAX_LIFETIME", 0):
+            first = self.use()
+
+        self.assertTrue(first.closed)
+
+    def test_keeps_up_to_pool_size_idle_connections(self):
+        with pooled_connection(self.query_runner) as first:
+            with pooled_connection(self.query_runner) as second:
+                with pooled_connection(self.query_runner) as third:
+                    pass
+
+        # The first one was returned to the pool last, when it was full.
+        self.assertEqual(
+            [True, False, False], [c.closed for c in (first, second, third)]
+        )
+
+    def test_opens_a_connection_for_each_block_when_pooling_is_off(self):
+        with mock.patch("redash.settings.QUERY_RUNNER_POOL_SIZE", 0):
+            first = self.use()
+            second = self.use()
+
+        self.assertIsNot(first, second)
+        self.assertTrue(first.closed)
+        self.assertEqual({}, pool_stats())
+
+    def test_reuses_connections_in_reused_connections_blocks(self):
+        with mock.patch("redash.settings.QUERY_RUNNER_POOL_SIZE", 0):
+            with reused_connections():
+                first = self.use()
+                second = self.use()
+
+            self.assertIs(first, second)
+            self.assertTrue(first.closed)
+            self.assertIsNot(first, self.use())
+
+    def test_forked_processes_dont_reuse_connections(self):
+        self.use()
+
+        pid = os.fork()
+        if pid == 0:
+            os._exit(0 if pool_stats() == {} else 1)
+
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(0, os.WEXITSTATUS(status))
+        self.assertEqual(1, len(pool_stats()))
+
@@ -0,0 +1,45 @@
+import asyncio
+from http.server import BaseHTTPRequestHandler
+from unittest import TestCase
+
+from tests import http_server
+from redash.query_runner.url import Url
+
+DATA = '{"columns": [{"name": "a"}], "rows": [{"a": "é"}]}'
+
+
+class DataHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = DATA.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestUrl(TestCase):
+    def test_returns_the_response_as_text(self):
+        # Bytes would be stored as a bytea literal in the results' text column.
+        with http_server(DataHandler) as url:
+            query_runner = Url({"url": url})
+            self.assertEqual((DATA, None), query_runner.run_query("/data", None))
+            self.assertEqual(
+                (DATA, None),
+                asyncio.run(query_runner.run_query_async("/data", None)),
+            )
+
+    def test_rejects_absolute_urls_with_a_base_url(self):
+        query_runner = Url({"url": "http://example.com"})
+        error = "Accepting only relative URLs to 'http://example.com'"
+
+        self.assertEqual(
+            (None, error), query_runner.run_query("http://example.org/data", None)
+        )
+        self.assertEqual(
+            (None, error),
+            asyncio.run(query_runner.run_query_async("http://example.org/data", None)),
+        )
@@ -1,12 +1,25 @@
 import datetime
 import csv
 import io
+import zipfile
+from unittest import TestCase
+
+import mock
+from dateutil.parser import isoparse
 
 from tests import BaseTestCase
 
 from redash import models
-from redash.utils import utcnow, json_dumps
-from redash.serializers import serialize_query_result, serialize_query_result_to_dsv
+from redash.utils import utcnow, json_dumps, json_loads
+from redash.serializers import (
+    serialize_query_result,
+    iter_query_result_dsv,
+    serialize_query_result_to_dsv,
+    serialize_query_result_to_json,
+    serialize_query_result_to_xlsx,
+    iter_query_result_xlsx,
+)
+from redash.serializers.query_result import DatetimeConverter, parse_date
 
 
 data = {
@@ -37,6 +50,30 @@ class QueryResultSerializationTest(BaseTestCase):
         self.assertSetEqual(set(["data", "retrieved_at"]), set(serialized.keys()))
 
 
+class JsonSerializationTest(BaseTestCase):
+    def test_matches_serialize_query_result(self):
+        query_result = self.factory.create_query_result(data=json_dumps(data))
+
+        for is_api_user in [False, True]:
+            expected = json_loads(
+                json_dumps(
+                    {"query_result": serialize_query_result(query_result, is_api_user)}
+                )
+            )
+            serialized = serialize_query_result_to_json(query_result, is_api_user)
+            self.assertEqual(expected, json_loads(serialized))
+
+    def test_doesnt_deserialize_data(self):
+        query_result = self.factory.create_query_result(data=json_dumps(data))
+        models.db.session.expire(query_result)
+
+        with mock.patch("redash.models.json_loads") as json_loads_mock:
+            serialized = serialize_query_result_to_json(query_result, False)
+
+        json_loads_mock.assert_not_called()
+        self.assertEqual(data, json_loads(serialized)["query_result"]["data"])
+
+
 class DsvSerializationTest(BaseTestCase):
     def delimited_content(self, delimiter):
         query_result = self.factory.create_query_result(data=json_dumps(data))
@@ -81,3 +118,152 @@ class DsvSerializationTest(BaseTestCase):
         self.assertEqual(rows[1]["bool"], "false")
         self.assertEqual(rows[2]["date"], "")
         self.assertEqual(rows[3]["datetime"], "459")
+
+    def test_yields_rows_in_batches(self):
+        query_result = self.factory.create_query_result(data=json_dumps(data))
+        with self.app.test_request_context("/"):
+            chunks = list(iter_query_result_dsv(query_result, ",", batch_size=2))
+
+        self.assertEqual(3, len(chunks))
+        self.assertEqual(
+            "".join(chunks), serialize_query_result_to_dsv(query_result, ",")
+        )
+
+    def test_includes_sub_results(self):
+        result = dict(data)
+        result["data_ex"] = [
+            {
+                "name": "ex",
+                "data": {
+                    "columns": [{"name": "x", "type": "integer"}],
+                    "rows": [{"x": 1}, {"y": 2}],
+                },
+            }
+        ]
+        query_result = self.factory.create_query_result(data=json_dumps(result))
+        with self.app.test_request_context("/"):
+            content = serialize_query_result_to_dsv(query_result, ",")
+
+        self.assertTrue(content.endswith('x\r\n1\r\n""\r\n'))
+        # Converting values for the export doesn't modify the (cached) result.
+        self.assertEqual(data["rows"], query_result.data["rows"])
+
+
+class XlsxSerializationTest(BaseTestCase):
+    def sheet_xml(self, data, sheet=1):
+        query_result = self.factory.create_query_result(data=json_dumps(data))
+        content = serialize_query_result_to_xlsx(query_result)
+
+        with zipfile.ZipFile(io.BytesIO(content)) as book:
+            return book.read("xl/worksheets/sheet{}.xml".format(sheet)).decode()
+
+    def test_writes_cells_by_column_type(self):
+        sheet = self.sheet_xml(
+            {
+                "columns": [
+                    {"name": "n", "type": "integer"},
+                    {"name": "s", "type": "string"},
+                    {"name": "b", "type": "boolean"},
+                ],
+                "rows": [{"n": 1, "s": "=1+1", "b": True}, {"n": "x", "s": 2}],
+            }
+        )
+
+        self.assertIn('<c r="A2"><v>1</v></c>', sheet)
+        self.assertIn('<c r="B2" t="inlineStr"><is><t>=1+1</t></is></c>', sheet)
+        self.assertIn('<c r="C2" t="b"><v>1</v></c>', sheet)
+        self.assertIn('<c r="A3" t="inlineStr"><is><t>x</t></is></c>', sheet)
+        self.assertIn('<c r="B3"><v>2</v></c>', sheet)
+        self.assertNotIn('r="C3"', sheet)
+
+    def test_writes_formulas_as_text_and_urls_as_links(self):
+        query_result = self.factory.create_query_result(
+            data=json_dumps(
+                {
+                    "columns": [{"name": "a"}, {"name": "b"}],
+                    "rows": [{"a": "=1+1", "b": "http://example.com"}],
+                }
+            )
+        )
+        content = serialize_query_result_to_xlsx(query_result)
+
+        with zipfile.ZipFile(io.BytesIO(content)) as book:
+            sheet = book.read("xl/worksheets/sheet1.xml").decode()
+            rels = book.read("xl/worksheets/_rels/sheet1.xml.rels").decode()
+
+        self.assertIn('<c r="A2" t="inlineStr"><is><t>=1+1</t></is></c>', sheet)
+        self.assertNotIn("<f>", sheet)
+        self.assertIn('<hyperlink ref="B2" r:id="rId1"/>', sheet)
+        self.assertIn('Id="rId1"', rels)
+        self.assertIn('Target="http://example.com"', rels)
+
+    def test_writes_sub_results_to_their_own_sheet(self):
+        result = dict(data)
+        result["data_ex"] = [
+            {
+                "name": "ex",
+                "data": {"columns": [{"name": "x"}], "rows": [{"x": {"a": 1}}]},
+            }
+        ]
+
+        sheet = self.sheet_xml(result, sheet=2)
+        self.assertIn("<t>{'a': 1}</t>", sheet)
+
+
+    def test_sends_the_export_while_it_is_built(self):
+        written = []
+
+        def rows():
+            for i in range(20000):
+                written.append(i)
+                yield {"x": "{:08}".format(i)}
+
+        query_result = mock.Mock(
+            lazy_data={"columns": [{"name": "x"}], "rows": rows()}
+        )
+        chunks = iter_query_result_xlsx(query_result, chunk_size=1024)
+
+        content = next(chunks)
+        self.assertLess(len(written), 20000)
+
+        content += b"".join(chunks)
+        with zipfile.ZipFile(io.BytesIO(content)) as book:
+            sheet = book.read("xl/worksheets/sheet1.xml").decode()
+            self.assertIn("xl/styles.xml", book.namelist())
+
+        self.assertIn('<c r="A20001" t="inlineStr"><is><t>00019999</t></is></c>', sheet)
+        self.assertTrue(sheet.endswith("</worksheet>"))
+
+
+class ParseDateTest(TestCase):
+    def test_matches_isoparse(self):
+        values = [
+            "2019-05-26",
+            "2019-05-26 12:39",
+            "2019-05-26T12:39:23",
+            "2019-05-26T12:39:23.026Z",
+            "2019-05-26T12:39:23.123456+02:00",
+            "2019-05-26T12:39:23-05:30",
+            "2019-05-26T12:39:23+00:00",
+            "2019-05-26T24:00:00",
+            "20190526",
+        ]
+
+        for value in values:
+            self.assertEqual(isoparse(value), parse_date(value), value)
+
+    def test_raises_on_invalid_dates(self):
+        self.assertRaises(ValueError, parse_date, "2019-02-30")
+
+
+class DatetimeConverterTest(TestCase):
+    def test_converts_each_distinct_value_once(self):
+        converter = DatetimeConverter("%d/%m/%y")
+
+        with mock.patch(
+            "redash.serializers.query_result.parse_date", wraps=parse_date
+        ) as parse:
+            values = [converter(v) for v in ["2019-05-26", "2019-05-26", "", None, 1]]
+
+        self.assertEqual(["26/05/19", "26/05/19", "", None, 1], values)
+        self.assertEqual(2, parse.call_count)
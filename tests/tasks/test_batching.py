@@ -0,0 +1,245 @@
+import signal
+import time
+
+from mock import patch
+from rq.job import JobStatus
+from rq.timeouts import JobTimeoutException, UnixSignalDeathPenalty
+
+from tests import BaseTestCase
+from redash import redis_connection, rq_redis_connection
+from redash.query_runner import InterruptException
+from redash.query_runner.pg import PostgreSQL
+from redash.serializers import serialize_job
+from redash.tasks import Job, Queue
+from redash.tasks.queries.batching import recover_query_batches
+from redash.tasks.queries.execution import TIMEOUT_MESSAGE, enqueue_query
+from redash.tasks.queries.runtimes import record_runtime
+from redash.utils import json_dumps
+
+
+class TestQueryBatching(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        rq_redis_connection.flushdb()
+        self.queue = Queue("queries", connection=rq_redis_connection)
+        patcher = patch.multiple(
+            "redash.settings",
+            QUERY_BATCHING=True,
+            QUERY_BATCH_WINDOW=60,
+            QUERY_BATCH_MAX_SIZE=50,
+            QUERY_BATCH_MAX_RUNTIME=1,
+            QUERY_BATCH_THREADS=1,
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        rq_redis_connection.flushdb()
+        super().tearDown()
+
+    def enqueue(self, query_text, runtime=0.1, data_source=None):
+        data_source = data_source or self.factory.data_source
+        query = self.factory.create_query(
+            query_text=query_text, data_source=data_source
+        )
+        if runtime is not None:
+            record_runtime(data_source.id, query.query_hash, runtime)
+
+        return enqueue_query(
+            query.query_text,
+            data_source,
+            query.user_id,
+            False,
+            None,
+            {"Username": "Arik", "Query ID": query.id},
+        )
+
+    def queued_batches(self):
+        return [
+            job
+            for job in self.queue.jobs
+            if job.func_name.endswith("execute_query_batch")
+        ]
+
+    def close_batch(self):
+        redis_connection.delete(
+            "query_batch:open:{}:queries".format(self.factory.data_source.id)
+        )
+
+    def dequeue_batch(self):
+        batches = self.queued_batches()
+        self.assertEqual(1, len(batches))
+        self.queue.remove(batches[0])
+        return batches[0]
+
+    def run_batch(self):
+        batch = self.dequeue_batch()
+        self.close_batch()
+        data = json_dumps({"columns": [{"name": "a"}], "rows": [{"a": 1}]})
+        with patch.object(PostgreSQL, "run_query", return_value=(data, None)) as qr:
+            batch.perform()
+        return qr
+
+    def test_batches_short_adhoc_queries_of_a_data_source(self):
+        jobs = [self.enqueue("SELECT {}".format(i)) for i in range(3)]
+
+        self.assertEqual(
+            [batch.id for batch in self.queued_batches()], self.queue.job_ids
+        )
+        self.assertEqual(1, len(self.queued_batches()))
+        for job in jobs:
+            job = Job.fetch(job.id, connection=rq_redis_connection)
+            self.assertEqual(JobStatus.QUEUED, job.get_status())
+            self.assertEqual(1, serialize_job(job)["job"]["status"])
+
+    def test_doesnt_batch_queries_that_arent_known_to_be_short(self):
+        slow = self.enqueue("SELECT 1", runtime=5)
+        new = self.enqueue("SELECT 2", runtime=None)
+
+        self.assertEqual([slow.id, new.id], self.queue.job_ids)
+        self.assertEqual([], self.queued_batches())
+
+    def test_runs_the_batch_once_its_window_is_over(self):
+        with patch("redash.settings.QUERY_BATCH_WINDOW", 0.5):
+            self.enqueue("SELECT 1")
+        batch = self.dequeue_batch()
+
+        started = time.monotonic()
+        with patch.object(PostgreSQL, "run_query", return_value=(None, "")) as qr:
+            batch.perform()
+
+        self.assertGreater(time.monotonic() - started, 0.3)
+        qr.assert_called_once()
+
+    def test_opens_a_new_batch_once_one_is_full(self):
+        with patch("redash.settings.QUERY_BATCH_MAX_SIZE", 2):
+            for i in range(3):
+                self.enqueue("SELECT {}".format(i))
+
+        self.assertEqual(2, len(self.queued_batches()))
+
+    def test_runs_full_batches_right_away(self):
+        with patch("redash.settings.QUERY_BATCH_MAX_SIZE", 2):
+            for i in range(2):
+                self.enqueue("SELECT {}".format(i))
+        batch = self.dequeue_batch()
+
+        started = time.monotonic()
+        with patch.object(PostgreSQL, "run_query", return_value=(None, "")) as qr:
+            batch.perform()
+
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertEqual(2, qr.call_count)
+
+    def test_runs_the_batch_and_stores_each_result(self):
+        jobs = [self.enqueue("SELECT {}".format(i)) for i in range(3)]
+
+        qr = self.run_batch()
+
+        self.assertEqual(3, qr.call_count)
+        result_ids = set()
+        for job in jobs:
+            job = Job.fetch(job.id, connection=rq_redis_connection)
+            serialized = serialize_job(job)["job"]
+            self.assertEqual(3, serialized["status"])
+            self.assertIsNotNone(serialized["query_result_id"])
+            result_ids.add(serialized["query_result_id"])
+        self.assertEqual(3, len(result_ids))
+
+    def test_runs_the_batch_in_threads(self):
+        jobs = [self.enqueue("SELECT {}".format(i)) for i in range(4)]
+
+        with patch("redash.settings.QUERY_BATCH_THREADS", 2):
+            qr = self.run_batch()
+
+        self.assertEqual(4, qr.call_count)
+        for job in jobs:
+            job = Job.fetch(job.id, connection=rq_redis_connection)
+            self.assertEqual(JobStatus.FINISHED, job.get_status())
+            self.assertIsInstance(job.result, int)
+
+    def test_skips_cancelled_jobs(self):
+        cancelled, job = [self.enqueue("SELECT {}".format(i)) for i in range(2)]
+        Job.fetch(cancelled.id, connection=rq_redis_connection).cancel()
+
+        qr = self.run_batch()
+
+        self.assertEqual(1, qr.call_count)
+        cancelled = Job.fetch(cancelled.id, connection=rq_redis_connection)
+        self.assertEqual(
+            "Query cancelled by user.", serialize_job(cancelled)["job"]["error"]
+        )
+        self.assertEqual(
+            JobStatus.FINISHED,
+            Job.fetch(job.id, connection=rq_redis_connection).get_status(),
+        )
+
+    def test_enqueues_the_jobs_left_when_the_batch_is_interrupted(self):
+        jobs = [self.enqueue("SELECT {}".format(i)) for i in range(3)]
+        batch = self.dequeue_batch()
+        self.close_batch()
+
+        with patch(
+            "redash.tasks.queries.batching._perform", side_effect=InterruptException
+        ):
+            with self.assertRaises(InterruptException):
+                batch.perform()
+
+        self.assertEqual([job.id for job in jobs[1:]], self.queue.job_ids)
+        self.assertEqual([], redis_connection.keys("query_batch*"))
+
+    def test_recovers_the_jobs_of_failed_batches(self):
+        jobs = [self.enqueue("SELECT {}".format(i)) for i in range(2)]
+        batch = self.dequeue_batch()
+        self.close_batch()
+
+        recover_query_batches()
+        self.assertEqual([], self.queue.job_ids)
+
+        batch.set_status(JobStatus.FAILED)
+        recover_query_batches()
+        self.assertEqual([job.id for job in jobs], self.queue.job_ids)
+        self.assertEqual([], redis_connection.keys("query_batch*"))
+
+        # The batch doesn't run them again.
+        with patch.object(PostgreSQL, "run_query") as qr:
+            batch.perform()
+        qr.assert_not_called()
+
+    def test_doesnt_recover_open_batches(self):
+        self.enqueue("SELECT 1")
+        # Its job is lost while it's open.
+        self.dequeue_batch().delete()
+
+        recover_query_batches()
+
+        self.assertEqual([], self.queue.job_ids)
+
+    def test_limits_the_time_of_each_query(self):
+        def run_query(query, user):
+            if "SELECT 1" in query:
+                # Interruptible in any thread: it runs Python code.
+                started = time.monotonic()
+                while time.monotonic() - started < 10:
+                    time.sleep(0.01)
+            return None, ""
+
+        for threads in (1, 2):
+            with patch("redash.settings.ADHOC_QUERY_TIME_LIMIT", 1):
+                slow, job = [self.enqueue("SELECT {}".format(i)) for i in (1, 2)]
+            batch = self.dequeue_batch()
+            self.close_batch()
+
+            with patch("redash.settings.QUERY_BATCH_THREADS", threads), patch.object(
+                PostgreSQL, "run_query", side_effect=run_query
+            ), UnixSignalDeathPenalty(100, JobTimeoutException):
+                batch.perform()
+                # The batch's own time limit still applies.
+                self.assertGreater(signal.alarm(0), 90)
+
+            slow = Job.fetch(slow.id, connection=rq_redis_connection)
+            self.assertEqual(TIMEOUT_MESSAGE, serialize_job(slow)["job"]["error"])
+            self.assertEqual(
+                JobStatus.FINISHED,
+                Job.fetch(job.id, connection=rq_redis_connection).get_status(),
+            )
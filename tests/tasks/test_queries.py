@@ -1,21 +1,28 @@
 from unittest import TestCase
+import threading
 import uuid
 
 from mock import patch, Mock
 
 from rq import Connection
 from rq.exceptions import NoSuchJobError
+from rq.job import JobStatus
 
 from tests import BaseTestCase
 from redash import redis_connection, rq_redis_connection, models
-from redash.utils import json_dumps
+from redash.utils import JSONEncoder, columnar, json_dumps, json_loads
 from redash.query_runner.pg import PostgreSQL
 from redash.tasks.queries.execution import (
     QueryExecutionError,
+    StreamedResult,
+    enqueue_queries,
     enqueue_query,
     execute_query,
 )
-from redash.tasks import Job
+from redash.tasks import Job, Queue
+from redash.tasks.queries.runtimes import estimate_runtime, record_runtime
+from redash.tasks.queries.slots import DataSourceSlots
+from redash.tasks.worker import Parked
 
 
 def fetch_job(*args, **kwargs):
@@ -68,6 +75,7 @@ class TestEnqueueTask(BaseTestCase):
 
         self.assertEqual(1, enqueue.call_count)
 
+    @patch("redash.tasks.queries.execution.JOB_RESERVATION_TIMEOUT", 0)
     def test_multiple_enqueue_of_expired_job(self, enqueue, fetch_job):
         query = self.factory.create_query()
 
@@ -143,6 +151,162 @@ class TestEnqueueTask(BaseTestCase):
 
         self.assertEqual(3, enqueue.call_count)
 
+    def test_routes_slow_queries_to_slow_lane(self, enqueue, _):
+        data_source = self.factory.create_data_source(
+            options={"dbname": "test", "slow_query_threshold": 60}
+        )
+        query = self.factory.create_query(data_source=data_source)
+        record_runtime(data_source.id, query.query_hash, 600)
+
+        with patch("redash.tasks.queries.execution.Queue") as queue, patch(
+            "redash.tasks.queries.runtimes.listened_queues",
+            return_value={"queries_slow"},
+        ):
+            queue.return_value.enqueue.side_effect = create_job
+            enqueue_query(
+                query.query_text,
+                data_source,
+                query.user_id,
+                False,
+                None,
+                {"Username": "Arik", "Query ID": query.id},
+            )
+
+        queue.assert_called_once_with("queries_slow", connection=rq_redis_connection)
+
+
+class TestEnqueueQueryConcurrency(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.queue = Queue("queries", connection=rq_redis_connection)
+        self.queue.empty()
+
+    def tearDown(self):
+        self.queue.empty()
+        super().tearDown()
+
+    def test_parallel_enqueues_of_same_query_create_one_job(self):
+        query = self.factory.create_query()
+        data_source = query.data_source
+        # Loaded before the threads start, as they don't share the session.
+        data_source.org.get_setting("queue_weight")
+
+        enqueuers = 20
+        barrier = threading.Barrier(enqueuers)
+        job_ids = []
+        errors = []
+
+        def enqueue():
+            barrier.wait()
+            try:
+                job = enqueue_query(
+                    query.query_text,
+                    data_source,
+                    query.user_id,
+                    False,
+                    None,
+                    {"Username": "Arik", "Query ID": query.id},
+                )
+                job_ids.append(job.id)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=enqueue) for _ in range(enqueuers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual([], errors)
+        self.assertEqual(enqueuers, len(job_ids))
+        self.assertEqual(1, len(set(job_ids)))
+        self.assertEqual(list(set(job_ids)), self.queue.job_ids)
+
+    def test_replaces_lock_of_finished_job(self):
+        query = self.factory.create_query()
+        args = (query.query_text, query.data_source, query.user_id, False, None, {})
+
+        finished = enqueue_query(*args)
+        finished.set_status(JobStatus.FINISHED)
+        job = enqueue_query(*args)
+
+        self.assertNotEqual(finished.id, job.id)
+        self.assertEqual([finished.id, job.id], self.queue.job_ids)
+        self.assertEqual(job.id, enqueue_query(*args).id)
+
+
+class TestEnqueueQueries(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.queue = Queue("scheduled_queries", connection=rq_redis_connection)
+        self.queue.empty()
+
+    def tearDown(self):
+        self.queue.empty()
+        super().tearDown()
+
+    def scheduled(self, query):
+        return (query.query_text, query, {"Query ID": query.id})
+
+    def test_enqueues_each_query_once(self):
+        queries = [
+            self.factory.create_query(query_text="SELECT {}".format(i))
+            for i in range(3)
+        ]
+        running = enqueue_query(
+            queries[0].query_text,
+            queries[0].data_source,
+            queries[0].user_id,
+            scheduled_query=queries[0],
+        )
+
+        with patch("redash.tasks.queries.execution.ENQUEUE_BATCH_SIZE", 2):
+            job_ids = enqueue_queries([self.scheduled(q) for q in queries])
+
+        self.assertEqual(running.id, job_ids[0])
+        self.assertEqual(job_ids, self.queue.job_ids)
+
+        job = Job.fetch(job_ids[1], connection=rq_redis_connection)
+        self.assertEqual(
+            (queries[1].query_text, queries[1].data_source.id), job.args[:2]
+        )
+        self.assertEqual(queries[1].id, job.kwargs["scheduled_query_id"])
+        self.assertEqual(queries[1].org_id, job.meta["org_id"])
+
+    def test_replaces_lock_of_finished_job(self):
+        query = self.factory.create_query()
+        finished_id = enqueue_queries([self.scheduled(query)])[0]
+        Job.fetch(finished_id, connection=rq_redis_connection).set_status(
+            JobStatus.FINISHED
+        )
+
+        job_id = enqueue_queries([self.scheduled(query)])[0]
+
+        self.assertNotEqual(finished_id, job_id)
+        self.assertEqual([finished_id, job_id], self.queue.job_ids)
+
+    def test_isolates_failures(self):
+        queries = [
+            self.factory.create_query(query_text="SELECT {}".format(i))
+            for i in range(2)
+        ]
+
+        with patch(
+            "redash.tasks.queries.execution._job_arguments",
+            side_effect=[ValueError("broken"), ({}, {"job_timeout": 60, "meta": {}})],
+        ):
+            results = enqueue_queries([self.scheduled(q) for q in queries])
+
+        self.assertIsInstance(results[0], ValueError)
+        self.assertEqual([results[1]], self.queue.job_ids)
+        self.assertIsNone(
+            redis_connection.get(
+                "query_hash_job:{}:{}".format(
+                    queries[0].data_source_id, queries[0].query_hash
+                )
+            )
+        )
+
 
 @patch("redash.tasks.queries.execution.get_current_job", side_effect=fetch_job)
 class QueryExecutorTests(BaseTestCase):
@@ -157,6 +321,31 @@ class QueryExecutorTests(BaseTestCase):
             self.assertEqual(1, qr.call_count)
             result = models.QueryResult.query.get(result_id)
             self.assertEqual(result.data, query_result_data)
+            self.assertIsNotNone(
+                estimate_runtime(self.factory.data_source.id, result.query_hash)
+            )
+
+    @patch("redash.settings.FEATURE_STREAM_QUERY_RESULTS", True)
+    def test_success_streaming(self, _):
+        """
+        ``execute_query`` stores results of query runners that stream them.
+        """
+        columns = [{"name": "a", "friendly_name": "a", "type": "integer"}]
+
+        def run_query_stream(query, user):
+            yield columns
+            yield [{"a": 1}, {"a": 2}]
+            yield [{"a": 3}]
+
+        with patch.object(PostgreSQL, "run_query_stream") as qr:
+            qr.side_effect = run_query_stream
+            result_id = execute_query("SELECT 1, 2", self.factory.data_source.id, {})
+            self.assertEqual(1, qr.call_count)
+            result = models.QueryResult.query.get(result_id)
+            self.assertEqual(
+                result.data,
+                {"columns": columns, "rows": [{"a": 1}, {"a": 2}, {"a": 3}]},
+            )
 
     def test_success_scheduled(self, _):
         """
@@ -222,3 +411,166 @@ class QueryExecutorTests(BaseTestCase):
             )
             q = models.Query.get_by_id(q.id)
             self.assertEqual(q.schedule_failures, 0)
+
+    def test_parks_query_when_data_source_is_at_its_limit(self, _):
+        """
+        Queries of a data source that runs as many queries as its concurrency
+        limit don't run, and are parked instead.
+        """
+        data_source = self.factory.create_data_source(
+            options={"dbname": "test", "concurrency_limit": 1}
+        )
+        queue = Queue("queries", connection=rq_redis_connection)
+        running, job = [
+            queue.enqueue(execute_query, "SELECT 1", data_source.id, {})
+            for _ in range(2)
+        ]
+        queue.empty()
+        DataSourceSlots(data_source.id, 1).acquire(running)
+
+        with patch(
+            "redash.tasks.queries.execution.get_current_job", return_value=job
+        ), patch.object(PostgreSQL, "run_query") as qr:
+            result = execute_query("SELECT 1", data_source.id, {})
+
+        self.assertIsInstance(result, Parked)
+        qr.assert_not_called()
+        self.assertEqual(
+            [job.id],
+            redis_connection.lrange(
+                "data_source:{}:parked_jobs".format(data_source.id), 0, -1
+            ),
+        )
+
+    def test_fails_results_over_the_data_source_limit(self, _):
+        data_source = self.factory.create_data_source(
+            options={"dbname": "test", "max_result_bytes": 10}
+        )
+        with patch.object(PostgreSQL, "run_query") as qr:
+            qr.return_value = (json_dumps({"columns": [], "rows": []}), None)
+            result = execute_query("SELECT 1", data_source.id, {})
+
+        self.assertIsInstance(result, QueryExecutionError)
+        self.assertEqual(
+            "Query result is too large: it's over 10 bytes.", str(result)
+        )
+
+    @patch("redash.settings.FEATURE_STREAM_QUERY_RESULTS", True)
+    @patch("redash.settings.QUERY_RESULTS_ROW_LIMIT", 2)
+    def test_fails_streamed_results_over_the_limit(self, _):
+        def run_query_stream(query, user):
+            yield [{"name": "a", "friendly_name": "a", "type": "integer"}]
+            yield [{"a": 1}, {"a": 2}]
+            yield [{"a": 3}]
+
+        with patch.object(PostgreSQL, "run_query_stream") as qr:
+            qr.side_effect = run_query_stream
+            result = execute_query("SELECT 1", self.factory.data_source.id, {})
+
+        self.assertIsInstance(result, QueryExecutionError)
+        self.assertEqual("Query result is too large: it has over 2 rows.", str(result))
+
+    def test_releases_data_source_slot(self, _):
+        data_source = self.factory.create_data_source(
+            options={"dbname": "test", "concurrency_limit": 1}
+        )
+        job = create_job()
+        job.timeout = 300
+
+        with patch(
+            "redash.tasks.queries.execution.get_current_job", return_value=job
+        ), patch.object(PostgreSQL, "run_query") as qr:
+            qr.side_effect = ValueError("broken")
+            execute_query("SELECT 1", data_source.id, {})
+
+        self.assertEqual(
+            0, redis_connection.zcard("data_source:{}:slots".format(data_source.id))
+        )
+
+
+class TestStreamedResult(TestCase):
+    columns = [{"name": "a", "friendly_name": "a", "type": "integer"}]
+
+    def stream(self, *batches):
+        yield self.columns
+        for batch in batches:
+            yield batch
+
+    def test_serializes_all_batches(self):
+        result = StreamedResult(JSONEncoder)
+        result.consume(self.stream([{"a": 1}, {"a": 2}], [{"a": 3}]))
+
+        self.assertEqual(
+            json_loads(result.to_json()),
+            {"columns": self.columns, "rows": [{"a": 1}, {"a": 2}, {"a": 3}]},
+        )
+        self.assertFalse(result.truncated)
+
+    def test_serializes_empty_results(self):
+        result = StreamedResult(JSONEncoder)
+        result.consume(self.stream())
+
+        self.assertEqual(
+            json_loads(result.to_json()), {"columns": self.columns, "rows": []}
+        )
+
+    def test_truncates_at_row_limit(self):
+        stream = self.stream([{"a": 1}, {"a": 2}], [{"a": 3}], [{"a": 4}])
+        result = StreamedResult(JSONEncoder, max_rows=3)
+        result.consume(stream)
+
+        data = json_loads(result.to_json())
+        self.assertEqual(data["rows"], [{"a": 1}, {"a": 2}, {"a": 3}])
+        self.assertTrue(data["truncated"])
+        # the stream is closed once the limit is reached
+        with self.assertRaises(StopIteration):
+            next(stream)
+
+    def test_truncates_at_byte_limit(self):
+        result = StreamedResult(JSONEncoder, max_bytes=30)
+        result.consume(self.stream([{"a": 1}, {"a": 2}], [{"a": 3}, {"a": 4}]))
+
+        data = json_loads(result.to_json())
+        self.assertEqual(data["rows"], [{"a": 1}, {"a": 2}, {"a": 3}])
+        self.assertTrue(data["truncated"])
+
+    def test_moves_large_results_to_disk(self):
+        result = StreamedResult(JSONEncoder)
+        with patch("redash.tasks.queries.execution.SPOOL_MAX_SIZE", 10):
+            result.consume(self.stream([{"a": 1}, {"a": 2}], [{"a": "\u00e9\n"}]))
+
+        self.assertTrue(result._files[0]._rolled)
+        self.assertEqual(
+            json_loads(result.to_json()),
+            {"columns": self.columns, "rows": [{"a": 1}, {"a": 2}, {"a": "\u00e9\n"}]},
+        )
+        self.assertTrue(result._files[0].closed)
+
+    def test_encodes_columnar_results_from_the_rows(self):
+        result = StreamedResult(JSONEncoder, columnar=True)
+        with patch("redash.tasks.queries.execution.SPOOL_MAX_SIZE", 10):
+            result.consume(self.stream([{"a": 1}, {"a": 2}], [{"a": "\u00e9"}]))
+
+        with patch("redash.utils.columnar.json_loads") as json_loads_result:
+            data = result.to_columnar("zlib")
+        json_loads_result.assert_not_called()
+
+        self.assertEqual(
+            columnar.decode(data),
+            {"columns": self.columns, "rows": [{"a": 1}, {"a": 2}, {"a": "\u00e9"}]},
+        )
+
+    def test_truncates_columnar_results(self):
+        stream = self.stream([{"a": 1}, {"a": 2}], [{"a": 3}, {"a": 4}])
+        result = StreamedResult(JSONEncoder, max_bytes=9, columnar=True)
+        result.consume(stream)
+
+        self.assertEqual(
+            columnar.decode(result.to_columnar("zlib")),
+            {
+                "columns": self.columns,
+                "rows": [{"a": 1}, {"a": 2}, {"a": 3}],
+                "truncated": True,
+            },
+        )
+
@@ -1,9 +1,28 @@
-from mock import patch, call, ANY
+import datetime
+
+from mock import patch
 from tests import BaseTestCase
+from redash import redis_connection, settings
+from redash.tasks.queries import maintenance
 from redash.tasks.queries.maintenance import refresh_queries
-from redash.models import Query
+from redash.models import Query, scheduled_query_shard
+from redash.utils import json_dumps, utcnow
+
+ENQUEUE_QUERIES = "redash.tasks.queries.maintenance.enqueue_queries"
+
+
+def patch_enqueue(**kwargs):
+    kwargs.setdefault("side_effect", lambda queries: ["job"] * len(queries))
+    return patch(ENQUEUE_QUERIES, **kwargs)
 
-ENQUEUE_QUERY = "redash.tasks.queries.maintenance.enqueue_query"
+
+def enqueued(enqueue):
+    """The (query text, scheduled query) of the queries `enqueue_queries` got."""
+    return [
+        (query_text, query)
+        for args, _ in enqueue.call_args_list
+        for query_text, query, _ in args[0]
+    ]
 
 
 class TestRefreshQuery(BaseTestCase):
@@ -16,30 +35,14 @@ class TestRefreshQuery(BaseTestCase):
         query2 = self.factory.create_query(
             query_text="select 42;", data_source=self.factory.create_data_source()
         )
-        oq = staticmethod(lambda: [query1, query2])
-        with patch(ENQUEUE_QUERY) as add_job_mock, patch.object(
+        oq = staticmethod(lambda *args: [query1, query2])
+        with patch_enqueue() as add_job_mock, patch.object(
             Query, "outdated_queries", oq
         ):
             refresh_queries()
-            self.assertEqual(add_job_mock.call_count, 2)
-            add_job_mock.assert_has_calls(
-                [
-                    call(
-                        query1.query_text,
-                        query1.data_source,
-                        query1.user_id,
-                        scheduled_query=query1,
-                        metadata=ANY,
-                    ),
-                    call(
-                        query2.query_text,
-                        query2.data_source,
-                        query2.user_id,
-                        scheduled_query=query2,
-                        metadata=ANY,
-                    ),
-                ],
-                any_order=True,
+            self.assertEqual(
+                [(query1.query_text, query1), (query2.query_text, query2)],
+                enqueued(add_job_mock),
             )
 
     def test_doesnt_enqueue_outdated_queries_for_paused_data_source(self):
@@ -48,24 +51,18 @@ class TestRefreshQuery(BaseTestCase):
         data source is paused.
         """
         query = self.factory.create_query()
-        oq = staticmethod(lambda: [query])
+        oq = staticmethod(lambda *args: [query])
         query.data_source.pause()
         with patch.object(Query, "outdated_queries", oq):
-            with patch(ENQUEUE_QUERY) as add_job_mock:
+            with patch_enqueue() as add_job_mock:
                 refresh_queries()
-                add_job_mock.assert_not_called()
+                self.assertEqual([], enqueued(add_job_mock))
 
             query.data_source.resume()
 
-            with patch(ENQUEUE_QUERY) as add_job_mock:
+            with patch_enqueue() as add_job_mock:
                 refresh_queries()
-                add_job_mock.assert_called_with(
-                    query.query_text,
-                    query.data_source,
-                    query.user_id,
-                    scheduled_query=query,
-                    metadata=ANY,
-                )
+                self.assertEqual([(query.query_text, query)], enqueued(add_job_mock))
 
     def test_enqueues_parameterized_queries(self):
         """
@@ -85,18 +82,12 @@ class TestRefreshQuery(BaseTestCase):
                 ]
             },
         )
-        oq = staticmethod(lambda: [query])
-        with patch(ENQUEUE_QUERY) as add_job_mock, patch.object(
+        oq = staticmethod(lambda *args: [query])
+        with patch_enqueue() as add_job_mock, patch.object(
             Query, "outdated_queries", oq
         ):
             refresh_queries()
-            add_job_mock.assert_called_with(
-                "select 42",
-                query.data_source,
-                query.user_id,
-                scheduled_query=query,
-                metadata=ANY,
-            )
+            self.assertEqual([("select 42", query)], enqueued(add_job_mock))
 
     def test_doesnt_enqueue_parameterized_queries_with_invalid_parameters(self):
         """
@@ -116,12 +107,12 @@ class TestRefreshQuery(BaseTestCase):
                 ]
             },
         )
-        oq = staticmethod(lambda: [query])
-        with patch(ENQUEUE_QUERY) as add_job_mock, patch.object(
+        oq = staticmethod(lambda *args: [query])
+        with patch_enqueue() as add_job_mock, patch.object(
             Query, "outdated_queries", oq
         ):
             refresh_queries()
-            add_job_mock.assert_not_called()
+            self.assertEqual([], enqueued(add_job_mock))
 
     def test_doesnt_enqueue_parameterized_queries_with_dropdown_queries_that_are_detached_from_data_source(
         self
@@ -146,9 +137,171 @@ class TestRefreshQuery(BaseTestCase):
 
         dropdown_query = self.factory.create_query(id=100, data_source=None)
 
-        oq = staticmethod(lambda: [query])
-        with patch(ENQUEUE_QUERY) as add_job_mock, patch.object(
+        oq = staticmethod(lambda *args: [query])
+        with patch_enqueue() as add_job_mock, patch.object(
             Query, "outdated_queries", oq
         ):
             refresh_queries()
-            add_job_mock.assert_not_called()
+            self.assertEqual([], enqueued(add_job_mock))
+
+
+class TestRefreshQuerySmoothing(BaseTestCase):
+    def create_due_query(self, minutes_ago=10, **kwargs):
+        kwargs.setdefault("query_text", "SELECT {}".format(minutes_ago))
+        """A daily query due `minutes_ago` minutes ago, that ran right after its
+        previous run time."""
+        scheduled_at = utcnow() - datetime.timedelta(minutes=minutes_ago)
+        query = self.factory.create_query(
+            schedule={
+                "interval": "86400",
+                "time": scheduled_at.strftime("%H:%M"),
+                "until": None,
+                "day_of_week": None,
+            },
+            **kwargs
+        )
+        query.latest_query_data = self.factory.create_query_result(
+            query_text=query.query_text,
+            query_hash=query.query_hash,
+            retrieved_at=scheduled_at - datetime.timedelta(hours=23, minutes=59),
+        )
+        return query
+
+    def status(self):
+        return redis_connection.hgetall("redash:status")
+
+    def test_spread_offset_is_fixed_per_query_and_within_window(self):
+        query = self.create_due_query()
+        with patch.object(settings, "SCHEDULED_QUERIES_SPREAD_WINDOW", 600):
+            offset = maintenance._spread_offset(query)
+            self.assertEqual(offset, maintenance._spread_offset(query))
+            self.assertTrue(0 <= offset < 600)
+
+            query.schedule = dict(query.schedule, time=None, interval="3600")
+            self.assertEqual(0, maintenance._spread_offset(query))
+
+    def create_interval_query(self, interval):
+        return self.factory.create_query(
+            schedule={
+                "interval": interval,
+                "time": None,
+                "until": None,
+                "day_of_week": None,
+            }
+        )
+
+    def test_spreads_the_next_runs_of_queries_with_only_an_interval(self):
+        queries = [self.create_interval_query("3600") for _ in range(10)]
+        ran_at = utcnow()
+
+        with patch.object(settings, "SCHEDULED_QUERIES_SPREAD_WINDOW", 600):
+            next_runs = [query.next_run(ran_at) for query in queries]
+
+        self.assertGreater(len(set(next_runs)), 1)
+        due_at = ran_at + datetime.timedelta(hours=1)
+        for next_run in next_runs:
+            self.assertGreater(next_run, due_at - datetime.timedelta(seconds=600))
+            self.assertLessEqual(next_run, due_at + datetime.timedelta(seconds=60))
+
+    def test_spread_queries_keep_their_interval(self):
+        query = self.create_interval_query("3600")
+        # Each run is enqueued by the first refresh after it's due, and waits in
+        # its queue before it starts.
+        tick = datetime.timedelta(seconds=30)
+        queued_for = datetime.timedelta(seconds=25)
+
+        ran_at = [utcnow()]
+        now = ran_at[0]
+        with patch.object(settings, "SCHEDULED_QUERIES_SPREAD_WINDOW", 3600):
+            while len(ran_at) < 8:
+                now += tick
+                if now > query.next_run(ran_at[-1]):
+                    ran_at.append(now + queued_for)
+
+        for previous, run in zip(ran_at[1:], ran_at[2:]):
+            self.assertAlmostEqual(
+                3600, (run - previous).total_seconds(), delta=tick.total_seconds()
+            )
+
+    def test_holds_back_queries_within_their_spread_offset(self):
+        query = self.create_due_query(minutes_ago=10)
+
+        with patch.object(
+            settings, "SCHEDULED_QUERIES_SPREAD_WINDOW", 3600
+        ), patch_enqueue() as enqueue, patch.object(
+            maintenance, "_spread_offset", return_value=1200
+        ):
+            refresh_queries()
+            self.assertEqual([], enqueued(enqueue))
+            self.assertEqual("1", self.status()["spread_queries_count"])
+
+        with patch.object(
+            settings, "SCHEDULED_QUERIES_SPREAD_WINDOW", 3600
+        ), patch_enqueue() as enqueue, patch.object(
+            maintenance, "_spread_offset", return_value=300
+        ):
+            refresh_queries()
+            self.assertEqual([(query.query_text, query)], enqueued(enqueue))
+            self.assertEqual("0", self.status()["spread_queries_count"])
+
+    def test_carries_over_queries_over_the_data_source_budget(self):
+        data_source = self.factory.create_data_source()
+        oldest = self.create_due_query(minutes_ago=30, data_source=data_source)
+        newest = self.create_due_query(minutes_ago=10, data_source=data_source)
+        other = self.create_due_query(minutes_ago=20, data_source=data_source)
+        elsewhere = self.create_due_query(minutes_ago=5)
+
+        with patch.object(
+            settings, "SCHEDULED_QUERIES_MAX_PER_DATA_SOURCE", 2
+        ), patch_enqueue() as enqueue:
+            refresh_queries()
+
+        self.assertEqual(
+            [oldest, other, elsewhere], [query for _, query in enqueued(enqueue)]
+        )
+        self.assertEqual("1", self.status()["carried_over_queries_count"])
+        self.assertEqual("3", self.status()["outdated_queries_count"])
+        self.assertIn(newest, Query.outdated_queries())
+
+    def test_reports_queries_that_failed_to_enqueue(self):
+        query = self.create_due_query(minutes_ago=10)
+        failed = self.create_due_query(minutes_ago=20)
+
+        def enqueue_queries(queries):
+            return [ValueError() if q == failed else "job" for _, q, _ in queries]
+
+        with patch_enqueue(side_effect=enqueue_queries), patch(
+            "redash.tasks.queries.maintenance.sentry"
+        ) as sentry:
+            refresh_queries()
+
+        sentry.capture_message.assert_called_once()
+        self.assertIn(str(failed.id), sentry.capture_message.call_args[0][0])
+        self.assertEqual(json_dumps([query.id]), self.status()["query_ids"])
+
+
+class TestRefreshQueryShards(BaseTestCase):
+    create_due_query = TestRefreshQuerySmoothing.create_due_query
+    status = TestRefreshQuerySmoothing.status
+
+    def test_shards_split_queries(self):
+        queries = [self.create_due_query(minutes_ago=i) for i in range(1, 9)]
+
+        enqueued_by_shard = []
+        for shard in range(3):
+            with patch_enqueue() as enqueue:
+                refresh_queries(shard, 3)
+            enqueued_by_shard.append([query for _, query in enqueued(enqueue)])
+
+        for shard, shard_queries in enumerate(enqueued_by_shard):
+            self.assertTrue(
+                all(
+                    scheduled_query_shard(query.id, 3) == shard
+                    for query in shard_queries
+                )
+            )
+        self.assertEqual(
+            sorted(q.id for q in queries),
+            sorted(q.id for shard_queries in enqueued_by_shard for q in shard_queries),
+        )
+        self.assertEqual(str(len(queries)), self.status()["outdated_queries_count"])
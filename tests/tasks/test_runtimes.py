@@ -0,0 +1,95 @@
+from mock import patch
+from rq import Worker
+
+from tests import BaseTestCase
+from redash import rq_redis_connection
+from redash.tasks.queries import runtimes
+from redash.tasks.queries.runtimes import (
+    estimate_runtime,
+    record_runtime,
+    route_query,
+    track_runtime,
+)
+
+
+class TestRuntimeEstimates(BaseTestCase):
+    def test_first_runtime_is_the_estimate(self):
+        self.assertIsNone(record_runtime(1, "hash", 10))
+        self.assertEqual(10, estimate_runtime(1, "hash"))
+
+    @patch("redash.settings.QUERY_RUNTIME_EWMA_ALPHA", 0.5)
+    def test_estimate_is_a_moving_average(self):
+        record_runtime(1, "hash", 10)
+
+        self.assertEqual(10, record_runtime(1, "hash", 20))
+        self.assertEqual(15, estimate_runtime(1, "hash"))
+        self.assertIsNone(estimate_runtime(2, "hash"))
+
+
+class TestRouteQuery(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.data_source = self.factory.create_data_source(
+            options={
+                "dbname": "test",
+                "fast_query_threshold": 5,
+                "slow_query_threshold": 60,
+            }
+        )
+        self.listen("queries_fast", "queries", "queries_slow")
+
+    def listen(self, *queue_names):
+        worker = Worker(queue_names, connection=rq_redis_connection)
+        worker.register_birth()
+        self.addCleanup(worker.register_death)
+        runtimes._listened_queues.clear()
+
+    def test_routes_queries_by_estimated_runtime(self):
+        record_runtime(self.data_source.id, "fast", 1)
+        record_runtime(self.data_source.id, "regular", 30)
+        record_runtime(self.data_source.id, "slow", 600)
+
+        self.assertEqual(
+            ["queries_fast", "queries", "queries_slow", "queries"],
+            [
+                route_query(self.data_source, query_hash, "queries")
+                for query_hash in ["fast", "regular", "slow", "unknown"]
+            ],
+        )
+
+    def test_routes_only_to_lanes_workers_listen_to(self):
+        record_runtime(self.data_source.id, "fast", 1)
+        record_runtime(self.data_source.id, "slow", 600)
+
+        self.assertEqual(
+            ["http_queries", "http_queries"],
+            [
+                route_query(self.data_source, query_hash, "http_queries")
+                for query_hash in ["fast", "slow"]
+            ],
+        )
+
+        self.listen("http_queries_slow")
+        self.assertEqual(
+            "http_queries_slow", route_query(self.data_source, "slow", "http_queries")
+        )
+
+    def test_doesnt_route_without_thresholds(self):
+        data_source = self.factory.create_data_source()
+        record_runtime(data_source.id, "slow", 600)
+
+        self.assertEqual("queries", route_query(data_source, "slow", "queries"))
+
+    @patch("redash.tasks.queries.runtimes.statsd_client")
+    def test_tracks_routing_accuracy(self, statsd):
+        track_runtime(self.data_source, "hash", 1)
+        statsd.incr.assert_not_called()
+
+        track_runtime(self.data_source, "hash", 2)
+        statsd.incr.assert_called_once_with("query_execution.routing.hit")
+        statsd.timing.assert_called_once_with(
+            "query_execution.runtime_estimate_error", 1000
+        )
+
+        track_runtime(self.data_source, "hash", 600)
+        statsd.incr.assert_called_with("query_execution.routing.miss")
@@ -1,7 +1,22 @@
+import time
+from datetime import datetime, timedelta
 from unittest import TestCase
 from mock import patch, ANY
 
-from redash.tasks.schedule import rq_scheduler, schedule_periodic_jobs
+from redash import rq_redis_connection, settings
+from redash.tasks import Queue
+from redash.tasks.queries.maintenance import refresh_queries
+from redash.tasks.schedule import (
+    LeaseScheduler,
+    job_id,
+    periodic_job_definitions,
+    rq_scheduler,
+    schedule_periodic_jobs,
+)
+
+
+def noop():
+    pass
 
 
 class TestSchedule(TestCase):
@@ -62,3 +77,158 @@ class TestSchedule(TestCase):
         self.assertTrue(jobs[0].func_name.endswith("foo"))
         self.assertEqual(jobs[0].meta["interval"], 60)
 
+    def test_keeps_jobs_scheduled_to_run_once(self):
+        rq_scheduler.enqueue_in(timedelta(seconds=60), noop)
+
+        schedule_periodic_jobs([])
+
+        self.assertEqual(1, len(list(rq_scheduler.get_jobs())))
+
+    def test_schedules_refresh_queries_in_shards(self):
+        with patch.object(settings, "SCHEDULED_QUERIES_SHARDS", 3):
+            jobs = [
+                job
+                for job in periodic_job_definitions()
+                if job["func"] is refresh_queries
+            ]
+
+        self.assertEqual(
+            [{"shard": shard, "shards": 3} for shard in range(3)],
+            [job["kwargs"] for job in jobs],
+        )
+        self.assertEqual(3, len(set(job_id(job) for job in jobs)))
+
+
+class TestLeaseScheduler(TestCase):
+    """
+    Runs several schedulers against the same Redis, stepping through their loop
+    (`heartbeat` then `enqueue_jobs`) by hand.
+    """
+
+    def setUp(self):
+        for job in rq_scheduler.get_jobs():
+            rq_scheduler.cancel(job)
+            job.delete()
+        rq_redis_connection.delete(
+            LeaseScheduler.leader_key, LeaseScheduler.instances_key
+        )
+        self.queue = Queue("periodic", connection=rq_redis_connection)
+        self.queue.empty()
+
+    def tearDown(self):
+        self.setUp()
+
+    def scheduler(self, lease_timeout=5):
+        scheduler = LeaseScheduler(
+            connection=rq_redis_connection,
+            queue_name="periodic",
+            interval=1,
+            lease_timeout=lease_timeout,
+        )
+        scheduler.register_birth()
+        return scheduler
+
+    def schedule(self, seconds_ago=1, **kwargs):
+        return rq_scheduler.schedule(
+            scheduled_time=datetime.utcnow() - timedelta(seconds=seconds_ago),
+            func=noop,
+            interval=60,
+            **kwargs
+        )
+
+    def test_one_scheduler_leads(self):
+        leader, follower = self.scheduler(), self.scheduler()
+        leader.heartbeat()
+        follower.heartbeat()
+
+        self.assertTrue(leader.is_leader)
+        self.assertFalse(follower.is_leader)
+        self.assertEqual(
+            sorted([leader.instance_id, follower.instance_id]), follower.instances
+        )
+
+    def test_leader_enqueues_periodic_jobs_once_per_run(self):
+        leader, follower = self.scheduler(), self.scheduler()
+        leader.heartbeat()
+        follower.heartbeat()
+        job = self.schedule()
+
+        self.assertEqual([], follower.enqueue_jobs())
+        self.assertEqual([job.id], [j.id for j in leader.enqueue_jobs()])
+        self.assertEqual([], leader.enqueue_jobs())
+        self.assertEqual([job.id], self.queue.job_ids)
+
+    def test_splits_shards_between_schedulers(self):
+        schedulers = [self.scheduler() for _ in range(3)]
+        for _ in range(2):
+            for scheduler in schedulers:
+                scheduler.heartbeat()
+        jobs = [self.schedule(meta={"shard": shard}) for shard in range(12)]
+
+        enqueued = [
+            [job.id for job in scheduler.enqueue_jobs()] for scheduler in schedulers
+        ]
+
+        for scheduler, job_ids in zip(schedulers, enqueued):
+            self.assertEqual(
+                sorted(
+                    job.id
+                    for job in jobs
+                    if scheduler.shard_owner(job.meta["shard"])
+                    == scheduler.instance_id
+                ),
+                sorted(job_ids),
+            )
+        self.assertEqual(
+            sorted(job.id for job in jobs), sorted(self.queue.job_ids)
+        )
+
+    def test_takes_over_when_leader_dies_mid_run(self):
+        leader, follower = self.scheduler(lease_timeout=1), self.scheduler()
+        leader.heartbeat()
+        follower.heartbeat()
+        claimed = self.schedule(seconds_ago=2)
+        pending = self.schedule(seconds_ago=1)
+
+        # The leader is killed right after claiming its first job.
+        with patch.object(leader, "get_queue_for_job", side_effect=SystemExit):
+            with self.assertRaises(SystemExit):
+                leader.enqueue_jobs()
+
+        follower.heartbeat()
+        self.assertFalse(follower.is_leader)
+
+        time.sleep(1.1)
+        follower.heartbeat()
+
+        self.assertTrue(follower.is_leader)
+        self.assertEqual([follower.instance_id], follower.instances)
+        # The run of the job the leader claimed is skipped, not enqueued twice.
+        self.assertEqual([pending.id], [j.id for j in follower.enqueue_jobs()])
+        self.assertEqual([pending.id], self.queue.job_ids)
+        self.assertEqual(
+            [claimed.id, pending.id],
+            [job.id for job in rq_scheduler.get_jobs()],
+        )
+
+    def test_stale_leader_doesnt_enqueue(self):
+        stale, follower = self.scheduler(lease_timeout=1), self.scheduler()
+        stale.heartbeat()
+        job = self.schedule()
+
+        time.sleep(1.1)
+        follower.heartbeat()
+
+        self.assertTrue(stale.is_leader)
+        self.assertEqual([], stale.enqueue_jobs())
+        self.assertEqual([job.id], [j.id for j in follower.enqueue_jobs()])
+        self.assertEqual([job.id], self.queue.job_ids)
+
+    def test_register_death_releases_leadership(self):
+        leader, follower = self.scheduler(), self.scheduler()
+        leader.heartbeat()
+        leader.register_death()
+        follower.heartbeat()
+
+        self.assertTrue(follower.is_leader)
+        self.assertEqual([follower.instance_id], follower.instances)
@@ -0,0 +1,108 @@
+import time
+
+from mock import patch
+from rq.job import JobStatus
+from rq.registry import StartedJobRegistry
+
+from tests import BaseTestCase
+from redash import redis_connection, rq_redis_connection
+from redash.tasks import Queue, Worker
+from redash.tasks.queries.maintenance import wake_parked_queries
+from redash.tasks.queries.slots import DataSourceSlots
+from redash.tasks.worker import Parked
+
+
+def noop():
+    pass
+
+
+class TestDataSourceSlots(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.queue = Queue("queries", connection=rq_redis_connection)
+        self.queue.empty()
+
+    def create_job(self):
+        job = self.queue.enqueue(noop, job_timeout=300)
+        # Jobs are dequeued when they run.
+        self.queue.remove(job)
+        return job
+
+    def parked_job_ids(self, data_source_id=1):
+        return redis_connection.lrange(
+            "data_source:{}:parked_jobs".format(data_source_id), 0, -1
+        )
+
+    def test_doesnt_limit_data_sources_without_a_limit(self):
+        slots = DataSourceSlots(1, 0)
+        jobs = [self.create_job() for _ in range(3)]
+
+        self.assertTrue(all(slots.acquire(job) for job in jobs))
+        self.assertEqual([], self.parked_job_ids())
+
+    def test_parks_jobs_over_the_limit(self):
+        slots = DataSourceSlots(1, 2)
+        first, second, third = [self.create_job() for _ in range(3)]
+
+        self.assertTrue(slots.acquire(first))
+        self.assertTrue(slots.acquire(second))
+        self.assertFalse(slots.acquire(third))
+
+        self.assertEqual([third.id], self.parked_job_ids())
+        self.assertIn("parked_at", third.meta)
+
+    def test_release_enqueues_parked_job_at_the_front_of_its_queue(self):
+        slots = DataSourceSlots(1, 1)
+        running, parked = self.create_job(), self.create_job()
+        other = self.queue.enqueue(noop)
+
+        slots.acquire(running)
+        slots.acquire(parked)
+        slots.release(running)
+
+        self.assertEqual([], self.parked_job_ids())
+        self.assertEqual([parked.id, other.id], self.queue.job_ids)
+
+        with patch("redash.tasks.queries.slots.statsd_client") as statsd:
+            self.assertTrue(slots.acquire(parked))
+        statsd.timing.assert_called_once()
+        self.assertNotIn("parked_at", parked.meta)
+
+    def test_expired_leases_free_their_slot(self):
+        slots = DataSourceSlots(1, 1)
+        crashed, job = self.create_job(), self.create_job()
+
+        with patch("time.time", return_value=time.time() - 3600):
+            slots.acquire(crashed)
+
+        self.assertTrue(slots.acquire(job))
+
+    def test_wake_parked_queries_enqueues_jobs_of_free_slots(self):
+        data_source = self.factory.create_data_source(
+            options={"dbname": "test", "concurrency_limit": 1}
+        )
+        slots = DataSourceSlots(data_source.id, 1)
+        crashed, parked = self.create_job(), self.create_job()
+
+        with patch("time.time", return_value=time.time() - 3600):
+            slots.acquire(crashed)
+            slots.acquire(parked)
+
+        wake_parked_queries()
+
+        self.assertEqual([], self.parked_job_ids(data_source.id))
+        self.assertEqual([parked.id], self.queue.job_ids)
+        self.assertEqual(set(), redis_connection.smembers("data_sources:parked_jobs"))
+
+    def test_worker_doesnt_finish_parked_jobs(self):
+        job = self.create_job()
+        registry = StartedJobRegistry(job.origin, rq_redis_connection)
+        registry.add(job, 300)
+        job._result = Parked()
+        job.set_status(JobStatus.QUEUED)
+
+        worker = Worker([self.queue], connection=rq_redis_connection)
+        worker.handle_job_success(job, self.queue, registry)
+
+        self.assertEqual(JobStatus.QUEUED, job.get_status())
+        self.assertNotIn(job.id, registry.get_job_ids())
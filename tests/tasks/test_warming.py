@@ -0,0 +1,103 @@
+import datetime
+
+from mock import patch
+
+from tests import BaseTestCase
+from redash import models
+from redash.tasks.queries.warming import warm_caches
+from redash.utils import gen_query_hash, utcnow
+
+
+class TestWarmCaches(BaseTestCase):
+    def setUp(self):
+        super(TestWarmCaches, self).setUp()
+        self.query = self.factory.create_query(
+            query_text="SELECT {{param}}",
+            options={
+                "parameters": [{"name": "param", "type": "text", "value": "default"}]
+            },
+        )
+        self.dashboard = self.factory.create_dashboard()
+        self.factory.create_widget(
+            dashboard=self.dashboard,
+            visualization=self.factory.create_visualization(query_rel=self.query),
+        )
+
+    def record(self, days_ago, action, object_type, object_id=None, **properties):
+        # 40 minutes from now is in the window warmed next (30-45 minutes ahead).
+        created_at = utcnow() + datetime.timedelta(days=-days_ago, minutes=40)
+        models.db.session.add(
+            models.Event(
+                org=self.factory.org,
+                action=action,
+                object_type=object_type,
+                object_id=object_id,
+                additional_properties=properties,
+                created_at=created_at,
+            )
+        )
+
+    def view(self, days, dashboard=None):
+        for days_ago in days:
+            self.record(
+                days_ago, "view", "dashboard", str((dashboard or self.dashboard).id)
+            )
+
+    def execute(self, days, **parameters):
+        for days_ago in days:
+            self.record(
+                days_ago,
+                "execute_query",
+                "data_source",
+                str(self.query.data_source_id),
+                query_id=self.query.id,
+                parameters=parameters,
+            )
+
+    def warmed(self):
+        with patch("redash.tasks.queries.warming.enqueue_query") as enqueue:
+            warm_caches()
+        return [call[0][0] for call in enqueue.call_args_list]
+
+    def test_warms_queries_of_dashboards_viewed_at_this_time_of_day(self):
+        self.view(days=[1, 2, 3])
+
+        self.assertEqual(["SELECT default"], self.warmed())
+
+    def test_skips_dashboards_viewed_on_few_days(self):
+        self.view(days=[1, 1, 1, 2])
+
+        self.assertEqual([], self.warmed())
+
+    def test_skips_dashboards_viewed_at_other_times(self):
+        for days_ago in [1, 2, 3]:
+            self.record(days_ago - 0.25, "view", "dashboard", str(self.dashboard.id))
+
+        self.assertEqual([], self.warmed())
+
+    def test_warms_parameters_the_dashboard_is_viewed_with(self):
+        self.view(days=[1, 2, 3])
+        self.execute(days=[1, 2, 3], param="usual")
+        self.execute(days=[1], param="once")
+
+        self.assertEqual(["SELECT usual", "SELECT default"], self.warmed())
+
+    def test_skips_queries_with_fresh_results(self):
+        self.view(days=[1, 2, 3])
+        self.factory.create_query_result(
+            query_text="SELECT default",
+            query_hash=gen_query_hash("SELECT default"),
+            retrieved_at=utcnow(),
+        )
+
+        self.assertEqual([], self.warmed())
+
+    def test_stays_within_the_budget_of_each_data_source(self):
+        self.view(days=[1, 2, 3])
+        self.execute(days=[1, 2, 3], param="usual")
+        other = self.factory.create_dashboard()
+        self.factory.create_widget(dashboard=other)
+        self.view(days=[1, 2, 3], dashboard=other)
+
+        with patch("redash.settings.CACHE_WARMING_MAX_PER_DATA_SOURCE", 2):
+            self.assertEqual(["SELECT usual", "SELECT default"], self.warmed())
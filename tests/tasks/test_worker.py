@@ -0,0 +1,630 @@
+import os
+import signal
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+from unittest import TestCase
+
+from mock import patch
+from rq import Connection
+from rq.job import Job as BaseJob, JobStatus
+
+from tests import BaseTestCase, http_server
+from redash import models, rq_redis_connection
+from redash.monitor import get_queues_status
+from redash.query_runner import TYPE_INTEGER
+from redash.tasks.queries.execution import (
+    TIMEOUT_MESSAGE,
+    QueryExecutionError,
+    QueryExecutor,
+    execute_query,
+)
+from redash.tasks.worker import (
+    AsyncWorker,
+    CancellableQueue,
+    FairQueue,
+    HardLimitingWorker,
+    Job,
+    PreforkWorker,
+)
+from redash.utils import json_dumps
+
+
+def noop():
+    pass
+
+
+def getpid():
+    return os.getpid()
+
+
+def fail():
+    raise ValueError("failed")
+
+
+def hang():
+    # Stuck in a way the job's own (soft) time limit can't interrupt.
+    signal.signal(signal.SIGALRM, signal.SIG_IGN)
+    time.sleep(30)
+
+
+def interruptible_hang():
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    time.sleep(30)
+
+
+def use_memory(megabytes, ignore_limit=False):
+    if ignore_limit:
+        signal.signal(signal.SIGUSR1, signal.SIG_IGN)
+    memory = b"x" * (megabytes * 1024 * 1024)
+    time.sleep(30)
+    return len(memory)
+
+
+def get_thread_ident():
+    return threading.get_ident()
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+class FairQueueTestCase(TestCase):
+    def setUp(self):
+        rq_redis_connection.flushdb()
+        self.queue = FairQueue("queries", connection=rq_redis_connection)
+        patcher = patch("redash.settings.QUEUE_FAIR_SHARE", True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        rq_redis_connection.flushdb()
+
+    def enqueue(self, org_id, user_id=1, queue=None, **meta):
+        job = Job.create(
+            noop,
+            connection=rq_redis_connection,
+            meta=dict(meta, org_id=org_id, user_id=user_id),
+        )
+        return (queue or self.queue).enqueue_job(job)
+
+    def dequeue(self, queue=None):
+        queue = queue or self.queue
+        result = queue.dequeue_any([queue], None, connection=rq_redis_connection)
+        return result and result[0]
+
+    def tenants(self, count):
+        return [
+            (job.meta["org_id"], job.meta["user_id"])
+            for job in [self.dequeue() for _ in range(count)]
+        ]
+
+
+class TestFairQueue(FairQueueTestCase):
+    def test_organizations_take_turns(self):
+        for _ in range(3):
+            self.enqueue(org_id=1)
+        self.enqueue(org_id=2)
+        self.enqueue(org_id=3)
+
+        self.assertEqual(
+            [(1, 1), (2, 1), (3, 1), (1, 1), (1, 1)], self.tenants(5)
+        )
+        self.assertIsNone(self.dequeue())
+
+    def test_users_take_turns_within_their_organization(self):
+        for _ in range(2):
+            self.enqueue(org_id=1, user_id=1)
+        self.enqueue(org_id=1, user_id=2)
+
+        self.assertEqual([(1, 1), (1, 2), (1, 1)], self.tenants(3))
+
+    def test_organizations_get_turns_by_weight(self):
+        for _ in range(6):
+            self.enqueue(org_id=1, queue_weight=2)
+            self.enqueue(org_id=2)
+
+        self.assertEqual(
+            [1, 2, 1, 1, 2, 1], [org_id for org_id, _ in self.tenants(6)]
+        )
+
+    def test_keeps_jobs_on_the_rq_queue(self):
+        jobs = [self.enqueue(org_id=1), self.enqueue(org_id=2)]
+
+        self.assertEqual([job.id for job in jobs], self.queue.job_ids)
+        self.dequeue()
+        self.assertEqual(1, self.queue.count)
+
+    def test_skips_jobs_removed_from_the_queue(self):
+        removed = self.enqueue(org_id=1)
+        job = self.enqueue(org_id=1)
+        self.queue.remove(removed)
+
+        self.assertEqual(job.id, self.dequeue().id)
+        self.assertIsNone(self.dequeue())
+
+    def test_skips_cancelled_jobs(self):
+        cancelled = self.enqueue(org_id=1)
+        job = self.enqueue(org_id=1)
+        cancelled.cancel()
+
+        self.assertEqual(job.id, self.dequeue().id)
+        self.assertIsNone(self.dequeue())
+
+    def test_removes_jobs_popped_out_of_order_once_they_reach_the_head(self):
+        first, second = self.enqueue(org_id=1), self.enqueue(org_id=1)
+        other = self.enqueue(org_id=2)
+
+        self.assertEqual([first.id, other.id], [self.dequeue().id for _ in range(2)])
+        self.assertEqual([second.id], self.queue.job_ids)
+        self.assertEqual(1, self.queue.count)
+        self.assertEqual(second.id, self.dequeue().id)
+        self.assertEqual(0, rq_redis_connection.llen(self.queue.key))
+        self.assertEqual(0, self.queue.count)
+
+    def test_runs_jobs_enqueued_again_once(self):
+        self.enqueue(org_id=1)
+        job = self.enqueue(org_id=1)
+        other = self.enqueue(org_id=2)
+        self.dequeue()
+        self.dequeue()
+        self.queue.enqueue_job(other)
+
+        self.assertEqual([job.id, other.id], self.queue.job_ids)
+        self.assertEqual(
+            {job.id, other.id}, {self.dequeue().id, self.dequeue().id}
+        )
+        self.assertIsNone(self.dequeue())
+
+    def test_skips_jobs_deleted_without_leaving_their_tenant(self):
+        deleted = self.enqueue(org_id=1)
+        job = self.enqueue(org_id=1)
+        BaseJob.fetch(deleted.id, connection=rq_redis_connection).delete()
+
+        self.assertEqual(job.id, self.dequeue().id)
+        self.assertIsNone(self.dequeue())
+        self.assertEqual(0, self.queue.count)
+
+    def test_empty_keeps_the_jobs_that_were_popped(self):
+        first, second = self.enqueue(org_id=1), self.enqueue(org_id=1)
+        other = self.enqueue(org_id=2)
+        self.dequeue()
+        self.dequeue()
+
+        self.assertEqual(1, self.queue.empty())
+        self.assertEqual(0, self.queue.count)
+        self.assertIsNone(Job.fetch_many([second.id], rq_redis_connection)[0])
+        for job in (first, other):
+            self.assertIsNotNone(Job.fetch(job.id, connection=rq_redis_connection))
+        self.assertEqual(
+            [], rq_redis_connection.keys(FairQueue.fair_namespace_prefix + "*:org*")
+        )
+        self.assertIsNone(self.dequeue())
+
+    def test_is_fifo_without_fair_share(self):
+        with patch("redash.settings.QUEUE_FAIR_SHARE", False):
+            jobs = [self.enqueue(org_id=org_id) for org_id in (1, 1, 2)]
+
+        self.assertEqual([job.id for job in jobs], [self.dequeue().id for _ in jobs])
+        self.assertEqual(
+            [], rq_redis_connection.keys(FairQueue.fair_namespace_prefix + "*")
+        )
+
+    def test_queue_sizes_dont_count_popped_jobs(self):
+        self.enqueue(org_id=1)
+        self.enqueue(org_id=1)
+        self.enqueue(org_id=2)
+        self.dequeue()
+        self.dequeue()
+
+        with Connection(rq_redis_connection):
+            self.assertEqual({"queries": {"size": 1}}, get_queues_status())
+
+    def test_pops_jobs_without_tenant_after_others(self):
+        untracked = self.queue.enqueue(noop)
+        job = self.enqueue(org_id=1)
+
+        self.assertEqual(job.id, self.dequeue().id)
+        self.assertEqual(untracked.id, self.dequeue().id)
+
+    def test_blocking_dequeue_removes_job_from_its_tenant(self):
+        self.enqueue(org_id=1)
+        job = self.enqueue(org_id=1)
+        self.dequeue()
+
+        result = FairQueue.dequeue_any(
+            [self.queue], 1, connection=rq_redis_connection
+        )
+
+        self.assertEqual(job.id, result[0].id)
+        self.assertEqual(
+            [], rq_redis_connection.keys(FairQueue.fair_namespace_prefix + "*:org:*")
+        )
+
+
+class TestFairQueueLoad(FairQueueTestCase):
+    """
+    Simulates 4 workers running one job per tick, while one user of organization 1
+    enqueues 400 jobs at once and 5 other organizations enqueue a job every other
+    tick, and compares the wait (in ticks) of each organization's jobs with
+    the FIFO queue.
+    """
+
+    WORKERS = 4
+
+    def simulate(self, queue):
+        enqueued_at = {}
+        waits = {}
+        last_tick = 0
+
+        for _ in range(400):
+            job = self.enqueue(org_id=1, queue=queue)
+            enqueued_at[job.id] = 0
+
+        for tick in range(200):
+            if tick % 2 == 0 and tick < 100:
+                for org_id in range(2, 7):
+                    job = self.enqueue(org_id=org_id, queue=queue)
+                    enqueued_at[job.id] = tick
+
+            for _ in range(self.WORKERS):
+                job = self.dequeue(queue)
+                if job is None:
+                    break
+                waits.setdefault(job.meta["org_id"], []).append(
+                    tick - enqueued_at[job.id]
+                )
+                last_tick = tick
+
+        waits = {
+            org_id: (percentile(w, 0.5), percentile(w, 0.95), max(w))
+            for org_id, w in waits.items()
+        }
+        return waits, last_tick
+
+    def test_other_organizations_dont_wait_behind_a_busy_user(self):
+        fifo, fifo_last_tick = self.simulate(
+            CancellableQueue("fifo", connection=rq_redis_connection)
+        )
+        fair, fair_last_tick = self.simulate(self.queue)
+
+        report = "\n".join(
+            "org {}: p50/p95/max wait FIFO {} fair {}".format(
+                org_id, fifo[org_id], fair[org_id]
+            )
+            for org_id in sorted(fair)
+        )
+
+        for org_id in range(2, 7):
+            self.assertGreater(fifo[org_id][1], 50, report)
+            self.assertLessEqual(fair[org_id][1], 2, report)
+
+        # The busy organization gets the workers the others don't need, so all the
+        # jobs are done as soon as with the FIFO queue.
+        self.assertEqual(fifo_last_tick, fair_last_tick, report)
+
+
+class TestPreforkWorker(TestCase):
+    def setUp(self):
+        rq_redis_connection.flushdb()
+        self.queue = FairQueue("prefork", connection=rq_redis_connection)
+        self.signal_handlers = {
+            signum: signal.getsignal(signum)
+            for signum in (signal.SIGINT, signal.SIGTERM)
+        }
+
+    def tearDown(self):
+        for signum, handler in self.signal_handlers.items():
+            signal.signal(signum, handler)
+        rq_redis_connection.flushdb()
+
+    def work(self, **kwargs):
+        worker = PreforkWorker(
+            [self.queue],
+            connection=rq_redis_connection,
+            job_monitoring_interval=1,
+            **kwargs
+        )
+        worker.grace_period = 0
+        worker.work(burst=True)
+        return worker
+
+    def enqueue(self, func, **kwargs):
+        return self.queue.enqueue(func, **kwargs)
+
+    def results(self, jobs):
+        for job in jobs:
+            job.refresh()
+        return [job.result for job in jobs]
+
+    def test_runs_jobs_in_a_long_lived_work_horse(self):
+        jobs = [self.enqueue(getpid) for _ in range(5)]
+
+        self.work()
+
+        pids = set(self.results(jobs))
+        self.assertEqual(1, len(pids))
+        self.assertNotIn(os.getpid(), pids)
+
+    def test_replaces_work_horse_after_max_jobs(self):
+        jobs = [self.enqueue(getpid) for _ in range(4)]
+
+        self.work(max_jobs_per_horse=2)
+
+        first, second, third, fourth = self.results(jobs)
+        self.assertEqual(first, second)
+        self.assertEqual(third, fourth)
+        self.assertNotEqual(first, third)
+
+    def test_replaces_work_horse_over_max_memory(self):
+        jobs = [self.enqueue(getpid) for _ in range(2)]
+
+        self.work(max_horse_memory=1)
+
+        first, second = self.results(jobs)
+        self.assertNotEqual(first, second)
+
+    def test_keeps_work_horse_after_failed_job(self):
+        before = self.enqueue(getpid)
+        failed = self.enqueue(fail)
+        after = self.enqueue(getpid)
+
+        self.work()
+
+        self.assertEqual(JobStatus.FAILED, failed.get_status())
+        self.assertEqual(*self.results([before, after]))
+
+    def test_kills_work_horse_that_exceeds_the_time_limit(self):
+        before = self.enqueue(getpid)
+        stuck = self.enqueue(hang, job_timeout=1)
+        after = self.enqueue(getpid)
+
+        self.work()
+
+        self.assertEqual(JobStatus.FAILED, stuck.get_status())
+        self.assertEqual(JobStatus.FINISHED, after.get_status())
+        self.assertNotEqual(*self.results([before, after]))
+
+    def test_cancels_running_job(self):
+        running = self.enqueue(interruptible_hang)
+        after = self.enqueue(getpid)
+
+        def cancel():
+            while running.get_status() != JobStatus.STARTED:
+                time.sleep(0.05)
+            job = Job.fetch(running.id, connection=rq_redis_connection)
+            job.meta["cancelled"] = True
+            job.save_meta()
+
+        canceller = threading.Thread(target=cancel)
+        canceller.start()
+        started = time.time()
+        self.work()
+        canceller.join()
+
+        self.assertLess(time.time() - started, 10)
+        self.assertEqual(JobStatus.FAILED, running.get_status())
+        self.assertEqual(JobStatus.FINISHED, after.get_status())
+
+
+class TestMemoryLimit(TestCase):
+    worker_class = HardLimitingWorker
+
+    def setUp(self):
+        rq_redis_connection.flushdb()
+        self.queue = FairQueue("memory", connection=rq_redis_connection)
+        self.signal_handlers = {
+            signum: signal.getsignal(signum)
+            for signum in (signal.SIGINT, signal.SIGTERM)
+        }
+
+    def tearDown(self):
+        for signum, handler in self.signal_handlers.items():
+            signal.signal(signum, handler)
+        rq_redis_connection.flushdb()
+
+    def work(self):
+        worker = self.worker_class(
+            [self.queue], connection=rq_redis_connection, job_monitoring_interval=1
+        )
+        started = time.time()
+        worker.work(burst=True)
+        return time.time() - started
+
+    @patch("redash.settings.WORKER_MEMORY_LIMIT", 50)
+    def test_interrupts_jobs_over_the_memory_limit(self):
+        job = self.queue.enqueue(use_memory, 60)
+        after = self.queue.enqueue(getpid)
+
+        self.assertLess(self.work(), 15)
+        self.assertEqual(JobStatus.FAILED, job.get_status())
+        job.refresh()
+        self.assertIn("MemoryLimitExceeded", job.exc_info)
+        self.assertEqual(JobStatus.FINISHED, after.get_status())
+
+    @patch("redash.settings.WORKER_MEMORY_LIMIT", 50)
+    def test_kills_work_horse_over_the_hard_memory_limit(self):
+        job = self.queue.enqueue(use_memory, 100, ignore_limit=True)
+        after = self.queue.enqueue(getpid)
+
+        self.assertLess(self.work(), 15)
+        self.assertEqual(JobStatus.FAILED, job.get_status())
+        job.refresh()
+        self.assertIn("killed for using over 75MB of memory", job.exc_info)
+        self.assertEqual(JobStatus.FINISHED, after.get_status())
+
+    def test_uses_the_memory_limit_of_the_data_source(self):
+        job = self.queue.enqueue(use_memory, 60, meta={"memory_limit": 50})
+
+        self.assertLess(self.work(), 15)
+        self.assertEqual(JobStatus.FAILED, job.get_status())
+
+    @patch("redash.settings.WORKER_QUEUE_MEMORY_LIMITS", {"memory": 50})
+    def test_uses_the_memory_limit_of_the_queue(self):
+        job = self.queue.enqueue(use_memory, 60)
+
+        self.assertLess(self.work(), 15)
+        self.assertEqual(JobStatus.FAILED, job.get_status())
+
+
+class TestPreforkMemoryLimit(TestMemoryLimit):
+    worker_class = PreforkWorker
+
+
+class SlowHandler(BaseHTTPRequestHandler):
+    """Responds to /<seconds> with a row, that many seconds later."""
+
+    def do_GET(self):
+        time.sleep(float(self.path.strip("/").split("?")[0]))
+        body = json_dumps(
+            {"columns": [{"name": "a", "type": TYPE_INTEGER}], "rows": [{"a": 1}]}
+        ).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestAsyncWorker(BaseTestCase):
+    def setUp(self):
+        super(TestAsyncWorker, self).setUp()
+        rq_redis_connection.flushdb()
+        self.queue = FairQueue("http_queries", connection=rq_redis_connection)
+        self.signal_handlers = {
+            signum: signal.getsignal(signum)
+            for signum in (signal.SIGINT, signal.SIGTERM)
+        }
+        self.server = http_server(SlowHandler)
+        self.data_source = self.factory.create_data_source(
+            type="url", options={"url": self.server.__enter__() + "/"}
+        )
+
+    def tearDown(self):
+        self.server.__exit__(None, None, None)
+        for signum, handler in self.signal_handlers.items():
+            signal.signal(signum, handler)
+        rq_redis_connection.flushdb()
+        super(TestAsyncWorker, self).tearDown()
+
+    def work(self, **kwargs):
+        worker = AsyncWorker(
+            [self.queue],
+            connection=rq_redis_connection,
+            job_monitoring_interval=1,
+            **kwargs
+        )
+        worker.grace_period = 1
+        started = time.time()
+        worker.work(burst=True)
+        return time.time() - started
+
+    def enqueue_query(self, query, **kwargs):
+        return self.queue.enqueue(
+            execute_query, query, self.data_source.id, {}, **kwargs
+        )
+
+    def test_runs_http_queries_concurrently(self):
+        jobs = [self.enqueue_query("1?{}".format(i)) for i in range(50)]
+
+        elapsed = self.work(concurrency=50)
+
+        self.assertLess(elapsed, 10)
+        for job in jobs:
+            job.refresh()
+            self.assertEqual(JobStatus.FINISHED, job.get_status())
+            query_result = models.QueryResult.query.get(job.result)
+            self.assertEqual([{"a": 1}], query_result.data["rows"])
+
+    def test_gives_each_job_its_own_session(self):
+        sessions = []
+        finish = QueryExecutor._finish
+
+        def record_session(executor, *args):
+            sessions.append(models.db.session())
+            return finish(executor, *args)
+
+        jobs = [self.enqueue_query("0.5?{}".format(i)) for i in range(3)]
+        with patch.object(
+            QueryExecutor, "_finish", autospec=True, side_effect=record_session
+        ):
+            self.work(concurrency=3)
+
+        self.assertEqual(3, len(set(map(id, sessions))))
+        self.assertNotIn(models.db.session(), sessions)
+        for job in jobs:
+            self.assertEqual(JobStatus.FINISHED, job.get_status())
+
+    def test_fails_queries_over_the_time_limit(self):
+        job = self.enqueue_query("10", job_timeout=1)
+
+        elapsed = self.work()
+
+        self.assertLess(elapsed, 5)
+        job.refresh()
+        self.assertIsInstance(job.result, QueryExecutionError)
+        self.assertEqual(TIMEOUT_MESSAGE, str(job.result))
+
+    def test_cancels_running_query(self):
+        running = self.enqueue_query("10")
+        after = self.enqueue_query("0")
+
+        def cancel():
+            while running.get_status() != JobStatus.STARTED:
+                time.sleep(0.05)
+            job = Job.fetch(running.id, connection=rq_redis_connection)
+            job.meta["cancelled"] = True
+            job.save_meta()
+
+        canceller = threading.Thread(target=cancel)
+        canceller.start()
+        elapsed = self.work()
+        canceller.join()
+
+        self.assertLess(elapsed, 5)
+        self.assertEqual(JobStatus.FAILED, running.get_status())
+        self.assertEqual(JobStatus.FINISHED, after.get_status())
+
+    def test_runs_other_jobs_in_threads(self):
+        job = self.queue.enqueue(get_thread_ident)
+
+        self.work()
+
+        job.refresh()
+        self.assertEqual(JobStatus.FINISHED, job.get_status())
+        self.assertNotEqual(threading.get_ident(), job.result)
+
+    def test_finishes_jobs_outside_of_the_event_loop(self):
+        threads = []
+
+        def record_thread(handler):
+            def record(*args, **kwargs):
+                threads.append(threading.get_ident())
+                return handler(*args, **kwargs)
+
+            return record
+
+        succeeding = self.enqueue_query("0")
+        failing = self.queue.enqueue(fail)
+        with patch.object(
+            AsyncWorker,
+            "handle_job_success",
+            autospec=True,
+            side_effect=record_thread(AsyncWorker.handle_job_success),
+        ), patch.object(
+            AsyncWorker,
+            "handle_job_failure",
+            autospec=True,
+            side_effect=record_thread(AsyncWorker.handle_job_failure),
+        ):
+            self.work(concurrency=2)
+
+        self.assertEqual(2, len(threads))
+        self.assertNotIn(threading.get_ident(), threads)
+        self.assertEqual(JobStatus.FINISHED, succeeding.get_status())
+        self.assertEqual(JobStatus.FAILED, failing.get_status())
+
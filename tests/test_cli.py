@@ -6,7 +6,8 @@ from tests import BaseTestCase
 from redash.utils.configuration import ConfigurationContainer
 from redash.query_runner import query_runners
 from redash.cli import manager
-from redash.models import DataSource, Group, Organization, User, db
+from redash.models import DataSource, Group, Organization, QueryResult, User, db
+from redash.utils import columnar, json_dumps, json_loads
 
 
 class DataSourceCommandTests(BaseTestCase):
@@ -575,3 +576,33 @@ class UserCommandTests(BaseTestCase):
         self.assertEqual(result.exit_code, 0)
         db.session.add(u)
         self.assertEqual(u.group_ids, [u.org.default_group.id, u.org.admin_group.id])
+
+
+class DatabaseCommandTests(BaseTestCase):
+    def test_convert_query_results(self):
+        result_data = {"columns": [], "rows": [{"a": 1}, {"a": 2}]}
+        qr = self.factory.create_query_result(data=json_dumps(result_data))
+        empty = self.factory.create_query_result(data="")
+        db.session.commit()
+        qr_id, empty_id = qr.id, empty.id
+
+        runner = CliRunner()
+        result = runner.invoke(
+            manager, ["database", "convert_query_results", "--batch-size", "1"]
+        )
+        self.assertFalse(result.exception)
+        self.assertEqual(result.exit_code, 0)
+
+        db.session.expire_all()
+        stored = QueryResult.query.get(qr_id)._data
+        self.assertTrue(columnar.is_columnar(stored))
+        self.assertEqual(columnar.decode(stored), result_data)
+        self.assertEqual(QueryResult.query.get(empty_id)._data, "")
+
+        result = runner.invoke(
+            manager, ["database", "convert_query_results", "--to", "json"]
+        )
+        self.assertFalse(result.exception)
+
+        db.session.expire_all()
+        self.assertEqual(json_loads(QueryResult.query.get(qr_id)._data), result_data)
@@ -3,6 +3,7 @@ import datetime
 from unittest import TestCase
 
 import pytz
+from mock import patch
 from dateutil.parser import parse as date_parse
 from tests import BaseTestCase
 
@@ -158,6 +159,27 @@ class ShouldScheduleNextTest(TestCase):
         )
 
 
+class NextScheduledRunTest(TestCase):
+    def test_matches_should_schedule_next(self):
+        previous = utcnow() - datetime.timedelta(days=2)
+        for schedule in [
+            ("3600", None, None, 0),
+            ("3600", None, None, 3),
+            ("86400", "23:59", None, 0),
+            ("604800", "01:15", "Monday", 1),
+        ]:
+            next_run = models.next_scheduled_run(previous, *schedule)
+            self.assertFalse(models.should_schedule_next(previous, next_run, *schedule))
+            self.assertTrue(
+                models.should_schedule_next(
+                    previous, next_run + datetime.timedelta(microseconds=1), *schedule
+                )
+            )
+
+    def test_never_runs_after_too_many_failures(self):
+        self.assertIsNone(models.next_scheduled_run(utcnow(), "3600", failures=10000))
+
+
 class QueryOutdatedQueriesTest(BaseTestCase):
     def schedule(self, **kwargs):
         schedule = {"interval": None, "time": None, "until": None, "day_of_week": None}
@@ -334,6 +356,187 @@ class QueryOutdatedQueriesTest(BaseTestCase):
         queries = models.Query.outdated_queries()
         self.assertNotIn(query, queries)
 
+    def test_indexes_next_run_of_queries_that_arent_due(self):
+        query = self.create_scheduled_query(interval="3600")
+        self.fake_previous_execution(query, minutes=30)
+
+        self.assertNotIn(query, models.Query.outdated_queries())
+
+        next_run = query.latest_query_data.retrieved_at + datetime.timedelta(hours=1)
+        self.assertAlmostEqual(
+            next_run.timestamp(),
+            redis_connection.zscore(models.ScheduledQueriesNextRuns.KEY_NAME, query.id),
+        )
+        self.assertNotIn(query.id, models.scheduled_queries_next_runs.due(utcnow()))
+        self.assertIn(
+            query.id,
+            models.scheduled_queries_next_runs.due(
+                next_run + datetime.timedelta(seconds=1)
+            ),
+        )
+
+    def test_reevaluates_queries_when_their_schedule_changes(self):
+        query = self.create_scheduled_query(interval="3600")
+        self.fake_previous_execution(query, minutes=30)
+        self.assertNotIn(query, models.Query.outdated_queries())
+
+        query.schedule = self.schedule(interval="60")
+        db.session.commit()
+
+        self.assertIn(query, models.Query.outdated_queries())
+
+    def test_reevaluates_queries_once_their_changes_are_committed(self):
+        query = self.create_scheduled_query(interval="3600")
+        self.fake_previous_execution(query, minutes=30)
+        db.session.commit()
+        self.assertNotIn(query, models.Query.outdated_queries())
+
+        query.schedule = self.schedule(interval="60")
+        db.session.flush()
+        self.assertNotIn(query.id, models.scheduled_queries_next_runs.due(utcnow()))
+
+        db.session.rollback()
+        self.assertNotIn(query.id, models.scheduled_queries_next_runs.due(utcnow()))
+
+        query.schedule = self.schedule(interval="60")
+        db.session.commit()
+        self.assertIn(query.id, models.scheduled_queries_next_runs.due(utcnow()))
+
+    def test_reevaluates_queries_when_they_execute(self):
+        query = self.create_scheduled_query(interval="60")
+        self.fake_previous_execution(query, minutes=10)
+        self.assertIn(query, models.Query.outdated_queries())
+
+        models.scheduled_queries_executions.update(query.id)
+
+        self.assertNotIn(query, models.Query.outdated_queries())
+        self.assertNotIn(query.id, models.scheduled_queries_next_runs.due(utcnow()))
+
+    def test_drops_unscheduled_queries_from_index(self):
+        query = self.create_scheduled_query(interval="60")
+        self.fake_previous_execution(query, minutes=10)
+        self.assertIn(query, models.Query.outdated_queries())
+
+        query.schedule = None
+        db.session.commit()
+
+        self.assertIsNone(
+            redis_connection.zscore(models.ScheduledQueriesNextRuns.KEY_NAME, query.id)
+        )
+
+    def test_rebuilds_index_when_its_missing(self):
+        query = self.create_scheduled_query(interval="60")
+        self.fake_previous_execution(query, minutes=10)
+        db.session.flush()
+        redis_connection.flushdb()
+
+        self.assertIn(query, models.Query.outdated_queries())
+
+
+class QueryAdaptiveRefreshTest(BaseTestCase):
+    def setUp(self):
+        super(QueryAdaptiveRefreshTest, self).setUp()
+        self.factory.org.set_setting("adaptive_refresh", True)
+        self.query = self.factory.create_query(
+            schedule={
+                "interval": "3600",
+                "time": None,
+                "until": None,
+                "day_of_week": None,
+            }
+        )
+        self.query.latest_query_data = self.factory.create_query_result(
+            retrieved_at=utcnow() - datetime.timedelta(hours=2),
+            query_text=self.query.query_text,
+            query_hash=self.query.query_hash,
+            runtime=12.5,
+        )
+        # Reads are tracked since long before the query went cold.
+        redis_connection.set(
+            models.QueryResultReads.SINCE_KEY_NAME,
+            calendar.timegm((utcnow() - datetime.timedelta(days=30)).timetuple()),
+        )
+
+    def read(self, **kwargs):
+        redis_connection.hset(
+            models.QueryResultReads.KEY_NAME,
+            "{}:{}".format(self.query.data_source_id, self.query.query_hash),
+            calendar.timegm((utcnow() - datetime.timedelta(**kwargs)).timetuple()),
+        )
+
+    def test_refreshes_queries_that_are_read(self):
+        self.read(days=1)
+
+        self.assertIn(self.query, models.Query.outdated_queries())
+
+    def test_stretches_interval_of_cold_queries(self):
+        self.read(days=20)
+
+        self.assertNotIn(self.query, models.Query.outdated_queries())
+        self.assertEqual(
+            "1", redis_connection.hget("redash:status", "cold_queries_skipped")
+        )
+        self.assertEqual(
+            12.5,
+            float(redis_connection.hget("redash:status", "cold_queries_runtime_saved")),
+        )
+
+        # It's refreshed 4 times less often.
+        self.query.latest_query_data.retrieved_at = utcnow() - datetime.timedelta(
+            hours=4, minutes=1
+        )
+        models.scheduled_queries_next_runs.invalidate(self.query.id)
+        self.assertIn(self.query, models.Query.outdated_queries())
+
+    def test_checks_cold_queries_again_after_their_interval(self):
+        self.read(days=20)
+        models.Query.outdated_queries()
+
+        next_run = redis_connection.zscore(
+            models.ScheduledQueriesNextRuns.KEY_NAME, self.query.id
+        )
+        self.assertAlmostEqual(
+            calendar.timegm(utcnow().timetuple()) + 3600, next_run, delta=5
+        )
+
+    def test_refreshes_cold_queries_once_read(self):
+        self.read(days=20)
+        models.Query.outdated_queries()
+
+        models.query_result_reads.touch(
+            self.query.data_source_id, self.query.query_hash
+        )
+
+        self.assertIn(self.query, models.Query.outdated_queries())
+
+    def test_records_reads_once_a_minute_at_most(self):
+        reads = models.query_result_reads
+        reads.touch(self.query.data_source_id, self.query.query_hash)
+        self.read(days=20)
+        reads.touch(self.query.data_source_id, self.query.query_hash)
+
+        self.assertNotIn(self.query, models.Query.outdated_queries())
+
+    def test_pauses_queries_nobody_reads(self):
+        self.read(days=20)
+        self.query.latest_query_data.retrieved_at = utcnow() - datetime.timedelta(
+            days=1
+        )
+
+        self.assertIn(self.query, models.Query.outdated_queries())
+
+        models.scheduled_queries_next_runs.invalidate(self.query.id)
+        with patch(
+            "redash.settings.ADAPTIVE_REFRESH_PAUSE_AFTER", 19 * 24 * 60 * 60
+        ):
+            self.assertNotIn(self.query, models.Query.outdated_queries())
+
+    def test_ignores_reads_of_organizations_without_adaptive_refresh(self):
+        self.factory.org.set_setting("adaptive_refresh", False)
+        self.read(days=20)
+
+        self.assertIn(self.query, models.Query.outdated_queries())
+
 
 class QueryArchiveTest(BaseTestCase):
     def test_archive_query_sets_flag(self):
@@ -0,0 +1,104 @@
+from unittest import TestCase
+
+import mock
+from redis import RedisError
+
+from redash.result_cache import LRUCache, QueryResultCache, query_result_cache
+
+
+class TestLRUCache(TestCase):
+    def test_evicts_least_recently_used_by_size(self):
+        cache = LRUCache(max_size=10)
+        cache.set("a", b"aaaa")
+        cache.set("b", b"bbbb")
+        cache.get("a")
+
+        self.assertEqual(1, cache.set("c", b"cccc"))
+        self.assertEqual(b"aaaa", cache.get("a"))
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(8, cache.size)
+
+    def test_ignores_values_larger_than_the_cache(self):
+        cache = LRUCache(max_size=10)
+        cache.set("a", b"aaaa")
+        cache.set("b", b"b" * 11)
+
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(b"aaaa", cache.get("a"))
+
+    def test_replacing_a_value_updates_size(self):
+        cache = LRUCache(max_size=10)
+        cache.set("a", b"aaaa")
+        cache.set("a", b"aa")
+
+        self.assertEqual(2, cache.size)
+        self.assertEqual(1, len(cache))
+
+
+class TestQueryResultCache(TestCase):
+    def setUp(self):
+        self.cache = QueryResultCache(
+            query_result_cache.redis,
+            memory_size=1024,
+            max_item_size=512,
+            ttl=60,
+            key_prefix="test_query_result_payload",
+        )
+
+    def tearDown(self):
+        for key in self.cache.redis.scan_iter("test_query_result_payload:*"):
+            self.cache.redis.delete(key)
+
+    def test_get_or_set_builds_payload_once(self):
+        build = mock.Mock(return_value=b'{"query_result": {}}')
+
+        first = self.cache.get_or_set(1, build)
+        second = self.cache.get_or_set(1, build)
+
+        build.assert_called_once_with()
+        self.assertEqual(first.body(), second.body())
+        self.assertEqual((b'{"query_result": {}}', None), second.body())
+
+    def test_falls_back_to_redis(self):
+        self.cache.set(1, b"payload")
+        self.cache.memory.clear()
+
+        with mock.patch("redash.result_cache.statsd_client") as statsd_client:
+            self.assertEqual(b"payload", self.cache.get(1).body()[0])
+            self.assertEqual(b"payload", self.cache.get(1).body()[0])
+
+        statsd_client.incr.assert_has_calls(
+            [
+                mock.call("query_result_cache.redis.hit"),
+                mock.call("query_result_cache.memory.hit"),
+            ]
+        )
+
+    def test_reports_misses(self):
+        with mock.patch("redash.result_cache.statsd_client") as statsd_client:
+            self.assertIsNone(self.cache.get(1))
+
+        statsd_client.incr.assert_called_once_with("query_result_cache.miss")
+
+    def test_compressed_payload(self):
+        payload = self.cache.set(1, b"x" * 100)
+
+        body, encoding = payload.body(accept_gzip=True)
+        self.assertEqual("gzip", encoding)
+        self.assertLess(len(body), 100)
+        self.assertEqual((b"x" * 100, None), payload.body())
+
+    def test_doesnt_cache_large_payloads(self):
+        self.cache.compress = False
+        self.cache.set(1, b"x" * 1000)
+
+        self.assertIsNone(self.cache.get(1))
+
+    def test_treats_redis_errors_as_misses(self):
+        redis = mock.Mock()
+        redis.get.side_effect = RedisError
+        redis.set.side_effect = RedisError
+        cache = QueryResultCache(redis, memory_size=1024, max_item_size=512, ttl=60)
+
+        self.assertEqual(b"payload", cache.get_or_set(1, lambda: b"payload").body()[0])
+        self.assertIsNone(QueryResultCache(redis, 1024, 512, 60).get(1))
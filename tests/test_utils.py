@@ -1,12 +1,22 @@
+import datetime
+import decimal
+import uuid
 from collections import namedtuple
-from unittest import TestCase
+from unittest import TestCase, skipIf
+
+import mock
+import pytz
+import simplejson
 
 from redash.utils import (
+    JSONEncoder,
     build_url,
     collect_parameters_from_request,
     filter_none,
     json_dumps,
+    json_loads,
     generate_token,
+    orjson,
 )
 
 
@@ -74,6 +84,91 @@ class TestJsonDumps(TestCase):
         self.assertEqual(json_dumps(memoryview(b"test")), '"74657374"')
 
 
+class CustomEncoder(JSONEncoder):
+    def default(self, o):
+        if isinstance(o, set):
+            return sorted(o)
+        return super(CustomEncoder, self).default(o)
+
+
+@skipIf(orjson is None, "orjson isn't installed")
+@mock.patch("redash.utils.use_orjson", True)
+class TestOrjsonBackend(TestCase):
+    payload = {
+        "columns": [{"name": "id", "type": "integer"}],
+        "rows": [
+            {
+                "id": 1,
+                "amount": decimal.Decimal("10.50"),
+                "ratio": 0.1,
+                "name": "Тест",
+                "created_at": datetime.datetime(2019, 5, 26, 12, 39, 23, 26123, pytz.utc),
+                "local": datetime.datetime(2019, 5, 26, 12, 39, 23),
+                "day": datetime.date(2019, 5, 26),
+                "time": datetime.time(12, 39, 23, 26123),
+                "duration": datetime.timedelta(hours=1),
+                "uuid": uuid.UUID(int=1),
+                "binary": b"test",
+                "empty": None,
+                "flag": True,
+                7: "non string key",
+            }
+        ],
+    }
+
+    def simplejson_dumps(self, data, **kwargs):
+        kwargs.setdefault("cls", JSONEncoder)
+        return simplejson.dumps(data, encoding=None, **kwargs)
+
+    def test_matches_simplejson(self):
+        with mock.patch("redash.utils.orjson.dumps", wraps=orjson.dumps) as dumps:
+            serialized = json_dumps(self.payload, ignore_nan=True)
+
+        dumps.assert_called_once()
+        self.assertEqual(
+            simplejson.loads(self.simplejson_dumps(self.payload, ignore_nan=True)),
+            simplejson.loads(serialized),
+        )
+        if hasattr(orjson, "Fragment"):
+            self.assertIn('"amount":10.50', serialized)
+        self.assertIn('"created_at":"2019-05-26T12:39:23.026Z"', serialized)
+        self.assertIn('"time":"12:39:23.026"', serialized)
+
+    def test_ignores_nan(self):
+        self.assertEqual(
+            json_dumps([float("nan"), float("inf")], ignore_nan=True), "[null,null]"
+        )
+
+    def test_keeps_nan_without_ignore_nan(self):
+        self.assertEqual(json_dumps([float("nan")]), "[NaN]")
+
+    def test_uses_encoder_subclasses(self):
+        self.assertEqual(
+            json_dumps({"s": {2, 1}}, cls=CustomEncoder, ignore_nan=True), '{"s":[1,2]}'
+        )
+
+    def test_falls_back_to_simplejson(self):
+        Point = namedtuple("Point", ["x", "y"])
+        data = {"big": 2 ** 70, "point": Point(1, 2)}
+
+        self.assertEqual(
+            json_dumps(data, ignore_nan=True),
+            self.simplejson_dumps(data, ignore_nan=True),
+        )
+        self.assertEqual(json_dumps(data, indent=2), self.simplejson_dumps(data, indent=2))
+        self.assertRaises(TypeError, json_dumps, object(), ignore_nan=True)
+
+    def test_only_serializes_results_with_orjson(self):
+        self.assertEqual(json_dumps({"a": [1, "b"]}), '{"a": [1, "b"]}')
+
+    def test_loads(self):
+        self.assertEqual(json_loads('{"a": [1, 2.5, "b"]}'), {"a": [1, 2.5, "b"]})
+        self.assertEqual(json_loads(b'{"a": null}'), {"a": None})
+        self.assertEqual(json_loads('{"a": NaN}')["a"].__class__, float)
+        self.assertEqual(json_loads('{"a": %d}' % 2 ** 70)["a"], 2 ** 70)
+        self.assertRaises(ValueError, json_loads, "{")
+
+
 class TestGenerateToken(TestCase):
     def test_format(self):
         token = generate_token(40)
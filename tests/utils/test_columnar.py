@@ -0,0 +1,78 @@
+from unittest import TestCase
+
+from redash.utils import columnar, json_dumps
+
+
+data = {
+    "columns": [
+        {"name": "id", "friendly_name": "id", "type": "integer"},
+        {"name": "name", "friendly_name": "name", "type": "string"},
+        {"name": "created_at", "friendly_name": "created_at", "type": "datetime"},
+    ],
+    "rows": [
+        {"id": 1, "name": "Arik", "created_at": "2019-05-26T12:39:23.026Z"},
+        {"id": 2, "name": None, "created_at": None},
+        {"id": 3, "name": "Тест", "created_at": "2019-05-27T00:00:00Z"},
+    ],
+}
+
+
+class TestColumnarEncoding(TestCase):
+    def test_round_trips_query_results(self):
+        encoded = columnar.encode(data)
+        self.assertTrue(columnar.is_columnar(encoded))
+        self.assertEqual(columnar.decode(encoded), data)
+
+    def test_round_trips_with_every_available_codec(self):
+        for codec in columnar.codecs:
+            encoded = columnar.encode(data, codec)
+            self.assertTrue(encoded.startswith("{}{}:".format(columnar.MAGIC, codec)))
+            self.assertEqual(columnar.decode(encoded), data)
+
+    def test_decodes_rows_lazily(self):
+        decoded = columnar.decode(columnar.encode(data), lazy_rows=True)
+        self.assertNotIsInstance(decoded["rows"], list)
+        self.assertEqual(list(decoded["rows"]), data["rows"])
+
+    def test_keeps_key_order(self):
+        reordered = {"rows": data["rows"], "columns": data["columns"]}
+        decoded = columnar.decode(columnar.encode(reordered))
+        self.assertEqual(json_dumps(decoded), json_dumps(reordered))
+
+    def test_round_trips_rows_with_different_keys(self):
+        ragged = {
+            "columns": data["columns"],
+            "rows": [{"id": 1}, {"id": 2, "name": "Arik"}, {"name": "Arik", "id": 3}],
+        }
+        decoded = columnar.decode(columnar.encode(ragged))
+        self.assertEqual(json_dumps(decoded), json_dumps(ragged))
+
+    def test_round_trips_empty_results(self):
+        for value in [
+            {"columns": [], "rows": []},
+            {"columns": [], "rows": [{}, {}]},
+            {"columns": []},
+            {},
+        ]:
+            self.assertEqual(columnar.decode(columnar.encode(value)), value)
+
+    def test_round_trips_additional_result_sets(self):
+        value = dict(data, data_ex=[{"name": "sub", "data": data}])
+        self.assertEqual(columnar.decode(columnar.encode(value)), value)
+
+    def test_is_smaller_than_json(self):
+        rows = [{"id": i, "name": "name {}".format(i % 10)} for i in range(1000)]
+        value = {"columns": data["columns"][:2], "rows": rows}
+        self.assertLess(len(columnar.encode(value)), len(json_dumps(value)) / 4)
+
+    def test_loads_handles_both_formats(self):
+        self.assertEqual(columnar.loads(json_dumps(data)), data)
+        self.assertEqual(columnar.loads(columnar.encode(data)), data)
+
+    def test_rejects_unknown_codecs(self):
+        payload = columnar.encode(data).split(":", 2)[2]
+        with self.assertRaises(columnar.ColumnarFormatError):
+            columnar.decode("{}snappy:{}".format(columnar.MAGIC, payload))
+
+        with self.assertRaises(columnar.ColumnarFormatError):
+            columnar.encode(data, "snappy")